@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        import api.signals  # noqa: F401
+        from core.db import check_connections
+        from core.routers import install_latency_tracking
+
+        if settings.DB_CONN_HEALTH_CHECKS:
+            request_started.connect(check_connections)
+        if settings.DB_REPLICA_SELECTION == 'least_latency':
+            connection_created.connect(install_latency_tracking)
@@ -0,0 +1,90 @@
+import base64
+import statistics
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+import numpy as np
+from django.core.handlers.wsgi import WSGIHandler
+from PIL import Image
+
+from api.throttling import THROTTLE_BUCKETS, LocalBucketStore, bucket_stores
+
+
+def wsgi_request(handler: WSGIHandler, path: str, method: str = 'GET',
+                 query_string: str = '', headers: dict = None) -> tuple:
+    """
+    Запрос через настоящий WSGI-обработчик, в отличие от тестового
+    клиента срабатывают request_started/request_finished.
+    Возвращает (статус, заголовки, тело).
+    """
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': method,
+               'QUERY_STRING': query_string, 'wsgi.input': BytesIO()}
+    for name, value in (headers or {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    setup_testing_defaults(environ)
+    result = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        result['status'] = int(status.split()[0])
+        result['headers'] = dict(response_headers)
+
+    response = handler(environ, start_response)
+    try:
+        body = b''.join(response)
+    finally:
+        response.close()
+    return result['status'], result['headers'], body
+
+
+def measure(func, repeat: int, clock=time.perf_counter) -> dict:
+    """
+    Распределение времени выполнения func в миллисекундах.
+    clock=time.process_time считает процессорное время.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = clock()
+        func()
+        timings.append((clock() - start) * 1000)
+    timings.sort()
+    return {
+        'p50': statistics.median(timings),
+        'p95': timings[max(int(len(timings) * 0.95) - 1, 0)],
+        'p99': timings[max(int(len(timings) * 0.99) - 1, 0)],
+        'max': timings[-1],
+    }
+
+
+def format_stats(name: str, stats: dict) -> str:
+    values = ' '.join(f'{key}={value:.3f}ms' for key, value in stats.items())
+    return f'{name:<32} {values}'
+
+
+@contextmanager
+def unlimited_throttling():
+    """
+    Корзины токенов, которые не закончатся за время замеров.
+    Корзины создаются заново: запросы до замеров их не опустошат.
+    """
+    buckets, stores = dict(THROTTLE_BUCKETS), dict(bucket_stores)
+    for scope in THROTTLE_BUCKETS:
+        THROTTLE_BUCKETS[scope] = {'capacity': 10 ** 9, 'rate': 1}
+        bucket_stores[scope] = LocalBucketStore()
+    try:
+        yield
+    finally:
+        THROTTLE_BUCKETS.update(buckets)
+        bucket_stores.update(stores)
+
+
+def image_data_uri(width: int = 640, height: int = 480,
+                   seed: int = 0) -> str:
+    """PNG со случайным шумом, как его присылает фронтенд."""
+    pixels = np.random.default_rng(seed).integers(
+        0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
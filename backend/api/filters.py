@@ -2,15 +2,47 @@ from django_filters import rest_framework as django_filters
 from rest_framework import filters
 
 from recipes.models import Recipe, Tag
+from recipes.normalize import normalize_name
 
 
 class IngredientSearch(filters.BaseFilterBackend):
-    """Поиск по ингредиентам."""
+    """Поиск по началу названия без учета регистра и ё/е."""
 
     def filter_queryset(self, request, queryset, view):
         ingredient = request.query_params.get('name')
         if ingredient:
-            queryset = queryset.filter(name__istartswith=ingredient)
+            queryset = queryset.filter(
+                normalized_name__startswith=normalize_name(ingredient))
+        return queryset
+
+
+class RecipeOrderingFilter(filters.OrderingFilter):
+    """
+    Сортировка рецептов, popular и trending берутся
+    из индексированной таблицы RecipeScore.
+    """
+    score_fields = {'popular': 'popularity', 'trending': 'trending'}
+
+    def get_valid_fields(self, queryset, view, context={}):
+        return super().get_valid_fields(queryset, view, context) + [
+            (name, name) for name in self.score_fields]
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = []
+        for field in self.get_ordering(request, queryset, view) or ():
+            name = field.lstrip('-')
+            if name not in self.score_fields:
+                ordering.append(field)
+                continue
+            # Порядок совпадает с индексом (рейтинг, recipe_id),
+            # а INNER JOIN позволяет читать рецепты по индексу.
+            # Рейтинг есть у каждого рецепта, строки не теряются
+            direction = '-' if field.startswith('-') else ''
+            queryset = queryset.filter(score__isnull=False)
+            ordering += [f'{direction}score__{self.score_fields[name]}',
+                         f'{direction}score__recipe']
+        if ordering:
+            return queryset.order_by(*ordering)
         return queryset
 
 
@@ -24,6 +56,12 @@ class RecipeFilterSet(django_filters.FilterSet):
         field_name='recipe_tag__tag__slug',
         to_field_name='slug',
         queryset=Tag.objects.all())
+    min_calories = django_filters.NumberFilter(
+        field_name='calories', lookup_expr='gte')
+    max_calories = django_filters.NumberFilter(
+        field_name='calories', lookup_expr='lte')
+    max_cost = django_filters.NumberFilter(
+        field_name='cost', lookup_expr='lte')
 
     class Meta:
         model = Recipe
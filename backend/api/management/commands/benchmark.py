@@ -0,0 +1,370 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.benchmark import (format_stats, image_data_uri, measure,
+                           unlimited_throttling, wsgi_request)
+from api.query_budget import recipe_data, seed
+from api.throttling import CacheBucketStore, LocalBucketStore
+from api.views import TagListRetrieveViewSet
+from core.compression import ENCODINGS
+from recipes.dedup import DEDUP_PREFIX, MIN_TYPO_LENGTH, find_duplicates
+from recipes.deletion import delete_users
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeScore,
+                            ShoppingCart, Tag)
+from recipes.scores import SCORE_WEIGHTS
+from recipes.units import as_number, get_unit_graph, round_amounts
+from users.models import Follow, User
+
+
+class Command(BaseCommand):
+    help = 'Замеры производительности API на текущей базе данных.'
+    scenarios = ('connections', 'throttle', 'compression', 'uploads',
+                 'facets', 'units', 'contention', 'dedup')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--conn-max-age', type=int, default=60)
+        parser.add_argument('--max-overhead', type=float, default=0.5,
+                            help='Допустимая доля фасетов во времени '
+                                 'ответа списка (сценарий facets).')
+        parser.add_argument('--size', type=int, default=10000,
+                            help='Количеств в пакете (сценарий units), '
+                                 'названий с опечаткой (dedup).')
+        parser.add_argument('--clients', type=int, default=8,
+                            help='Одновременных клиентов (сценарий '
+                                 'contention).')
+
+    def handle(self, *args, **options):
+        with unlimited_throttling():
+            getattr(self, f'benchmark_{options["scenario"]}')(options)
+
+    def request(self, handler, path, **kwargs):
+        status, headers, body = wsgi_request(handler, path, **kwargs)
+        if status >= 400:
+            raise CommandError(f'{path}: статус {status}.')
+        return status, headers, body
+
+    def benchmark_connections(self, options):
+        """Список рецептов с новым и с постоянным соединением."""
+        handler = WSGIHandler()
+        connection = connections['default']
+        original_max_age = connection.settings_dict['CONN_MAX_AGE']
+        opened = []
+
+        def on_connection_created(sender, connection, **kwargs):
+            opened.append(connection.alias)
+
+        connection_created.connect(on_connection_created)
+        try:
+            for max_age in (0, options['conn_max_age']):
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                opened.clear()
+                stats = measure(
+                    lambda: self.request(handler, '/api/recipes/'),
+                    options['repeat'])
+                self.stdout.write(
+                    format_stats(f'CONN_MAX_AGE={max_age}', stats)
+                    + f' connections={len(opened)}')
+        finally:
+            connection_created.disconnect(on_connection_created)
+            connection.settings_dict['CONN_MAX_AGE'] = original_max_age
+            connection.close()
+
+    def benchmark_throttle(self, options):
+        """Накладные расходы корзины токенов на запрос."""
+        for name, store in (('local store', LocalBucketStore()),
+                            ('cache store', CacheBucketStore())):
+            stats = measure(
+                lambda: store.consume('benchmark', 1, 10 ** 9, 1),
+                options['repeat'])
+            self.stdout.write(format_stats(name, stats))
+
+        handler = WSGIHandler()
+        throttle_classes = TagListRetrieveViewSet.throttle_classes
+        try:
+            for name, classes in (('/api/tags/ throttled', throttle_classes),
+                                  ('/api/tags/ unthrottled', [])):
+                TagListRetrieveViewSet.throttle_classes = classes
+                stats = measure(
+                    lambda: self.request(handler, '/api/tags/'),
+                    options['repeat'])
+                self.stdout.write(format_stats(name, stats))
+        finally:
+            TagListRetrieveViewSet.throttle_classes = throttle_classes
+
+    def benchmark_compression(self, options):
+        """Размер ответа и процессорное время по кодировкам."""
+        handler = WSGIHandler()
+        paths = ['/api/tags/', '/api/ingredients/', '/api/recipes/']
+        recipe = Recipe.objects.order_by('id').first()
+        if recipe is not None:
+            paths.append(f'/api/recipes/{recipe.id}/')
+        for path in paths:
+            for encoding in ('identity',) + ENCODINGS:
+                headers = {'Accept-Encoding': encoding}
+                _, _, body = self.request(handler, path, headers=headers)
+                stats = measure(
+                    lambda: self.request(handler, path, headers=headers),
+                    options['repeat'], clock=time.process_time)
+                self.stdout.write(format_stats(f'{path} {encoding}', stats)
+                                  + f' bytes={len(body)}')
+
+    def benchmark_facets(self, options):
+        """
+        Список рецептов с фасетами и без, для всего каталога и с фильтром
+        по самому частому тегу. Кеш очищается перед каждым запросом,
+        кроме варианта cached. Варианты чередуются в каждом повторе,
+        чтобы колебания нагрузки машины делились между ними поровну,
+        время - процессорное. Доля фасетов в медиане без кеша
+        не должна превышать --max-overhead.
+        """
+        handler = WSGIHandler()
+        queries = ['']
+        tag = Tag.objects.annotate(
+            recipes_count=Count('recipetag')).order_by(
+            '-recipes_count').first()
+        if tag is not None:
+            queries.append(f'tags={tag.slug}')
+        variants = (('list', '', True),
+                    ('facets', 'facets=tags,author', True),
+                    ('cached', 'facets=tags,author', False))
+        failed = []
+        for query in queries:
+            timings = {name: [] for name, _, _ in variants}
+            for _ in range(options['repeat']):
+                for name, facets, cold in variants:
+                    query_string = '&'.join(filter(None, (query, facets)))
+                    if cold:
+                        cache.clear()
+                    start = time.process_time()
+                    self.request(handler, '/api/recipes/',
+                                 query_string=query_string)
+                    timings[name].append(
+                        (time.process_time() - start) * 1000)
+            results = {name: statistics.median(values)
+                       for name, values in timings.items()}
+            for name, facets, _ in variants:
+                query_string = '&'.join(filter(None, (query, facets)))
+                self.stdout.write(f'{"?" + query_string:<48} {name:<7} '
+                                  f'p50={results[name]:.3f}ms')
+            overhead = results['facets'] / results['list'] - 1
+            self.stdout.write(f'{"":<48} overhead={overhead:.1%} cached='
+                              f'{results["cached"] / results["list"] - 1:.1%}')
+            if overhead > options['max_overhead']:
+                failed.append(query or 'все рецепты')
+        if failed:
+            raise CommandError(
+                f'Фасеты дороже {options["max_overhead"]:.0%} списка: '
+                f'{", ".join(failed)}.')
+
+    def benchmark_uploads(self, options):
+        """
+        PATCH рецепта с одной и той же картинкой: обычное хранилище
+        и хранилище с адресацией по содержимому. Данные откатываются,
+        файлы пишутся во временный каталог.
+        """
+        field = Recipe._meta.get_field('image')
+        content_storage = field.storage
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root), \
+                transaction.atomic():
+            fixture = seed(1)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {fixture["token"]}')
+            path = f'/api/recipes/{fixture["own_recipe"]}/'
+            data = dict(recipe_data(fixture), image=image_data_uri())
+
+            def patch():
+                response = client.patch(path, data, format='json')
+                if response.status_code >= 400:
+                    raise CommandError(f'{path}: статус '
+                                       f'{response.status_code}.')
+
+            try:
+                for name, storage in (
+                        ('FileSystemStorage', FileSystemStorage()),
+                        ('ContentAddressedStorage', content_storage)):
+                    field.storage = storage
+                    files_before, bytes_before = self.disk_usage(media_root)
+                    start = time.perf_counter()
+                    stats = measure(patch, options['repeat'])
+                    rate = options['repeat'] / (time.perf_counter() - start)
+                    files, size = self.disk_usage(media_root)
+                    self.stdout.write(
+                        format_stats(name, stats)
+                        + f' rps={rate:.1f} files={files - files_before}'
+                        f' bytes={size - bytes_before}')
+            finally:
+                field.storage = content_storage
+                transaction.set_rollback(True)
+
+    def benchmark_units(self, options):
+        """
+        Перевод --size количеств в базовые единицы с округлением:
+        пакетный путь на numpy и поэлементный на Fraction. Единицы
+        берутся из ингредиентов базы, результаты путей сверяются.
+        """
+        graph = get_unit_graph()
+        units = list(Ingredient.objects.values_list(
+            'measurement_unit', flat=True).distinct()) or list(graph.units)
+        rng = np.random.default_rng(1)
+        amounts = rng.integers(1, 1000, options['size'])
+        units = [units[index]
+                 for index in rng.integers(0, len(units), options['size'])]
+
+        def batch():
+            values, _, countable = graph.to_base(amounts, units)
+            return round_amounts(values, countable)
+
+        def scalar():
+            result = []
+            for amount, name in zip(amounts.tolist(), units):
+                unit = graph.unit(name)
+                result.append(as_number(unit.round(amount * unit.factor)))
+            return result
+
+        if not np.allclose(batch(), scalar()):
+            raise CommandError('Пакетный и поэлементный пути расходятся.')
+        results = {}
+        for name, func in (('batch', batch), ('scalar', scalar)):
+            stats = measure(func, options['repeat'])
+            results[name] = stats['p50']
+            self.stdout.write(format_stats(f'{name} size={options["size"]}',
+                                           stats))
+        speedup = results['scalar'] / results['batch']
+        self.stdout.write(f'speedup={speedup:.1f}x')
+
+    def benchmark_contention(self, options):
+        """
+        --clients потоков одного пользователя одновременно добавляют
+        и удаляют избранное, корзину и подписку для одного рецепта
+        и автора. Допустимы только ответы 201/400/204/404, число
+        вставок минус число удалений должно совпасть с оставшимися
+        строками, рейтинг рецепта - с его избранным и корзиной.
+        Пользователь замера удаляется вместе со связями.
+        """
+        user = User.objects.create_user(
+            username='benchmark_contention',
+            email='benchmark_contention@example.com')
+        recipe = Recipe.objects.exclude(author=user).order_by('id').first()
+        if recipe is None:
+            user.delete()
+            raise CommandError('Нет рецептов, загрузите тестовые данные.')
+        headers = {'Authorization': f'Token {Token.objects.create(user=user)}'}
+        endpoints = (
+            ('favorite', f'/api/recipes/{recipe.id}/favorite/',
+             Favorite.objects.filter(user=user, recipe=recipe)),
+            ('shopping_cart', f'/api/recipes/{recipe.id}/shopping_cart/',
+             ShoppingCart.objects.filter(user=user, recipe=recipe)),
+            ('subscribe', f'/api/users/{recipe.author_id}/subscribe/',
+             Follow.objects.filter(user=user, author=recipe.author)))
+        score = RecipeScore.objects.filter(recipe=recipe)
+        popularity = score.values_list('popularity', flat=True).first() or 0
+        handler = WSGIHandler()
+        failed = []
+
+        def client(path, number):
+            statuses = Counter()
+            for step in range(options['repeat']):
+                method = 'POST' if (number + step) % 2 == 0 else 'DELETE'
+                status, _, _ = wsgi_request(handler, path, method=method,
+                                            headers=headers)
+                statuses[status] += 1
+            return statuses
+
+        try:
+            for name, path, links in endpoints:
+                statuses = Counter()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(options['clients']) as executor:
+                    for result in executor.map(
+                            partial(client, path), range(options['clients'])):
+                        statuses.update(result)
+                rate = sum(statuses.values()) / (time.perf_counter() - start)
+                rows = links.count()
+                self.stdout.write(
+                    f'{name:<16} ' + ' '.join(
+                        f'{status}={count}'
+                        for status, count in sorted(statuses.items()))
+                    + f' rows={rows} rps={rate:.1f}')
+                if (set(statuses) - {201, 204, 400, 404}
+                        or statuses[201] - statuses[204] != rows):
+                    failed.append(name)
+                if name in SCORE_WEIGHTS:
+                    popularity += SCORE_WEIGHTS[name] * rows
+            actual = score.values_list('popularity', flat=True).first() or 0
+            self.stdout.write(f'popularity={actual} expected={popularity}')
+            if actual != popularity:
+                failed.append('popularity')
+        finally:
+            delete_users(User.objects.filter(id=user.id))
+        if failed:
+            raise CommandError(f'Гонки записи: {", ".join(failed)}.')
+
+    @staticmethod
+    def disk_usage(root):
+        files = size = 0
+        for directory, _, names in os.walk(root):
+            files += len(names)
+            size += sum(os.path.getsize(os.path.join(directory, name))
+                        for name in names)
+        return files, size
+
+    def benchmark_dedup(self, options):
+        """
+        Поиск дубликатов в справочнике ингредиентов из базы, к которому
+        добавлено --size копий названий с опечаткой после начала блока:
+        с блоками по началу названия и без них (все пары названий
+        одной единицы). База не изменяется.
+        """
+        rows = [row for row in Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit')
+            if max(map(len, row[1].split()), default=0) > MIN_TYPO_LENGTH]
+        if not rows:
+            raise CommandError('Нет ингредиентов с длинными словами.')
+        rng = random.Random(1)
+        next_id = Ingredient.objects.order_by('-id').values_list(
+            'id', flat=True).first() + 1
+        typos = []
+        for number in range(options['size']):
+            _, name, unit = rng.choice(rows)
+            # Буква удваивается в самом длинном слове, начало блока
+            # остается прежним
+            word = max(name.split(), key=len)
+            position = name.index(word) + rng.randrange(
+                max(DEDUP_PREFIX - name.index(word), 1), len(word))
+            typos.append((next_id + number,
+                          name[:position] + name[position - 1:], unit))
+        rows = list(Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit')) + typos
+        results = {}
+        for name, prefix in (('blocked', DEDUP_PREFIX), ('all pairs', 0)):
+            start = time.perf_counter()
+            clusters = find_duplicates(rows, prefix=prefix)
+            results[name] = time.perf_counter() - start
+            found = sum(len(cluster) - 1 for cluster in clusters)
+            self.stdout.write(
+                f'{name:<10} names={len(rows)} duplicates={found} '
+                f'time={results[name]:.3f}s')
+        speedup = results['all pairs'] / results['blocked']
+        self.stdout.write(f'speedup={speedup:.1f}x')
@@ -0,0 +1,62 @@
+import statistics
+from subprocess import CalledProcessError
+
+from django.core.management import BaseCommand, CommandError
+
+from core.startup import import_time_by_package, profile_startup
+
+STAGES = ('settings', 'apps_ready', 'wsgi_ready', 'first_request',
+          'second_request')
+
+
+class Command(BaseCommand):
+    help = ('Время запуска воркера: импорт модулей по пакетам, '
+            'готовность приложений и время до первого ответа.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/tags/',
+                            help='Путь первого запроса.')
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Запусков интерпретатора для медианы.')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Сколько пакетов показать.')
+        parser.add_argument('--without-admin', action='store_true',
+                            help='Запуск с DJANGO_ADMIN_ENABLED=0.')
+
+    def handle(self, *args, **options):
+        env = {'DJANGO_ADMIN_ENABLED': '0'} if options['without_admin'] else {}
+        runs = []
+        packages = {}
+        for _ in range(options['runs']):
+            try:
+                timings, modules = profile_startup(options['path'], env)
+            except CalledProcessError as error:
+                raise CommandError(error.stderr)
+            runs.append(timings)
+            for name, own in import_time_by_package(modules).items():
+                packages.setdefault(name, []).append(own)
+        status = runs[0]['status']
+        if status >= 400:
+            raise CommandError(f'{options["path"]}: статус {status}.')
+
+        self.stdout.write('Этап (от запуска интерпретатора), медиана:')
+        for stage in STAGES[:3]:
+            value = statistics.median(run[stage] for run in runs) * 1000
+            self.stdout.write(f'  {stage:<16} {value:9.1f} ms')
+        self.stdout.write('Запросы после запуска, медиана:')
+        for stage in STAGES[3:]:
+            value = statistics.median(run[stage] for run in runs) * 1000
+            self.stdout.write(f'  {stage:<16} {value:9.1f} ms')
+        first_response = statistics.median(
+            run['wsgi_ready'] + run['first_request'] for run in runs) * 1000
+        self.stdout.write(f'  {"time_to_first":<16} {first_response:9.1f} ms')
+
+        total = sum(statistics.median(values) for values in packages.values())
+        self.stdout.write(f'Импорт модулей: {total / 1000:.1f} ms, '
+                          'по пакетам (собственное время):')
+        ranked = sorted(packages.items(),
+                        key=lambda item: statistics.median(item[1]),
+                        reverse=True)
+        for name, values in ranked[:options['top']]:
+            self.stdout.write(
+                f'  {name:<24} {statistics.median(values) / 1000:9.1f} ms')
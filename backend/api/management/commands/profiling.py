@@ -0,0 +1,32 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from core.profiling import PROFILING_SAMPLE_RATE, read_switch, write_switch
+
+
+class Command(BaseCommand):
+    help = ('Включает выборочное профилирование запросов на время '
+            'для всех воркеров, выключает его или показывает состояние.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('state', choices=('on', 'off', 'status'))
+        parser.add_argument('--rate', type=float, default=1.0,
+                            help='Доля профилируемых запросов, от 0 до 1.')
+        parser.add_argument('--minutes', type=int, default=15,
+                            help='Через сколько минут выключить.')
+
+    def handle(self, *args, **options):
+        if options['state'] == 'on':
+            if not 0 < options['rate'] <= 1:
+                raise CommandError('--rate должен быть от 0 до 1.')
+            write_switch(options['rate'], options['minutes'] * 60)
+        elif options['state'] == 'off':
+            write_switch(0, 0)
+        rate, until = read_switch()
+        if until > time.time():
+            self.stdout.write(f'Профилируется доля {rate} запросов, '
+                              f'еще {int(until - time.time())} с.')
+        else:
+            self.stdout.write(f'Переключатель выключен, доля из настроек: '
+                              f'{PROFILING_SAMPLE_RATE}.')
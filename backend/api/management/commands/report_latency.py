@@ -0,0 +1,48 @@
+import statistics
+import tempfile
+
+from django.core.management import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api.benchmark import unlimited_throttling
+from api.query_budget import BUDGETS, LARGE_SCALE, run_budgets
+from core.routers import REPLICAS
+
+
+class Command(BaseCommand):
+    help = ('Отчет о медиане времени ответа эндпоинтов API против '
+            'бюджетов. Данные создаются во временной транзакции '
+            'и откатываются. Число запросов проверяют тесты api.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Запусков для медианы времени ответа.')
+        parser.add_argument('--endpoint', action='append', default=[],
+                            help='Только эндпоинты с этим именем.')
+        parser.add_argument('--strict', action='store_true',
+                            help='Завершиться ошибкой при превышении.')
+
+    def handle(self, *args, **options):
+        if REPLICAS:
+            raise CommandError('Запустите отчет без реплик: они не видят '
+                               'данных из незафиксированной транзакции.')
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root), \
+                unlimited_throttling():
+            results = run_budgets(LARGE_SCALE, max(options['repeat'], 1))
+
+        slow = 0
+        for budget in BUDGETS:
+            if options['endpoint'] and budget.name not in options['endpoint']:
+                continue
+            median = statistics.median(results[budget.name][2])
+            line = (f'{budget.name:<32} {median:6.1f} мс, '
+                    f'бюджет {budget.max_latency} мс')
+            if median <= budget.max_latency:
+                self.stdout.write(line)
+                continue
+            slow += 1
+            self.stdout.write(self.style.WARNING(line))
+        if slow and options['strict']:
+            raise CommandError(f'Бюджет времени превышен у {slow} '
+                               f'эндпоинтов.')
@@ -0,0 +1,162 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+from core.compression import ENCODINGS, choose_encoding, compress
+from core.routers import (choose_replica, current_replica,
+                          is_pinned_to_primary, pin_to_primary)
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы (If-None-Match / If-Modified-Since).
+    Валидаторы вычисляются до сериализации, при совпадении
+    клиенту отдается 304 без тела ответа.
+    """
+
+    def get_validators(self, request) -> tuple:
+        """Возвращает пару (etag, last_modified) или (None, None)."""
+        raise NotImplementedError
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        timestamp = (int(last_modified.timestamp())
+                     if last_modified else None)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if etag:
+            response['ETag'] = etag
+        if timestamp:
+            response['Last-Modified'] = http_date(timestamp)
+        # Флаги в ответе зависят от пользователя
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs)
+
+
+class ReplicaReadMixin:
+    """
+    Безопасные запросы читают с реплики. После успешной записи
+    пользователь на DB_REPLICA_PIN_SECONDS закрепляется
+    за основной базой и видит свои изменения.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (request.method in SAFE_METHODS
+                and not is_pinned_to_primary(request.user)):
+            self.replica_token = current_replica.set(choose_replica())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        replica_token = getattr(self, 'replica_token', None)
+        if replica_token is not None:
+            current_replica.reset(replica_token)
+            self.replica_token = None
+        if (request.method not in SAFE_METHODS
+                and response.status_code < 400
+                and request.user.is_authenticated):
+            pin_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def catalog_cache_keys(name: str) -> list:
+    """Ключи кеша всех представлений справочника."""
+    return [f'catalog:{name}:{encoding}'
+            for encoding in ENCODINGS + ('identity',)]
+
+
+class CachedCatalogMixin:
+    """
+    Полный список справочника рендерится и сжимается один раз,
+    повторные запросы без параметров получают сохраненные байты.
+    Кеш сбрасывается сигналами при изменении справочника.
+    """
+    catalog_name = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        key = f'catalog:{self.catalog_name}:{encoding or "identity"}'
+        body = cache.get(key)
+        if body is None:
+            data = super().list(request, *args, **kwargs).data
+            body = request.accepted_renderer.render(data)
+            if encoding:
+                body = compress(body, encoding, best=True)
+            cache.set(key, body, settings.CATALOG_CACHE_TIMEOUT)
+
+        response = HttpResponse(body,
+                                content_type=request.accepted_media_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+def parse_field_names(value: str) -> set:
+    """Имена полей из параметра вида "id,name,image"."""
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Параметры ?fields= и ?omit= выбирают поля ответа. Выборка
+    урезается под выбранные поля методом trim_queryset, поэтому
+    лишние JOIN, prefetch и флаги пользователя не запрашиваются.
+    Сериализатор должен принимать аргумент fields.
+    """
+    sparse_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self) -> set:
+        """Выбранные поля, без параметров - все поля сериализатора."""
+        available = set(self.get_serializer_class()().fields)
+        fields = available
+        selected = self.request.query_params.get('fields')
+        omitted = self.request.query_params.get('omit')
+        for param, value in (('fields', selected), ('omit', omitted)):
+            unknown = sorted(parse_field_names(value or '') - available)
+            if unknown:
+                raise ValidationError(
+                    {param: f'Неизвестные поля: {", ".join(unknown)}.'})
+        if selected:
+            fields = parse_field_names(selected)
+        if omitted:
+            fields = fields - parse_field_names(omitted)
+        return fields
+
+    def get_concrete_fields(self, fields: set) -> list:
+        """Поля модели для only(), первичный ключ нужен всегда."""
+        model_fields = self.queryset.model._meta.concrete_fields
+        return ['pk'] + [field.name for field in model_fields
+                         if field.name in fields]
+
+    def trim_queryset(self, queryset, fields: set):
+        """Урезает выборку под поля ответа."""
+        return queryset.only(*self.get_concrete_fields(fields))
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.sparse_actions:
+            queryset = self.trim_queryset(queryset, self.get_sparse_fields())
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in self.sparse_actions:
+            kwargs.setdefault('fields', self.get_sparse_fields())
+        return super().get_serializer(*args, **kwargs)
@@ -0,0 +1,255 @@
+import difflib
+import re
+import time
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.mixins import catalog_cache_keys
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, Tag)
+from recipes.units import UNIT_GRAPH_CACHE_KEY
+from users.models import Follow, User
+
+# Размер списков в двух прогонах: число запросов не должно зависеть от него
+SMALL_SCALE = 3
+LARGE_SCALE = 12
+# Все объекты фикстуры помещаются на одну страницу
+PAGE = 'limit=50'
+RECIPE_IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+
+
+@dataclass
+class Budget:
+    """
+    Бюджет эндпоинта: максимум запросов к базе и медиана времени
+    ответа в мс. per_item - допустимый рост числа запросов на каждый
+    объект списка, для известных и ограниченных размером страницы N+1.
+    """
+    name: str
+    method: str
+    path: str
+    max_queries: int
+    max_latency: float = 50
+    auth: bool = True
+    data: dict = None
+    per_item: int = 0
+
+
+def recipe_data(fixture: dict) -> dict:
+    return {'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'image': RECIPE_IMAGE, 'tags': fixture['tags'][:2],
+            'ingredients': [{'id': ingredient_id, 'amount': 100}
+                            for ingredient_id in fixture['ingredients'][:3]]}
+
+
+BUDGETS = (
+    Budget('tags list', 'get', '/api/tags/', 1, auth=False),
+    Budget('tags detail', 'get', '/api/tags/{tag}/', 1, auth=False),
+    Budget('ingredients list', 'get', '/api/ingredients/', 1, auth=False),
+    Budget('ingredients search', 'get', '/api/ingredients/?name=Ингр',
+           1, auth=False),
+    Budget('ingredients detail', 'get', '/api/ingredients/{ingredient}/',
+           1, auth=False),
+    Budget('recipes list anonymous', 'get', f'/api/recipes/?{PAGE}', 6,
+           auth=False),
+    Budget('recipes list', 'get', f'/api/recipes/?{PAGE}', 8),
+    Budget('recipes list lean', 'get',
+           f'/api/recipes/?{PAGE}&fields=id,name,image,cooking_time', 5),
+    Budget('recipes favorited', 'get',
+           f'/api/recipes/?{PAGE}&is_favorited=1', 8),
+    Budget('recipes in cart', 'get',
+           f'/api/recipes/?{PAGE}&is_in_shopping_cart=1', 8),
+    Budget('recipes by tag', 'get',
+           f'/api/recipes/?{PAGE}&tags=' + '{tag_slug}', 10),
+    # На фасет два запроса: счетчики и названия верхних значений
+    Budget('recipes facets', 'get',
+           f'/api/recipes/?{PAGE}&facets=tags,author', 12),
+    # Фасеты повторно проверяют параметры фильтров (slug тегов)
+    Budget('recipes by tag facets', 'get',
+           f'/api/recipes/?{PAGE}&facets=tags,author&tags=' + '{tag_slug}',
+           15),
+    Budget('recipes trending', 'get',
+           f'/api/recipes/?{PAGE}&ordering=-trending', 9),
+    Budget('recipe detail', 'get', '/api/recipes/{recipe}/', 7),
+    Budget('recipe detail servings', 'get',
+           '/api/recipes/{recipe}/?servings=3/2', 8),
+    Budget('recipes bulk', 'get', '/api/recipes/bulk/?ids={recipe_ids}', 5),
+    Budget('recipes bulk post', 'post', '/api/recipes/bulk/', 5,
+           data=lambda fixture: {'ids': fixture['recipe_ids_list']}),
+    Budget('recipe create', 'post', '/api/recipes/', 30, max_latency=100,
+           data=recipe_data),
+    Budget('recipe update', 'patch', '/api/recipes/{own_recipe}/', 35,
+           max_latency=100, data=recipe_data),
+    Budget('recipe delete', 'delete', '/api/recipes/{own_recipe}/', 14,
+           max_latency=100),
+    Budget('favorite add', 'post', '/api/recipes/{other_recipe}/favorite/',
+           7),
+    Budget('favorite remove', 'delete', '/api/recipes/{recipe}/favorite/',
+           7),
+    Budget('cart add', 'post', '/api/recipes/{other_recipe}/shopping_cart/',
+           7, data={'servings': 2}),
+    Budget('cart servings', 'patch', '/api/recipes/{recipe}/shopping_cart/',
+           6, data={'servings': 3}),
+    Budget('cart remove', 'delete', '/api/recipes/{recipe}/shopping_cart/',
+           7),
+    Budget('shopping list', 'get', '/api/recipes/shopping_list/', 3),
+    Budget('shopping list file', 'get',
+           '/api/recipes/download_shopping_cart/', 3),
+    # Перед чтением журнал нумерует новые записи одним UPDATE
+    Budget('changes', 'get', '/api/changes/?since=0', 8),
+    Budget('users list', 'get', f'/api/users/?{PAGE}', 3),
+    Budget('user detail', 'get', '/api/users/{author}/', 2),
+    # Рецептов у автора больше limit, поэтому считается и их число
+    Budget('user profile', 'get', '/api/users/{author}/profile/?limit=1', 7),
+    Budget('user profile anonymous', 'get',
+           '/api/users/{author}/profile/?limit=1', 6, auth=False),
+    Budget('users me', 'get', '/api/users/me/', 2),
+    # Рецепты всех авторов страницы читаются одним запросом
+    Budget('subscriptions', 'get', f'/api/users/subscriptions/?{PAGE}', 4),
+    Budget('subscribe', 'post', '/api/users/{other_author}/subscribe/', 7),
+    Budget('unsubscribe', 'delete', '/api/users/{author}/subscribe/', 4),
+)
+
+
+def seed(scale: int) -> dict:
+    """
+    Фикстура, в которой размер всех списков пропорционален scale:
+    авторы по два рецепта, избранное, корзина и подписки
+    основного пользователя.
+    """
+    user = User.objects.create_user(
+        username='budget', email='budget@example.com', password='budget')
+    authors = User.objects.bulk_create(
+        User(username=f'budget_author{number}',
+             email=f'budget_author{number}@example.com')
+        for number in range(scale + 1))
+    # SQLite не возвращает id из bulk_create
+    authors = list(User.objects.filter(username__startswith='budget_author')
+                   .order_by('id'))
+    tags = [Tag.objects.create(name=f'Тег {number}', color='#000000',
+                               slug=f'budget{number}')
+            for number in range(3)]
+    ingredients = [Ingredient.objects.create(name=f'Ингредиент {number}',
+                                             measurement_unit='г')
+                   for number in range(scale + 3)]
+    recipes = []
+    for author in authors:
+        for number in range(2):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Описание',
+                cooking_time=10, image='recipes/budget.png')
+            RecipeTag.objects.bulk_create(
+                RecipeTag(recipe=recipe, tag=tag) for tag in tags[:2])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=100)
+                for ingredient in ingredients[number:number + 3])
+            recipes.append(recipe)
+    for recipe in recipes[:scale]:
+        Favorite.objects.create(user=user, recipe=recipe)
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+    for author in authors[:scale]:
+        Follow.objects.create(user=user, author=author)
+    own_recipe = Recipe.objects.create(
+        author=user, name='Свой рецепт', text='Описание', cooking_time=10,
+        image='recipes/budget.png')
+    return {
+        'user': user,
+        'token': Token.objects.create(user=user).key,
+        'tags': [tag.id for tag in tags],
+        'ingredients': [ingredient.id for ingredient in ingredients],
+        'tag': tags[0].id,
+        'tag_slug': tags[0].slug,
+        'ingredient': ingredients[0].id,
+        'recipe': recipes[0].id,
+        'recipe_ids': ','.join(str(recipe.id) for recipe in recipes),
+        'recipe_ids_list': [recipe.id for recipe in recipes],
+        'other_recipe': recipes[-1].id,
+        'own_recipe': own_recipe.id,
+        'author': authors[0].id,
+        'other_author': authors[-1].id,
+    }
+
+
+def normalize_sql(sql: str) -> str:
+    """SQL без литералов: одинаковые запросы с разными id совпадают."""
+    sql = re.sub(r"'[^']*'", "'?'", sql)
+    # Имена точек сохранения вида "s140234_x12"
+    sql = re.sub(r'"s\d+_x\d+"', '"?"', sql)
+    return re.sub(r'\b\d+\b', '?', sql)
+
+
+def run_endpoint(budget: Budget, fixture: dict) -> tuple:
+    """
+    Выполняет запрос в точке сохранения, которая затем откатывается,
+    поэтому каждый запуск видит одну и ту же фикстуру.
+    Возвращает (статус, список SQL, время в мс).
+    """
+    client = APIClient()
+    if budget.auth:
+        client.credentials(HTTP_AUTHORIZATION=f'Token {fixture["token"]}')
+    path = budget.path.format(**fixture)
+    data = budget.data(fixture) if callable(budget.data) else budget.data
+    # Справочники и граф единиц кешируются, считаем запросы холодного кеша
+    cache.delete_many(catalog_cache_keys('tags')
+                      + catalog_cache_keys('ingredients')
+                      + [UNIT_GRAPH_CACHE_KEY])
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, budget.method)(
+                path, data, format='json')
+            elapsed = (time.perf_counter() - start) * 1000
+        transaction.set_rollback(True)
+    return (response.status_code,
+            [query['sql'] for query in queries.captured_queries], elapsed)
+
+
+def run_budgets(scale: int, repeat: int) -> dict:
+    """
+    Создает фикстуру размера scale и выполняет все эндпоинты.
+    Все изменения откатываются. Возвращает для каждого эндпоинта
+    (статус, список SQL, времена повторных запусков в мс).
+    """
+    results = {}
+    with transaction.atomic():
+        fixture = seed(scale)
+        for budget in BUDGETS:
+            status, queries, _ = run_endpoint(budget, fixture)
+            timings = [run_endpoint(budget, fixture)[2]
+                       for _ in range(repeat)]
+            results[budget.name] = (status, queries, timings)
+        transaction.set_rollback(True)
+    return results
+
+
+def check_queries(budget: Budget, small: tuple, large: tuple) -> list:
+    """
+    Ошибки бюджета запросов по результатам двух прогонов run_budgets,
+    пустой список - бюджет соблюден.
+    """
+    (small_status, small_sql, _), (status, large_sql, _) = small, large
+    if max(small_status, status) >= 400:
+        return [f'статус ответа {small_status}, {status}']
+    errors = []
+    allowed_growth = budget.per_item * (LARGE_SCALE - SMALL_SCALE)
+    max_queries = budget.max_queries + budget.per_item * LARGE_SCALE
+    if len(large_sql) - len(small_sql) > allowed_growth:
+        errors.append(
+            f'число запросов растет с размером данных: {len(small_sql)} '
+            f'при {SMALL_SCALE}, {len(large_sql)} при {LARGE_SCALE}')
+    if len(large_sql) > max_queries:
+        errors.append(f'{len(large_sql)} запросов, бюджет {max_queries}')
+    if errors:
+        errors.extend(difflib.unified_diff(
+            [normalize_sql(sql) for sql in small_sql],
+            [normalize_sql(sql) for sql in large_sql],
+            f'scale={SMALL_SCALE}', f'scale={LARGE_SCALE}', lineterm=''))
+    return errors
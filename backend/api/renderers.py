@@ -0,0 +1,19 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """
+    Минифицированный JSON, кодируется orjson. Запросы с отступами
+    (indent в Accept) рендерит стандартный рендерер DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or self.get_indent(accepted_media_type or '',
+                                           renderer_context or {}):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        # Нестроковые ключи приводятся к строкам, как в json.dumps
+        return orjson.dumps(data, default=JSONEncoder().default,
+                            option=orjson.OPT_NON_STR_KEYS)
@@ -7,22 +7,39 @@ from djoser.serializers import (UserCreateSerializer
                                 as DjoserUserCreateSerializer)
 from rest_framework import serializers
 
-from api.utils import create_recipe_ingredient_relation
+from api.utils import create_recipe_ingredient_relation, get_recipes_limit
+from changes.models import Change
+from jobs.models import Job
+from recipes.deletion import schedule_file_removal
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.nutrition import set_recipe_totals
+from recipes.units import get_unit_graph, scale_amount
 from users.models import User
 
 # Минимальное время приготовления, для валидатора в модели Recipe
 MIN_COOKING_TIME = settings.MIN_COOKING_TIME
 MIN_VALUE = settings.MIN_VALUE  # Минимальное количество ингредиента
+MIN_SERVINGS = settings.MIN_SERVINGS  # Минимальный множитель порций
 REGEX_USERNAME = settings.REGEX_USERNAME
-# Количество рецептов в подписках
-DEFAULT_RECIPES_LIMIT = settings.DEFAULT_RECIPES_LIMIT
 MAX_LEN_USERNAME = settings.MAX_LEN_USERNAME
 MAX_LEN_EMAIL = settings.MAX_LEN_EMAIL
 MAX_LEN_FIRST_NAME = settings.MAX_LEN_FIRST_NAME
 MAX_LEN_LAST_NAME = settings.MAX_LEN_LAST_NAME
 
 
+class SparseFieldsSerializerMixin:
+    """
+    Аргумент fields оставляет в сериализаторе только
+    перечисленные поля, см. api.mixins.SparseFieldsMixin.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор тегов."""
     class Meta:
@@ -37,11 +54,12 @@ class IngredientSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
-        fields = '__all__'
+        exclude = ('normalized_name',)
         read_only_fields = ('name', 'measurement_unit')
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsSerializerMixin,
+                     serializers.ModelSerializer):
     """Сериализатор авторов рецептов."""
     is_subscribed = serializers.SerializerMethodField()
 
@@ -52,6 +70,9 @@ class UserSerializer(serializers.ModelSerializer):
             'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, author: User) -> bool:
+        # Флаг может быть посчитан в выборке, см. trim_queryset
+        if hasattr(author, 'subscribed'):
+            return author.subscribed
         user = self.context['request'].user
         return (user.is_authenticated
                 and user.follower.filter(author=author).exists())
@@ -91,7 +112,8 @@ class Base64ImageField(serializers.ImageField):
         return super().to_internal_value(data)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SparseFieldsSerializerMixin,
+                       serializers.ModelSerializer):
     """Сериализатор чтения рецептов."""
     author = UserSerializer(required=False)
     tags = TagSerializer(many=True)
@@ -105,20 +127,38 @@ class RecipeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def to_representation(self, recipe):
-        """Добавляем количество каждому ингредиенту."""
-        recipe_ingredients = recipe.recipe_igredient.all()
+        """
+        Добавляем количество каждому ингредиенту. Множитель порций
+        servings из контекста пересчитывает количества с округлением.
+        """
+        if hasattr(recipe, 'author_subscribed'):
+            recipe.author.subscribed = recipe.author_subscribed
         data = super().to_representation(recipe)
-        for ingredient in data['ingredients']:
-            ingredient['amount'] = recipe_ingredients.get(
-                ingredient_id=ingredient['id']).amount
+        if 'ingredients' in data:
+            # all() берет связи из prefetch, если он был
+            amounts = {link.ingredient_id: link.amount
+                       for link in recipe.recipe_igredient.all()}
+            servings = self.context.get('servings')
+            graph = get_unit_graph() if servings is not None else None
+            for ingredient in data['ingredients']:
+                amount = amounts[ingredient['id']]
+                if graph is not None:
+                    amount = scale_amount(
+                        amount, servings,
+                        graph.unit(ingredient['measurement_unit']))
+                ingredient['amount'] = amount
         return data
 
     def get_is_favorited(self, recipe: Recipe) -> bool:
+        if hasattr(recipe, 'favorited'):
+            return recipe.favorited
         user = self.context['request'].user
         return (user.is_authenticated
                 and user.favorites.filter(recipe=recipe).exists())
 
     def get_is_in_shopping_cart(self, recipe: Recipe) -> bool:
+        if hasattr(recipe, 'in_shopping_cart'):
+            return recipe.in_shopping_cart
         user = self.context['request'].user
         return (user.is_authenticated
                 and user.shopping_carts.filter(recipe=recipe).exists())
@@ -181,6 +221,7 @@ class RecipeWriteSerializer(RecipeSerializer):
 
         # Создаем связь рецепта с ингредиентами
         create_recipe_ingredient_relation(recipe, ingredients_data)
+        set_recipe_totals(recipe)
 
         return recipe
 
@@ -200,7 +241,16 @@ class RecipeWriteSerializer(RecipeSerializer):
         # Добавляем новые ингредиенты
         create_recipe_ingredient_relation(recipe, ingredients_data)
 
-        return super().update(recipe, validated_data)
+        set_recipe_totals(recipe)
+
+        # save() внутри super().update() обновляет поле updated,
+        # смена тегов и ингредиентов меняет валидаторы условного GET
+        old_image = recipe.image.name
+        recipe = super().update(recipe, validated_data)
+        # Старая картинка удаляется, если на нее больше нет ссылок
+        if recipe.image.name != old_image:
+            schedule_file_removal({old_image})
+        return recipe
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
@@ -214,8 +264,7 @@ class RecipeShortSerializer(serializers.ModelSerializer):
 class SubscriptionsSerializer(UserSerializer):
     """Сериализатор подписок."""
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        source='recipes.count', read_only=True)
+    recipes_count = serializers.SerializerMethodField()
 
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
@@ -224,21 +273,27 @@ class SubscriptionsSerializer(UserSerializer):
     def get_recipes(self, user: User) -> dict:
         """Рецепты пользователя."""
         request = self.context.get('request')
-        recipes_limit = request.query_params.get(
-            'recipes_limit',
-            DEFAULT_RECIPES_LIMIT)
-        recipes = user.recipes.all().order_by('-id')[:int(recipes_limit)]
+        # Рецепты могут быть загружены заранее, см. prepare_subscriptions
+        if hasattr(user, 'recent_recipes'):
+            recipes = user.recent_recipes
+        else:
+            recipes = user.recipes.all().order_by('-id')[
+                :get_recipes_limit(request)]
 
         return RecipeShortSerializer(recipes,
                                      many=True,
                                      context={'request': request}).data
 
+    def get_recipes_count(self, user: User) -> int:
+        if hasattr(user, 'recipes_count'):
+            return user.recipes_count
+        return user.recipes.count()
+
     def validate(self, data):
+        """Повторную подписку отсекает вставка, см. core.db.insert_ignore."""
         author = self.instance
         request = self.context.get('request')
 
-        if request.user.follower.filter(author=author).exists():
-            raise serializers.ValidationError('Уже в подписках.')
         if request.user == author:
             raise serializers.ValidationError('Нельзя подписаться на себя.')
 
@@ -246,19 +301,24 @@ class SubscriptionsSerializer(UserSerializer):
 
 
 class ShoppingCartSerializer(RecipeShortSerializer):
-    """Сериализатор корзин."""
+    """
+    Сериализатор корзин. При добавлении порций по умолчанию
+    MIN_SERVINGS, PATCH без servings отклоняется, а не сбрасывает
+    сохраненное значение.
+    """
+    servings = serializers.IntegerField(
+        min_value=MIN_SERVINGS, default=MIN_SERVINGS, write_only=True)
 
     class Meta(RecipeShortSerializer.Meta):
+        fields = RecipeShortSerializer.Meta.fields + ('servings',)
         read_only_fields = ('name', 'cooking_time', 'image')
 
     def validate(self, data):
-        recipe = self.instance
-        request = self.context.get('request')
-
-        if request.user.shopping_carts.filter(recipe=recipe).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже в корзине.')
-
+        if (self.context['request'].method == 'PATCH'
+                and 'servings' not in self.initial_data):
+            raise serializers.ValidationError({
+                'servings': self.fields['servings'].error_messages[
+                    'required']})
         return data
 
 
@@ -268,12 +328,39 @@ class FavoriteSerializer(RecipeShortSerializer):
     class Meta(RecipeShortSerializer.Meta):
         read_only_fields = ('name', 'cooking_time', 'image')
 
-    def validate(self, data):
-        recipe = self.instance
-        request = self.context.get('request')
 
-        if request.user.favorites.filter(recipe=recipe).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже в избранном.')
+class JobSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор фоновых задач. Трассировка ошибки остается в журнале
+    и админке, пользователь получает только общее сообщение.
+    """
+    error = serializers.SerializerMethodField()
 
-        return data
+    class Meta:
+        model = Job
+        fields = ('id', 'kind', 'status', 'error',
+                  'created', 'started', 'finished')
+
+    def get_error(self, job: Job) -> str:
+        if job.status == Job.FAILED:
+            return 'Не удалось выполнить задачу, попробуйте позже.'
+        return ''
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    """
+    Запись журнала изменений. Для созданных и измененных объектов
+    каталога и корзины data содержит их текущее состояние,
+    словарь data передается в контексте.
+    """
+    id = serializers.IntegerField(source='object_id')
+    data = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Change
+        fields = ('seq', 'model', 'id', 'action', 'data')
+
+    def get_data(self, change: Change):
+        if change.action == Change.DELETE:
+            return None
+        return self.context['data'].get((change.model, change.object_id))
@@ -0,0 +1,16 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.mixins import catalog_cache_keys
+from recipes.models import Ingredient, Tag
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def reset_tags_cache(sender, **kwargs):
+    cache.delete_many(catalog_cache_keys('tags'))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def reset_ingredients_cache(sender, **kwargs):
+    cache.delete_many(catalog_cache_keys('ingredients'))
@@ -0,0 +1,595 @@
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import orjson
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections
+from django.http import QueryDict
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from api.benchmark import unlimited_throttling
+from api.query_budget import (BUDGETS, LARGE_SCALE, SMALL_SCALE, check_queries,
+                              run_budgets)
+from api.renderers import CompactJSONRenderer
+from api.throttling import CacheBucketStore, LocalBucketStore
+from api.utils import get_filters_hash
+from changes.log import (compact_changes, get_changes, get_horizon, get_latest,
+                         record_change)
+from changes.models import Change
+from core.db import delete_links, insert_ignore
+from jobs.models import Job
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from recipes.nutrition import update_recipe_totals
+from users.models import Follow, User
+
+
+class RecipeDetailTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='author')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/test.png')
+
+    def test_non_numeric_pk_is_not_found(self):
+        response = self.client.get('/api/recipes/abc/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_missing_pk_is_not_found(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.id + 1}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RecipeTotalsTests(APITestCase):
+
+    def test_recalculation_invalidates_etag(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='author')
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание', cooking_time=10,
+            image='recipes/test.png')
+        ingredient = Ingredient.objects.create(
+            name='Сахар', measurement_unit='г', calories=200)
+        RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=100)
+        update_recipe_totals([recipe.id])
+        path = f'/api/recipes/{recipe.id}/'
+        etag = self.client.get(path)['ETag']
+        self.assertEqual(
+            self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_304_NOT_MODIFIED)
+
+        Ingredient.objects.filter(id=ingredient.id).update(calories=1000)
+        self.assertEqual(update_recipe_totals(), 1)
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['calories'], 1000)
+        self.assertTrue(Change.objects.filter(
+            model='recipe', object_id=recipe.id, action=Change.UPSERT,
+            created__gte=response.data['updated']).exists())
+        # Итоги не изменились - рецепт не перезаписывается
+        self.assertEqual(update_recipe_totals(), 0)
+
+
+class LocalBucketStoreTests(APITestCase):
+
+    @mock.patch('api.throttling.MAX_LOCAL_BUCKETS', 3)
+    def test_allowed_requests_do_not_grow_buckets(self):
+        store = LocalBucketStore()
+        for number in range(10):
+            self.assertEqual(store.consume(f'ip{number}', 1, 5, 1), 0)
+        self.assertEqual(list(store.buckets), ['ip7', 'ip8', 'ip9'])
+
+    def test_denied_request_waits_for_tokens(self):
+        store = LocalBucketStore()
+        self.assertEqual(store.consume('user', 2, 2, 1), 0)
+        self.assertGreater(store.consume('user', 2, 2, 1), 0)
+
+
+class FakeMemcached:
+    """Клиент pymemcache в памяти: gets/cas с маркером версии."""
+
+    def __init__(self):
+        self.data, self.version = {}, 0
+
+    def gets(self, key):
+        return self.data.get(key, (None, None))
+
+    def cas(self, key, value, token, expire=0):
+        if key not in self.data:
+            return None
+        if self.data[key][1] != token:
+            return False
+        self.set(key, value)
+        return True
+
+    def set(self, key, value):
+        self.version += 1
+        self.data[key] = (value, self.version)
+
+
+class FakeMemcachedBackend:
+    """Бэкенд кеша Django поверх FakeMemcached."""
+
+    def __init__(self):
+        self._cache = FakeMemcached()
+
+    def make_key(self, key):
+        return f':1:{key}'
+
+    def add(self, key, value, timeout):
+        if self.make_key(key) in self._cache.data:
+            return False
+        self._cache.set(self.make_key(key), value)
+        return True
+
+
+class CacheBucketStoreTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('api.throttling.time.time')
+    def test_wait_is_time_until_tokens(self, now):
+        now.return_value = 1000.0
+        store = CacheBucketStore()
+        self.assertEqual(store.consume('user', 2, 4, 2), 0)
+        self.assertEqual(store.consume('user', 2, 4, 2), 0)
+        # Пустая корзина пополняется 2 токена в секунду, а не через окно
+        self.assertEqual(store.consume('user', 1, 4, 2), 0.5)
+        now.return_value = 1000.5
+        self.assertEqual(store.consume('user', 1, 4, 2), 0)
+        self.assertEqual(store.consume('user', 3, 4, 2), 1.5)
+
+    @mock.patch('api.throttling.time.time', return_value=1000.0)
+    def test_memcached_cas_retries_after_conflict(self, now):
+        backend = FakeMemcachedBackend()
+        store = CacheBucketStore(backend)
+        self.assertEqual(store.consume('user', 1, 3, 1), 0)
+        gets = store.gets
+
+        def concurrent_gets(key):
+            # Другой воркер тратит токен между чтением и записью
+            value, token = gets(key)
+            if store.gets is concurrent_gets:
+                store.gets = gets
+                store.consume('user', 1, 3, 1)
+            return value, token
+
+        store.gets = concurrent_gets
+        self.assertEqual(store.consume('user', 1, 3, 1), 0)
+        self.assertEqual(backend._cache.gets(':1:user')[0], (0, 1000.0))
+        self.assertEqual(store.consume('user', 1, 3, 1), 1)
+
+
+class ShoppingCartDownloadTests(APITestCase):
+
+    def test_anonymous_cannot_enqueue(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?async=1')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(Job.objects.exists())
+
+
+class ShoppingCartServingsTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='user')
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/test.png')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        self.client.post(self.url, {'servings': 4}, format='json')
+
+    def get_servings(self) -> int:
+        return ShoppingCart.objects.get(user=self.user,
+                                        recipe=self.recipe).servings
+
+    def test_patch_without_servings_keeps_value(self):
+        response = self.client.patch(self.url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('servings', response.data)
+        self.assertEqual(self.get_servings(), 4)
+
+    def test_patch_updates_servings(self):
+        response = self.client.patch(self.url, {'servings': 6},
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['servings'], 6)
+        self.assertEqual(self.get_servings(), 6)
+
+
+class CompactJSONRendererTests(APITestCase):
+
+    def test_renders_with_orjson(self):
+        data = {'price': Decimal('1.50'), 1: 'один', 'tags': []}
+        with mock.patch('api.renderers.orjson.dumps',
+                        wraps=orjson.dumps) as dumps:
+            content = CompactJSONRenderer().render(data, 'application/json')
+        dumps.assert_called_once()
+        # Тот же вывод, что у компактного рендерера DRF
+        self.assertEqual(content,
+                         JSONRenderer().render(data, 'application/json'))
+
+    def test_indent_falls_back_to_drf(self):
+        content = CompactJSONRenderer().render(
+            {'tags': []}, 'application/json; indent=2')
+        self.assertEqual(content, b'{\n  "tags": []\n}')
+
+    def test_api_response(self):
+        Ingredient.objects.create(name='Сахар', measurement_unit='г')
+        response = self.client.get('/api/ingredients/',
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()[0]['name'], 'Сахар')
+        self.assertNotIn(b', ', response.content)
+
+
+class SubscriptionsTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='reader')
+        cls.authors = []
+        for number, recipes in enumerate((3, 1, 0)):
+            author = User.objects.create_user(
+                username=f'author{number}', email=f'author{number}@ex.com',
+                password='author')
+            Recipe.objects.bulk_create(
+                Recipe(author=author, name=f'Рецепт {index}', text='Текст',
+                       cooking_time=10, image='recipes/test.png')
+                for index in range(recipes))
+            Follow.objects.create(user=cls.user, author=author)
+            cls.authors.append(author)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_latest_recipes_and_counts(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                '/api/users/subscriptions/?recipes_limit=2')
+        results = {author['id']: author
+                   for author in response.data['results']}
+        for author, count in zip(self.authors, (3, 1, 0)):
+            latest = list(Recipe.objects.filter(author=author)
+                          .order_by('-id').values_list('id', flat=True)[:2])
+            self.assertEqual(
+                [recipe['id'] for recipe in results[author.id]['recipes']],
+                latest)
+            self.assertEqual(results[author.id]['recipes_count'], count)
+            self.assertTrue(results[author.id]['is_subscribed'])
+
+    def test_zero_limit(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=0')
+        self.assertEqual(response.data['results'][0]['recipes'], [])
+        self.assertEqual(response.data['results'][-1]['recipes_count'], 3)
+
+    def test_invalid_limit(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeBulkTests(APITestCase):
+
+    def test_id_above_pk_range_is_rejected(self):
+        too_big = 2 ** 63
+        response = self.client.get(f'/api/recipes/bulk/?ids=1,{too_big}')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/recipes/bulk/',
+                                    {'ids': [1, too_big]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_largest_id_is_accepted(self):
+        response = self.client.get(f'/api/recipes/bulk/?ids={2 ** 63 - 1}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_boolean_ids_are_rejected(self):
+        response = self.client.post('/api/recipes/bulk/', {'ids': [True]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeFacetsTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        first, second = (
+            Tag.objects.create(name=slug, color='#000000', slug=slug)
+            for slug in ('first', 'second'))
+        # Оба фильтра находят по два рецепта с общей датой изменения
+        for number, tags in enumerate(((first,), (first, second),
+                                       (second,))):
+            author = User.objects.create_user(
+                username=f'author{number}', email=f'author{number}@ex.com',
+                password='author')
+            recipe = Recipe.objects.create(
+                author=author, name='Рецепт', text='Описание',
+                cooking_time=10, image='recipes/test.png')
+            recipe.tags.set(tags)
+        Recipe.objects.update(updated=timezone.now())
+
+    def setUp(self):
+        cache.clear()
+
+    def get_authors(self, query: str) -> list:
+        response = self.client.get(f'/api/recipes/?facets=author&{query}')
+        self.assertEqual(response.data['count'], 2)
+        return [author['username'] for author in response.data['facets']
+                ['author']]
+
+    def test_filters_with_same_count_do_not_share_facets(self):
+        self.assertEqual(self.get_authors('tags=first'),
+                         ['author0', 'author1'])
+        self.assertEqual(self.get_authors('tags=second'),
+                         ['author1', 'author2'])
+
+    def test_filter_order_does_not_matter(self):
+        self.assertEqual(get_filters_hash(QueryDict('tags=a&tags=b&limit=1')),
+                         get_filters_hash(QueryDict('page=2&tags=b&tags=a')))
+
+
+class AuthorProfileTests(APITestCase):
+
+    def test_recipes_count_is_not_stale(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='author')
+        recipes = [Recipe(author=author, name='Рецепт', text='Описание',
+                          cooking_time=10, image='recipes/test.png')
+                   for _ in range(3)]
+        Recipe.objects.bulk_create(recipes[:2])
+        path = f'/api/users/{author.id}/profile/?limit=1'
+        self.assertEqual(self.client.get(path).data['recipes_count'], 2)
+        # Вставка без сигналов, как у другого воркера или в миграции
+        Recipe.objects.bulk_create(recipes[2:])
+        self.assertEqual(self.client.get(path).data['recipes_count'], 3)
+
+
+class QueryBudgetTests(APITestCase):
+    """
+    Бюджеты числа запросов из api.query_budget: данные двух размеров,
+    число запросов не должно расти с размером данных (N+1).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root), \
+                unlimited_throttling():
+            cls.small = run_budgets(SMALL_SCALE, 0)
+            cls.large = run_budgets(LARGE_SCALE, 0)
+
+    def test_query_budgets(self):
+        for budget in BUDGETS:
+            with self.subTest(budget.name):
+                errors = check_queries(budget, self.small[budget.name],
+                                       self.large[budget.name])
+                if errors:
+                    self.fail('\n'.join(errors))
+
+
+class RecipeValidatorsTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='author')
+        cls.tag = Tag.objects.create(name='Завтрак', color='#000000',
+                                     slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='Сахар',
+                                                   measurement_unit='г')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/test.png')
+        cls.recipe.tags.set([cls.tag])
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=100)
+
+    def setUp(self):
+        throttling = unlimited_throttling()
+        throttling.__enter__()
+        self.addCleanup(throttling.__exit__, None, None, None)
+
+    def assert_modified(self, change):
+        for path in (f'/api/recipes/{self.recipe.id}/', '/api/recipes/'):
+            etag = self.client.get(path)['ETag']
+            change()
+            self.assertEqual(
+                self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code,
+                status.HTTP_200_OK, path)
+
+    def test_related_rows_invalidate_validators(self):
+        def rename(instance, **fields):
+            def change():
+                for name, value in fields.items():
+                    setattr(instance, name, value + str(timezone.now()))
+                instance.save()
+            return change
+
+        self.assert_modified(rename(self.tag, name='Обед'))
+        self.assert_modified(rename(self.ingredient, name='Соль'))
+        self.assert_modified(rename(self.author, first_name='Имя'))
+
+    def test_login_does_not_touch_recipes(self):
+        updated = Recipe.objects.get().updated
+        self.author.last_login = timezone.now()
+        self.author.save(update_fields=('last_login',))
+        self.assertEqual(Recipe.objects.get().updated, updated)
+
+    def test_validators_aggregate_plain_queryset(self):
+        self.client.force_authenticate(self.author)
+        etag = self.client.get('/api/recipes/')['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        aggregate = next(query['sql'] for query in queries.captured_queries
+                         if 'MAX(' in query['sql'])
+        self.assertNotIn('EXISTS', aggregate)
+        self.assertNotIn('subquery', aggregate)
+
+
+class LinkConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='user')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/test.png')
+
+    def run_concurrently(self, *functions) -> list:
+        """Запускает функции одновременно, каждую в своем потоке."""
+        barrier = threading.Barrier(len(functions))
+
+        def run(function):
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        return function()
+                    except OperationalError as error:
+                        # Общая база SQLite в памяти не ждет блокировку
+                        # таблицы, как busy_timeout для файла: повтор
+                        if 'locked' not in str(error):
+                            raise
+                        time.sleep(0.01)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(len(functions)) as executor:
+            return list(executor.map(run, functions))
+
+    def add(self) -> bool:
+        return insert_ignore(Favorite(user=self.user, recipe=self.recipe))
+
+    def remove(self) -> int:
+        return delete_links(Favorite.objects.filter(
+            user=self.user, recipe=self.recipe))
+
+    def test_concurrent_inserts_create_one_row(self):
+        results = self.run_concurrently(*[self.add] * self.THREADS)
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Favorite.objects.count(), 1)
+
+    def test_concurrent_deletes_signal_once(self):
+        self.add()
+        results = self.run_concurrently(*[self.remove] * self.THREADS)
+        self.assertEqual(sum(results), 1)
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEqual(Change.objects.filter(
+            model='favorite', action=Change.DELETE).count(), 1)
+
+    def test_delete_is_single_statement(self):
+        self.add()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.remove(), 1)
+        statements = [query['sql'] for query in queries
+                      if Favorite._meta.db_table in query['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('DELETE'))
+        change = Change.objects.get(action=Change.DELETE)
+        self.assertEqual((change.object_id, change.user_id),
+                         (self.recipe.id, self.user.id))
+
+    def test_mixed_inserts_and_deletes(self):
+        self.run_concurrently(*[self.add, self.remove] * (self.THREADS // 2))
+        self.assertLessEqual(Favorite.objects.count(), 1)
+        self.run_concurrently(*[self.add] * self.THREADS)
+        self.assertEqual(Favorite.objects.count(), 1)
+
+
+class ChangeFeedTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='user')
+        cls.other = User.objects.create_user(
+            username='other', email='other@example.com', password='other')
+
+    def get_feed(self, since: int, **params):
+        return self.client.get('/api/changes/', {'since': since, **params})
+
+    def test_late_commit_is_not_skipped(self):
+        for object_id in range(1, 4):
+            record_change('tag', object_id, Change.DELETE)
+        # Запись из транзакции, которая еще не зафиксирована
+        late = Change.objects.get(object_id=2)
+        late.delete()
+        response = self.get_feed(0)
+        self.assertEqual([change['id'] for change in response.data['changes']],
+                         [1, 3])
+        # Транзакция фиксируется позже: id меньше выданного next
+        late.save(force_insert=True)
+        response = self.get_feed(response.data['next'])
+        self.assertEqual([change['id'] for change in response.data['changes']],
+                         [2])
+        self.assertGreater(response.data['changes'][0]['seq'],
+                           Change.objects.get(object_id=3).seq)
+
+    def test_feed_pages_and_filters(self):
+        record_change('tag', 1, Change.DELETE)
+        record_change('favorite', 1, Change.DELETE, self.user.id)
+        record_change('favorite', 2, Change.DELETE, self.other.id)
+        record_change('ingredient', 1, Change.DELETE)
+        self.client.force_authenticate(self.user)
+        response = self.get_feed(0, models='tag,favorite')
+        self.assertEqual(
+            [(change['model'], change['id'])
+             for change in response.data['changes']],
+            [('tag', 1), ('favorite', 1)])
+        changes, has_more = get_changes(self.user, 0, limit=2)
+        self.assertTrue(has_more)
+        self.assertEqual([change.object_id for change in changes], [1, 1])
+
+    def test_compaction_keeps_last_change(self):
+        record_change('tag', 1, Change.UPSERT)
+        record_change('tag', 1, Change.DELETE)
+        record_change('favorite', 1, Change.UPSERT, self.user.id)
+        record_change('favorite', 1, Change.UPSERT, self.other.id)
+        stats = compact_changes()
+        self.assertEqual(stats, {'duplicates': 1, 'expired': 0})
+        self.assertEqual(
+            list(Change.objects.order_by('seq').values_list(
+                'model', 'action', 'user')),
+            [('tag', Change.DELETE, None),
+             ('favorite', Change.UPSERT, self.user.id),
+             ('favorite', Change.UPSERT, self.other.id)])
+
+    def test_client_behind_compaction_gets_gone(self):
+        for object_id in range(1, 4):
+            record_change('tag', object_id, Change.UPSERT)
+        Change.objects.filter(object_id__lt=3).update(
+            created=timezone.now() - timedelta(days=31))
+        stats = compact_changes(retention_days=30)
+        self.assertEqual(stats['expired'], 2)
+        horizon = get_horizon()
+        response = self.get_feed(horizon - 1)
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(response.data['next'], get_latest())
+        response = self.get_feed(horizon)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([change['id'] for change in response.data['changes']],
+                         [3])
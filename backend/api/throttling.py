@@ -0,0 +1,151 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+THROTTLE_BUCKETS = settings.THROTTLE_BUCKETS
+THROTTLE_ACTION_COSTS = settings.THROTTLE_ACTION_COSTS
+# Максимум корзин в памяти, сверх него вытесняются давно не использованные
+MAX_LOCAL_BUCKETS = 10000
+# Попыток записи корзины в кеш при одновременных запросах
+MAX_CAS_ATTEMPTS = 5
+
+
+class LocalBucketStore:
+    """
+    Корзины токенов в памяти процесса. Точный token bucket,
+    но у каждого воркера gunicorn свои корзины. Число корзин
+    ограничено MAX_LOCAL_BUCKETS (LRU): вытесненная корзина
+    давно не использовалась и обычно уже заполнена.
+    """
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key: str, cost: int, capacity: int,
+                rate: float) -> float:
+        """Списывает cost токенов. Возвращает ожидание в секундах."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens, wait = tokens - cost, 0
+            else:
+                wait = (cost - tokens) / rate
+            # Ключ переносится в конец: первыми вытесняются старые
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > MAX_LOCAL_BUCKETS:
+                self.buckets.popitem(last=False)
+            return wait
+
+
+class CacheBucketStore:
+    """
+    Корзины токенов в кеше Django: пара (токены, время пополнения),
+    которая обновляется атомарно. В memcached (CACHE_LOCATION) новая
+    корзина создается add, изменения записываются cas и повторяются
+    при конфликте, корзины общие для всех воркеров. В локальном кеше
+    DEBUG атомарность дает блокировка, корзины свои у каждого процесса.
+    """
+
+    def __init__(self, backend=cache):
+        self.cache = backend
+        self.lock = threading.Lock()
+
+    def gets(self, key: str) -> tuple:
+        """Значение и маркер для cas."""
+        client = getattr(self.cache, '_cache', None)
+        if hasattr(client, 'gets'):
+            return client.gets(self.cache.make_key(key))
+        value = self.cache.get(key)
+        return value, value
+
+    def cas(self, key: str, value, token, timeout: int) -> bool:
+        """Записывает value, если ключ не менялся после gets."""
+        if token is None:
+            return self.cache.add(key, value, timeout)
+        client = getattr(self.cache, '_cache', None)
+        if hasattr(client, 'cas'):
+            return bool(client.cas(self.cache.make_key(key), value, token,
+                                   expire=timeout))
+        with self.lock:
+            if self.cache.get(key) != token:
+                return False
+            self.cache.set(key, value, timeout)
+            return True
+
+    def consume(self, key: str, cost: int, capacity: int,
+                rate: float) -> float:
+        """Списывает cost токенов. Возвращает ожидание в секундах."""
+        # Корзина заполняется за capacity / rate секунд, после этого
+        # ключ можно забыть: отсутствующая корзина полна
+        timeout = math.ceil(capacity / rate) + 1
+        for _ in range(MAX_CAS_ATTEMPTS):
+            now = time.time()
+            bucket, token = self.gets(key)
+            tokens, updated = bucket or (capacity, now)
+            tokens = min(capacity, tokens + max(0, now - updated) * rate)
+            if tokens < cost:
+                return (cost - tokens) / rate
+            if self.cas(key, (tokens - cost, now), token, timeout):
+                return 0
+        # Корзину одновременно меняют другие запросы того же клиента
+        return cost / rate
+
+
+# Отдельное хранилище на каждую область: у них разные параметры корзин
+bucket_stores = {
+    scope: (CacheBucketStore() if settings.THROTTLE_STORE == 'cache'
+            else LocalBucketStore())
+    for scope in THROTTLE_BUCKETS}
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Ограничение частоты запросов корзиной токенов.
+    Стоимость запроса зависит от действия view.
+    """
+    scope = None
+
+    def get_cache_key(self, request, view) -> str:
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+        bucket = THROTTLE_BUCKETS[self.scope]
+        cost = min(THROTTLE_ACTION_COSTS.get(getattr(view, 'action', None), 1),
+                   bucket['capacity'])
+        self.wait_time = bucket_stores[self.scope].consume(
+            key, cost, bucket['capacity'], bucket['rate'])
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """Корзина на пользователя."""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not request.user.is_authenticated:
+            return None
+        return f'throttle_user_{request.user.pk}'
+
+
+class AnonTokenBucketThrottle(TokenBucketThrottle):
+    """Корзина на IP-адрес анонимного клиента."""
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user.is_authenticated:
+            return None
+        return f'throttle_anon_{self.get_ident(request)}'
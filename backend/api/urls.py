@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views import (CustomUserViewSet, IngredientListRetrieveViewSet,
+from api.views import (ChangeViewSet, CustomUserViewSet,
+                       IngredientListRetrieveViewSet, JobViewSet,
                        RecipeViewSet, TagListRetrieveViewSet)
 
 router = DefaultRouter()
@@ -9,6 +10,8 @@ router.register('tags', TagListRetrieveViewSet)
 router.register('ingredients', IngredientListRetrieveViewSet)
 router.register('recipes', RecipeViewSet)
 router.register('users', CustomUserViewSet)
+router.register('jobs', JobViewSet, basename='jobs')
+router.register('changes', ChangeViewSet, basename='changes')
 
 
 urlpatterns = [
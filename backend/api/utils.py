@@ -1,11 +1,35 @@
+import hashlib
 from datetime import datetime
+from fractions import Fraction
 
+import numpy as np
+from django.conf import settings
 from django.db import models
+from django.db.models import (Count, Exists, F, Max, OuterRef, Prefetch,
+                              Subquery, Sum, Value)
+from django.db.models.functions import Coalesce
 from django.http import HttpResponse
+from django.utils.http import quote_etag
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from recipes.models import Recipe, RecipeIngredient
+from core.db import delete_links
+from recipes.models import (Favorite, Recipe, RecipeIngredient, RecipeScore,
+                            RecipeTag, ShoppingCart, Tag)
+from recipes.units import as_number, get_unit_graph, round_amounts
+from users.models import Follow, User
+
+# Фасеты списка рецептов и максимум значений в каждом
+RECIPE_FACETS = ('tags', 'author')
+# Параметры списка рецептов, не меняющие состав выборки
+PRESENTATION_PARAMS = ('page', 'limit', 'fields', 'omit', 'ordering',
+                       'facets', 'servings', 'format')
+FACET_LIMIT = settings.FACET_LIMIT
+# Количество рецептов в подписках
+DEFAULT_RECIPES_LIMIT = settings.DEFAULT_RECIPES_LIMIT
+# Наибольшее значение первичного ключа BigAutoField
+MAX_ID = 2 ** 63 - 1
 
 
 def create_recipe_ingredient_relation(
@@ -22,29 +46,245 @@ def create_recipe_ingredient_relation(
     RecipeIngredient.objects.bulk_create(recipe_ingredients)
 
 
-def make_file(data: dict) -> HttpResponse:
-    """Формирование файла со списком покупок."""
-    response = HttpResponse(content_type='text/plan')
-    response['Content-Disposition'] = 'attachment; filename="ingredients.txt"'
+def check_ids(ids: list) -> list:
+    """
+    Проверяет, что id - целые числа в диапазоне первичного ключа:
+    больший id база отвергает ошибкой переполнения.
+    """
+    if not all(isinstance(pk, int) and not isinstance(pk, bool)
+               and 0 <= pk <= MAX_ID for pk in ids):
+        raise ValidationError(
+            {'ids': f'id должны быть целыми числами от 0 до {MAX_ID}.'})
+    return ids
+
+
+def parse_ids(value: str) -> list:
+    """Список id из параметра вида "1,2,3" в исходном порядке."""
+    ids = [pk.strip() for pk in value.split(',') if pk.strip()]
+    if not all(pk.isdigit() for pk in ids):
+        raise ValidationError({'ids': 'id должны быть целыми числами.'})
+    return check_ids([int(pk) for pk in ids])
+
+
+def get_recipes_limit(request) -> int:
+    """Число рецептов автора в подписках из параметра recipes_limit."""
+    value = request.query_params.get('recipes_limit',
+                                     str(DEFAULT_RECIPES_LIMIT))
+    if not value.isdigit():
+        raise ValidationError(
+            {'recipes_limit': 'Должно быть неотрицательным целым числом.'})
+    return int(value)
+
+
+def prepare_subscriptions(authors: models.QuerySet,
+                          limit: int) -> models.QuerySet:
+    """
+    Число рецептов, флаг подписки и последние limit рецептов авторов
+    для SubscriptionsSerializer: число запросов не зависит от числа
+    авторов. Рецепты всех авторов страницы читаются одним запросом,
+    границу для каждого автора находит подзапрос по индексу (author, -id).
+    """
+    recipes = Recipe.objects.none()
+    if limit:
+        boundary = (Recipe.objects.filter(author=OuterRef('author'))
+                    .order_by('-id').values('id')[limit - 1:limit])
+        recipes = (Recipe.objects
+                   .filter(id__gte=Coalesce(Subquery(boundary), 0))
+                   .only('id', 'author', 'name', 'cooking_time', 'image')
+                   .order_by('-id'))
+    return authors.annotate(
+        subscribed=Value(True), recipes_count=Count('recipes'),
+    ).prefetch_related(
+        Prefetch('recipes', queryset=recipes, to_attr='recent_recipes'))
+
+
+def prepare_recipes(recipes: models.QuerySet, user: User,
+                    fields: set) -> models.QuerySet:
+    """
+    Связанные объекты и флаги пользователя для полей fields
+    RecipeSerializer: число запросов не зависит от числа рецептов.
+    """
+    if 'author' in fields:
+        recipes = recipes.select_related('author')
+        if user.is_authenticated:
+            recipes = recipes.annotate(author_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('author'))))
+    if 'tags' in fields:
+        recipes = recipes.prefetch_related('tags')
+    if 'ingredients' in fields:
+        recipes = recipes.prefetch_related(
+            'ingredients',
+            Prefetch('recipe_igredient',
+                     queryset=RecipeIngredient.objects.only(
+                         'recipe', 'ingredient', 'amount')))
+    if user.is_authenticated:
+        for field, name, model in (
+                ('is_favorited', 'favorited', Favorite),
+                ('is_in_shopping_cart', 'in_shopping_cart', ShoppingCart)):
+            if field in fields:
+                recipes = recipes.annotate(**{name: Exists(
+                    model.objects.filter(user=user, recipe=OuterRef('pk')))})
+    return recipes
+
+
+def get_shopping_list(user: User) -> list:
+    """
+    Суммарное количество ингредиентов из корзины пользователя
+    с учетом порций. База суммирует количества по ингредиентам,
+    затем они пакетно приводятся к базовой единице графа переводов
+    (recipes.units) и складываются еще раз: 1 кг и 200 г муки
+    дают 1200 г. Единицы без перевода остаются как есть.
+    """
+    rows = (RecipeIngredient.objects
+            .filter(recipe__shopping_carts__user=user)
+            .values_list('ingredient__name', 'ingredient__measurement_unit')
+            .annotate(total=Sum(F('amount')
+                                * F('recipe__shopping_carts__servings')))
+            .order_by())
+    if not rows:
+        return []
+    names, units, totals = zip(*rows)
+    values, bases, countable = get_unit_graph().to_base(totals, units)
+    groups = {}
+    index = np.array([groups.setdefault(key, len(groups))
+                      for key in zip(names, bases)])
+    values = round_amounts(np.bincount(index, weights=values),
+                           np.bincount(index, weights=countable) > 0)
+    return [{'name': name, 'measurement_unit': unit,
+             'amount': as_number(Fraction(value))}
+            for (name, unit), value in sorted(zip(groups, values.tolist()))]
+
+
+def render_shopping_list(data: list) -> str:
+    """Текст файла со списком покупок."""
     cur_datetime = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
+    lines = [f'Recipes список ингредиентов.\t{cur_datetime}\n']
+    for item in data:
+        lines.append(f'{item["name"]} ({item["measurement_unit"]}):'
+                     f'\t{item["amount"]}\n')
+    return ''.join(lines)
 
-    response.write(f'Recipes список ингредиентов.\t{cur_datetime}\n')
-    for name, amount in data.items():
-        response.write(
-            f'{name}:\t{amount}\n')
 
+def make_file(data: list) -> HttpResponse:
+    """Формирование файла со списком покупок."""
+    response = HttpResponse(render_shopping_list(data),
+                            content_type='text/plan')
+    response['Content-Disposition'] = 'attachment; filename="ingredients.txt"'
     return response
 
 
 def custom_delete(data: dict, model: models.Model, message: str) -> Response:
     """
     Удаление объектов из M2M таблиц.
-    Корзина, избранное, подписки.
+    Корзина, избранное, подписки. Ответ 204 получает только
+    запрос, который действительно удалил строку.
     """
-    try:
-        obj = model.objects.get(**data)
-        obj.delete()
+    if delete_links(model.objects.filter(**data)):
         return Response(status=status.HTTP_204_NO_CONTENT)
-    except model.DoesNotExist:
-        return Response({'errors': message},
-                        status=status.HTTP_404_NOT_FOUND)
+    return Response({'errors': message},
+                    status=status.HTTP_404_NOT_FOUND)
+
+
+def get_filters_hash(query_params) -> str:
+    """
+    Хеш фильтров списка рецептов: параметры без PRESENTATION_PARAMS
+    и пустых значений, отсортированные вместе со значениями, поэтому
+    ?tags=a&tags=b и ?tags=b&tags=a дают один хеш.
+    """
+    filters = sorted(
+        (name, sorted(value for value in values if value))
+        for name, values in query_params.lists()
+        if name not in PRESENTATION_PARAMS and any(values))
+    return hashlib.md5(repr(filters).encode()).hexdigest()
+
+
+def get_recipe_facets(recipes: models.QuerySet, names: set) -> dict:
+    """
+    Число рецептов выборки по тегам и авторам. Авторы считаются
+    группировкой самой выборки, COUNT DISTINCT убирает повторы
+    от JOIN фильтров. Теги считаются по связям рецептов из подзапроса
+    id без JOIN с таблицей тегов. Названия читаются отдельным запросом
+    только для FACET_LIMIT верхних значений.
+    """
+    recipes = recipes.order_by()
+    facets = {}
+    if 'tags' in names:
+        links = RecipeTag.objects.all()
+        if recipes.query.has_filters():
+            ids = recipes.values('id')
+            # Для IN повторы не важны, DISTINCT только замедляет подзапрос
+            ids.query.distinct = False
+            links = links.filter(recipe__in=ids)
+        counts = list(links.values_list('tag').annotate(count=Count('id'))
+                      .order_by('-count', 'tag')[:FACET_LIMIT])
+        tags = Tag.objects.in_bulk([tag_id for tag_id, _ in counts])
+        facets['tags'] = [
+            {'id': tag_id, 'name': tags[tag_id].name,
+             'slug': tags[tag_id].slug, 'count': count}
+            for tag_id, count in counts]
+    if 'author' in names:
+        counts = list(recipes.values_list('author')
+                      .annotate(count=Count('id', distinct=True))
+                      .order_by('-count', 'author')[:FACET_LIMIT])
+        usernames = dict(User.objects.filter(
+            id__in=[author_id for author_id, _ in counts]
+        ).values_list('id', 'username'))
+        facets['author'] = [
+            {'id': author_id, 'username': usernames[author_id],
+             'count': count}
+            for author_id, count in counts]
+    return facets
+
+
+def get_user_state(user: User) -> tuple:
+    """
+    Состояние пользовательских флагов: количество и последний id
+    избранного, корзины и подписок. Одним запросом.
+    """
+    annotations = {}
+    for name, model in (('favorites', Favorite),
+                        ('shopping_carts', ShoppingCart),
+                        ('follows', Follow)):
+        links = (model.objects.filter(user=OuterRef('pk'))
+                 .order_by().values('user'))
+        annotations[f'{name}_count'] = Subquery(
+            links.annotate(count=Count('id')).values('count'))
+        annotations[f'{name}_last'] = Subquery(
+            links.annotate(last=Max('id')).values('last'))
+    return (User.objects.filter(pk=user.pk)
+            .annotate(**annotations)
+            .values_list(*annotations)
+            .get())
+
+
+def get_recipe_validators(request, queryset: models.QuerySet) -> tuple:
+    """
+    Валидаторы условного GET для выборки рецептов. Изменение тега,
+    ингредиента или автора обновляет дату изменения его рецептов,
+    см. recipes.signals. Возвращает пару (etag, last_modified).
+    """
+    state = queryset.order_by().aggregate(
+        count=Count('id', distinct=True), last_modified=Max('updated'))
+    user_state = ()
+    last_modified = state['last_modified']
+    if request.user.is_authenticated:
+        user_state = get_user_state(request.user)
+        # Флаги пользователя не имеют даты изменения,
+        # поэтому для него валидатором служит только ETag
+        last_modified = None
+    # Набор полей ответа (fields, omit, facets) и порции тоже
+    # различают представления
+    scores_state = None
+    ordering = request.query_params.get('ordering', '')
+    if 'popular' in ordering or 'trending' in ordering:
+        # Порядок зависит от рейтингов, которые меняют другие пользователи
+        scores_state = RecipeScore.objects.aggregate(
+            updated=Max('updated'))['updated']
+    raw = (f'{request.accepted_renderer.format}:{state["count"]}:'
+           f'{state["last_modified"]}:{request.user.pk}:{user_state}:'
+           f'{request.query_params.get("fields")}:'
+           f'{request.query_params.get("omit")}:{ordering}:{scores_state}:'
+           f'{request.query_params.get("facets")}:'
+           f'{request.query_params.get("servings")}')
+    etag = quote_etag(hashlib.md5(raw.encode()).hexdigest())
+    return etag, last_modified
@@ -1,37 +1,71 @@
+import codecs
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import filters, mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
-from api.filters import IngredientSearch, RecipeFilterSet
+from api.filters import IngredientSearch, RecipeFilterSet, RecipeOrderingFilter
+from api.mixins import (CachedCatalogMixin, ConditionalGetMixin,
+                        ReplicaReadMixin, SparseFieldsMixin, parse_field_names)
 from api.pagination import CustomPagination
 from api.permissions import ReadOnly
-from api.serializers import (FavoriteSerializer, IngredientSerializer,
-                             RecipeSerializer, RecipeWriteSerializer,
-                             ShoppingCartSerializer, SubscriptionsSerializer,
-                             TagSerializer, UserSerializer)
-from api.utils import custom_delete, make_file
+from api.serializers import (ChangeSerializer, FavoriteSerializer,
+                             IngredientSerializer, JobSerializer,
+                             RecipeSerializer, RecipeShortSerializer,
+                             RecipeWriteSerializer, ShoppingCartSerializer,
+                             SubscriptionsSerializer, TagSerializer,
+                             UserSerializer)
+from api.utils import (RECIPE_FACETS, check_ids, custom_delete,
+                       get_filters_hash, get_recipe_facets,
+                       get_recipe_validators, get_recipes_limit,
+                       get_shopping_list, make_file, parse_ids,
+                       prepare_recipes, prepare_subscriptions)
+from changes.log import get_changes, get_horizon, get_latest
+from changes.models import Change
+from core.db import insert_ignore
+from jobs.models import Job
+from jobs.queue import enqueue
+from recipes.deletion import delete_recipes
 from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.transfer import export_recipes, import_recipes
+from recipes.units import parse_servings
 from users.models import Follow, User
 
+# Максимум рецептов в одном запросе bulk_retrieve
+RECIPE_BULK_MAX_IDS = settings.RECIPE_BULK_MAX_IDS
+FACET_CACHE_TIMEOUT = settings.FACET_CACHE_TIMEOUT
+
 
-class TagListRetrieveViewSet(mixins.ListModelMixin,
+class TagListRetrieveViewSet(ReplicaReadMixin,
+                             CachedCatalogMixin,
+                             mixins.ListModelMixin,
                              mixins.RetrieveModelMixin,
                              viewsets.GenericViewSet):
     """Получает теги списком или по одному."""
+    catalog_name = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = [ReadOnly | IsAuthenticated]
 
 
-class IngredientListRetrieveViewSet(mixins.ListModelMixin,
+class IngredientListRetrieveViewSet(ReplicaReadMixin,
+                                    CachedCatalogMixin,
+                                    mixins.ListModelMixin,
                                     mixins.RetrieveModelMixin,
                                     viewsets.GenericViewSet):
     """Получает ингердиенты списком или по одному."""
+    catalog_name = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
@@ -40,23 +74,90 @@ class IngredientListRetrieveViewSet(mixins.ListModelMixin,
     ordering = ('name',)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, ConditionalGetMixin, SparseFieldsMixin,
+                    viewsets.ModelViewSet):
     """
     Выполняет методы GET, POST, PATCH, DELETE с рецептами.
+    Поля ответа выбираются параметрами fields и omit,
+    счетчики по тегам и авторам - параметром facets, количества
+    ингредиентов рецепта на N порций - параметром servings.
     """
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     http_method_names = ['get', 'post', 'patch', 'delete']
     permission_classes = [ReadOnly | IsAuthenticated]
-    filter_backends = (filters.OrderingFilter, DjangoFilterBackend)
+    filter_backends = (RecipeOrderingFilter, DjangoFilterBackend)
     filterset_class = RecipeFilterSet
     ordering = ('-id',)
+    sparse_actions = ('list', 'retrieve', 'bulk_retrieve')
 
     def get_serializer_class(self):
         if self.action in ('create', 'update', 'partial_update', 'destroy'):
             return RecipeWriteSerializer
         return self.serializer_class
 
+    def trim_queryset(self, queryset, fields: set):
+        """Связанные объекты и флаги запрашиваются только для ответа."""
+        queryset = super().trim_queryset(queryset, fields)
+        return prepare_recipes(queryset, self.request.user, fields)
+
+    def get_serializer_context(self):
+        """
+        ?servings=N у одного рецепта пересчитывает количества
+        ингредиентов на N порций (N может быть дробным: 1.5, 1/2).
+        """
+        context = super().get_serializer_context()
+        servings = self.request.query_params.get('servings')
+        if self.action == 'retrieve' and servings is not None:
+            try:
+                context['servings'] = parse_servings(servings)
+            except ValueError as error:
+                raise ValidationError({'servings': str(error)})
+        return context
+
+    def get_validators(self, request) -> tuple:
+        """
+        Валидаторы условного GET без сериализации рецептов. Агрегат
+        считается по выборке только с фильтрами: аннотации флагов
+        и сортировка сделали бы из него подзапрос.
+        """
+        if self.action == 'retrieve':
+            # Как get_object(): id не числом - 404, а не ошибка сервера
+            try:
+                queryset = Recipe.objects.filter(pk=self.kwargs['pk'])
+            except (TypeError, ValueError):
+                raise Http404
+        else:
+            queryset = DjangoFilterBackend().filter_queryset(
+                request, Recipe.objects.all(), self)
+        self.etag, last_modified = get_recipe_validators(request, queryset)
+        return self.etag, last_modified
+
+    def get_paginated_response(self, data):
+        """
+        С параметром ?facets=tags,author добавляет счетчики фасетов.
+        Ключ кеша - хеш фильтров, набор фасетов и ETag выборки как
+        состояние данных, поэтому страницы одного списка считают
+        счетчики один раз, а разные фильтры не делят их.
+        """
+        response = super().get_paginated_response(data)
+        names = parse_field_names(self.request.query_params.get('facets', ''))
+        unknown = sorted(names - set(RECIPE_FACETS))
+        if unknown:
+            raise ValidationError(
+                {'facets': f'Неизвестные фасеты: {", ".join(unknown)}.'})
+        if names:
+            key = (f'recipe_facets:'
+                   f'{get_filters_hash(self.request.query_params)}:'
+                   f'{",".join(sorted(names))}:{self.etag}')
+            facets = cache.get(key)
+            if facets is None:
+                facets = get_recipe_facets(
+                    self.filter_queryset(Recipe.objects.all()), names)
+                cache.set(key, facets, FACET_CACHE_TIMEOUT)
+            response.data['facets'] = facets
+        return response
+
     def create(self, request, *args, **kwargs):
         """Переопределям ответ с полным набором полей."""
         serializer = self.get_serializer(data=request.data)
@@ -76,89 +177,213 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return Response(response_serializer.data,
                         status=status.HTTP_200_OK)
 
-    @action(detail=True, methods=('post', 'delete'))
+    def perform_destroy(self, instance):
+        """Удаление без загрузки избранного и корзин в память."""
+        delete_recipes(Recipe.objects.filter(pk=instance.pk))
+
+    @action(detail=False, methods=('post',),
+            permission_classes=(IsAuthenticated,))
+    def bulk_delete(self, request):
+        """
+        Удаление рецептов по списку ids. Пользователь удаляет только
+        свои рецепты, администратор - любые.
+        """
+        ids = request.data.get('ids')
+        if (not isinstance(ids, list)
+                or not all(isinstance(pk, int) for pk in ids)):
+            return Response({'errors': 'Передайте список id в поле ids.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        recipes = Recipe.objects.filter(id__in=ids)
+        if not request.user.is_staff:
+            recipes = recipes.filter(author=request.user)
+        return Response(delete_recipes(recipes), status=status.HTTP_200_OK)
+
+    def get_bulk_ids(self, request) -> list:
+        """
+        Список id из ?ids=1,2,3 или из тела POST {"ids": [1, 2, 3]}
+        без повторов, не длиннее RECIPE_BULK_MAX_IDS.
+        """
+        if request.method == 'POST':
+            ids = request.data.get('ids')
+            if not isinstance(ids, list):
+                raise ValidationError(
+                    {'ids': 'Передайте список id в поле ids.'})
+            check_ids(ids)
+        else:
+            ids = parse_ids(request.query_params.get('ids', ''))
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            raise ValidationError({'ids': 'Укажите хотя бы один id.'})
+        if len(ids) > RECIPE_BULK_MAX_IDS:
+            raise ValidationError(
+                {'ids': f'Не больше {RECIPE_BULK_MAX_IDS} id за запрос.'})
+        return ids
+
+    @action(detail=False, methods=('get', 'post'), url_path='bulk',
+            permission_classes=(AllowAny,))
+    def bulk_retrieve(self, request):
+        """
+        Несколько рецептов одним запросом в порядке переданных id.
+        Связи и флаги пользователя загружаются для всех рецептов
+        сразу, несуществующие id пропускаются.
+        """
+        ids = self.get_bulk_ids(request)
+        recipes = self.get_queryset().filter(id__in=ids).in_bulk()
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=('post', 'patch', 'delete'))
     def shopping_cart(self, request, pk) -> Response:
-        """Добавляет/удаляет рецепт в корзине."""
-        recipe = get_object_or_404(Recipe, id=pk)
+        """
+        Добавляет/удаляет рецепт в корзине.
+        PATCH меняет количество порций (servings).
+        """
         user = request.user
 
+        # Удаление записи, рецепт загружать не нужно
+        if request.method == 'DELETE':
+            message = 'Рецепт не найден в корзине.'
+            response = custom_delete(data={'recipe_id': pk, 'user': user},
+                                     model=ShoppingCart, message=message)
+            return response
+
+        recipe = get_object_or_404(Recipe, id=pk)
+
         # Создание записи
         if request.method == 'POST':
             serilizer = ShoppingCartSerializer(
                 recipe,
-                data={},
+                data=request.data,
                 context={'request': request})
             serilizer.is_valid(raise_exception=True)
-            user.shopping_carts.create(recipe=recipe)
+            shopping_cart = ShoppingCart(
+                user=user, recipe=recipe,
+                servings=serilizer.validated_data['servings'])
+            if not insert_ignore(shopping_cart):
+                return Response({'errors': 'Рецепт уже в корзине.'},
+                                status=status.HTTP_400_BAD_REQUEST)
 
-            return Response(serilizer.data, status=status.HTTP_201_CREATED)
+            return Response({**serilizer.data,
+                             'servings': shopping_cart.servings},
+                            status=status.HTTP_201_CREATED)
 
-        # Удаление записи
-        if request.method == 'DELETE':
-            message = 'Рецепт не найден в корзине.'
-            response = custom_delete(data={'recipe': recipe, 'user': user},
-                                     model=ShoppingCart, message=message)
-            return response
+        # Изменение порций
+        if request.method == 'PATCH':
+            shopping_cart = get_object_or_404(ShoppingCart,
+                                              recipe=recipe, user=user)
+            serilizer = ShoppingCartSerializer(
+                recipe,
+                data=request.data,
+                context={'request': request})
+            serilizer.is_valid(raise_exception=True)
+            shopping_cart.servings = serilizer.validated_data['servings']
+            shopping_cart.save(update_fields=('servings',))
+
+            return Response({**serilizer.data,
+                             'servings': shopping_cart.servings},
+                            status=status.HTTP_200_OK)
 
     @action(detail=True, methods=('post', 'delete'))
     def favorite(self, request, pk):
         """Добавляет/удаляет рецепт в избранном."""
-        recipe = get_object_or_404(Recipe, id=pk)
         user = request.user
 
         # Создание записи
         if request.method == 'POST':
+            recipe = get_object_or_404(Recipe, id=pk)
             serilizer = FavoriteSerializer(
                 recipe,
                 data={},
                 context={'request': request})
             serilizer.is_valid(raise_exception=True)
-            user.favorites.create(recipe=recipe)
+            if not insert_ignore(Favorite(user=user, recipe=recipe)):
+                return Response({'errors': 'Рецепт уже в избранном.'},
+                                status=status.HTTP_400_BAD_REQUEST)
 
             return Response(serilizer.data, status=status.HTTP_201_CREATED)
 
         # Удаление записи
         if request.method == 'DELETE':
             message = 'Рецепт не найден в избранном.'
-            response = custom_delete(data={'recipe': recipe, 'user': user},
+            response = custom_delete(data={'recipe_id': pk, 'user': user},
                                      model=Favorite, message=message)
             return response
 
-    @action(detail=False, methods=('get',))
+    @action(detail=False, methods=('get',),
+            permission_classes=(IsAuthenticated,))
+    def shopping_list(self, request):
+        """Список покупок в JSON, количества в базовых единицах."""
+        return Response(get_shopping_list(request.user),
+                        status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=('get',),
+            permission_classes=(IsAuthenticated,))
     def download_shopping_cart(self, request):
-        ingr_list = {}
-        user = request.user
-        shopping_cart = user.shopping_carts.all().select_related('recipe')
-
-        for shopping_cart in shopping_cart:
-            recipe = shopping_cart.recipe
-            recipe_ingredients = recipe.recipe_igredient.all().select_related(
-                'ingredient')
-            for recipe_ingredient in recipe_ingredients:
-                name = (f'{recipe_ingredient.ingredient.name} '
-                        f'({recipe_ingredient.ingredient.measurement_unit})')
-                amount = recipe_ingredient.amount
-                ingr_list.setdefault(name, 0)
-                ingr_list[name] += amount
-        return make_file(ingr_list)
-
-
-class CustomUserViewSet(DjoserUserViewSet):
+        """
+        Файл со списком покупок. С параметром async=1 файл готовится
+        фоновой задачей, в ответ 202 с id задачи.
+        """
+        if request.query_params.get('async') in ('1', 'true'):
+            job = enqueue('shopping_cart', user=request.user)
+            serializer = JobSerializer(job, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED,
+                            headers={'Location': reverse(
+                                'jobs-detail', args=(job.id,),
+                                request=request)})
+        return make_file(get_shopping_list(request.user))
+
+    @action(detail=False, methods=('get',),
+            permission_classes=(IsAdminUser,))
+    def export(self, request):
+        """Потоковая выгрузка всех рецептов в JSON Lines."""
+        response = StreamingHttpResponse(
+            export_recipes(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = (
+            'attachment; filename="recipes.jsonl"')
+        return response
+
+    @action(detail=False, methods=('post',), url_path='import',
+            permission_classes=(IsAdminUser,))
+    def import_recipes(self, request):
+        """Пакетная загрузка рецептов из файла JSON Lines."""
+        jsonl_file = request.FILES.get('file')
+        if jsonl_file is None:
+            return Response({'errors': 'Передайте файл в поле file.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        stats = import_recipes(codecs.iterdecode(jsonl_file, 'utf-8'))
+        return Response(stats, status=status.HTTP_201_CREATED)
+
+
+class CustomUserViewSet(ReplicaReadMixin, SparseFieldsMixin,
+                        DjoserUserViewSet):
     """
     Расширяет стандарный UserViewSet из djoser, для работы
-    url-ов subscriptions и subscribe.
+    url-ов subscriptions, subscribe и profile.
+    Поля ответа выбираются параметрами fields и omit.
     """
     filter_backends = (filters.OrderingFilter,)
     ordering = ('-id',)
     permission_classes = [ReadOnly | IsAuthenticated]
+    sparse_actions = ('list', 'retrieve', 'me')
+
+    def trim_queryset(self, queryset, fields: set):
+        """Флаг подписки считается в той же выборке."""
+        queryset = super().trim_queryset(queryset, fields)
+        user = self.request.user
+        if 'is_subscribed' in fields and user.is_authenticated:
+            queryset = queryset.annotate(subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('pk'))))
+        return queryset
 
     @action(detail=False, permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
         """Список подписок пользователя."""
         pagination = CustomPagination()
         authors_id = request.user.follower.all().values_list('author')
-        authors = (User.objects.filter(id__in=authors_id)
-                   .prefetch_related('recipes'))
+        authors = prepare_subscriptions(
+            User.objects.filter(id__in=authors_id).order_by('-id'),
+            get_recipes_limit(request))
         page = pagination.paginate_queryset(authors, request)
         serializer = SubscriptionsSerializer(
             page, many=True, context={'request': request})
@@ -168,30 +393,147 @@ class CustomUserViewSet(DjoserUserViewSet):
     @action(detail=True, methods=('post', 'delete'))
     def subscribe(self, request, id) -> Response:
         """Создает/удаляет подписку на автора."""
-        author = get_object_or_404(User, id=id)
         user = request.user
 
         # Создание записи
         if request.method == 'POST':
+            author = get_object_or_404(User, id=id)
             serializer = SubscriptionsSerializer(
                 author,
                 data={},
                 context={'request': request})
             serializer.is_valid(raise_exception=True)
-            user.follower.create(author=author)
+            if not insert_ignore(Follow(user=user, author=author)):
+                return Response({'errors': 'Уже в подписках.'},
+                                status=status.HTTP_400_BAD_REQUEST)
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         # Удаление записи
         if request.method == 'DELETE':
             message = 'Подписка отсутсвует.'
-            response = custom_delete(data={'author': author, 'user': user},
+            response = custom_delete(data={'author_id': id, 'user': user},
                                      model=Follow, message=message)
             return response
 
+    @action(detail=True, methods=('get',), permission_classes=(AllowAny,))
+    def profile(self, request, id) -> Response:
+        """
+        Страница автора одним ответом: автор с флагом подписки, число
+        рецептов и первая страница его рецептов (параметр limit).
+        Рецепты и их число читаются по индексу (author, -id), число
+        не считается, если рецепты поместились на страницу.
+        """
+        author = get_object_or_404(
+            self.trim_queryset(User.objects.all(),
+                               set(UserSerializer.Meta.fields)), id=id)
+        limit = CustomPagination().get_page_size(request)
+        # Лишний рецепт показывает, есть ли следующая страница
+        recipes = list(prepare_recipes(
+            Recipe.objects.filter(author=author).order_by('-id'),
+            request.user, set(RecipeSerializer().fields))[:limit + 1])
+        has_more = len(recipes) > limit
+        recipes_count = (Recipe.objects.filter(author=author).count()
+                         if has_more else len(recipes))
+        next_url = None
+        if has_more:
+            next_url = (f'{reverse("recipe-list", request=request)}'
+                        f'?author={author.id}&page=2&limit={limit}')
+        context = self.get_serializer_context()
+        return Response({
+            **UserSerializer(author, context=context).data,
+            'recipes_count': recipes_count,
+            'recipes': RecipeSerializer(recipes[:limit], many=True,
+                                        context=context).data,
+            'next': next_url,
+        }, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=('get',),
             permission_classes=(IsAuthenticated,))
     def me(self, request):
         """Переопределил me для ограничения до метода GET."""
-        serializer = UserSerializer(request.user, context={'request': request})
+        serializer = self.get_serializer(request.user)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class JobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Статус фоновых задач пользователя и скачивание результата."""
+    serializer_class = JobSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    @action(detail=True, methods=('get',))
+    def download(self, request, pk):
+        """Скачивание файла, подготовленного задачей."""
+        job = self.get_object()
+        if job.status != Job.DONE or not job.result:
+            return Response({'errors': 'Результат задачи еще не готов.'},
+                            status=status.HTTP_409_CONFLICT)
+        return FileResponse(job.result.open('rb'), as_attachment=True,
+                            filename=job.result.name.split('/')[-1])
+
+
+class ChangeViewSet(ReplicaReadMixin, viewsets.GenericViewSet):
+    """
+    Журнал изменений для синхронизации клиентов: GET ?since=<seq>
+    возвращает изменения после seq пачками, ?models= ограничивает
+    модели. Если журнал сжат дальше since, ответ 410 и номер,
+    с которого продолжать после полной загрузки.
+    """
+    serializer_class = ChangeSerializer
+    permission_classes = (ReadOnly,)
+    catalog = {'recipe': (Recipe, RecipeShortSerializer),
+               'ingredient': (Ingredient, IngredientSerializer),
+               'tag': (Tag, TagSerializer)}
+
+    def get_change_data(self, changes: list) -> dict:
+        """Текущее состояние объектов, по одному запросу на модель."""
+        upserts = {}
+        for change in changes:
+            if change.action == Change.UPSERT:
+                upserts.setdefault(change.model, set()).add(change.object_id)
+        data = {}
+        for name, (model, serializer_class) in self.catalog.items():
+            if name not in upserts:
+                continue
+            objs = model.objects.filter(id__in=upserts[name])
+            for item in serializer_class(objs, many=True,
+                                         context=self.get_serializer_context()
+                                         ).data:
+                data[(name, item['id'])] = item
+        if 'shopping_cart' in upserts:
+            data.update(
+                (('shopping_cart', recipe_id), {'servings': servings})
+                for recipe_id, servings in ShoppingCart.objects.filter(
+                    user=self.request.user,
+                    recipe_id__in=upserts['shopping_cart']
+                ).values_list('recipe_id', 'servings'))
+        return data
+
+    def list(self, request):
+        since = request.query_params.get('since', '0')
+        if not since.isdigit():
+            raise ValidationError({'since': 'Укажите номер изменения.'})
+        since = int(since)
+        models = parse_field_names(request.query_params.get('models', ''))
+        unknown = sorted(models - set(dict(Change.MODELS)))
+        if unknown:
+            raise ValidationError(
+                {'models': f'Неизвестные модели: {", ".join(unknown)}.'})
+        horizon = get_horizon()
+        if since < horizon:
+            return Response(
+                {'errors': 'Журнал сжат, загрузите данные заново.',
+                 'next': max(get_latest(), horizon)},
+                status=status.HTTP_410_GONE)
+        changes, has_more = get_changes(request.user, since, models=models)
+        serializer = self.get_serializer(
+            changes, many=True,
+            context={**self.get_serializer_context(),
+                     'data': self.get_change_data(changes)})
+        return Response({'changes': serializer.data,
+                         'next': changes[-1].seq if changes else since,
+                         'has_more': has_more},
+                        status=status.HTTP_200_OK)
@@ -0,0 +1,16 @@
+from django.contrib import admin
+
+from changes.models import Change, Compaction
+
+
+@admin.register(Change)
+class ChangeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'seq', 'model', 'object_id', 'action', 'user',
+                    'created')
+    list_filter = ('model', 'action')
+    raw_id_fields = ('user',)
+
+
+@admin.register(Compaction)
+class CompactionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'horizon', 'removed', 'created')
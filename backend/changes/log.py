@@ -0,0 +1,135 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Exists, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from changes.models import Change, Compaction
+
+CHANGE_FEED_BATCH_SIZE = settings.CHANGE_FEED_BATCH_SIZE
+# Ключ рекомендательной блокировки PostgreSQL, под которой
+# выдаются номера изменений
+CHANGE_SEQUENCE_LOCK = 4045
+CHANGE_RETENTION_DAYS = settings.CHANGE_RETENTION_DAYS
+CHANGE_BATCH_SIZE = settings.DELETION_BATCH_SIZE
+
+
+def record_change(model: str, object_id: int, action: str,
+                  user_id: int = None) -> None:
+    Change.objects.create(model=model, object_id=object_id, action=action,
+                          user_id=user_id)
+
+
+def record_changes(model: str, object_ids, action: str, user_ids=None,
+                   batch_size: int = CHANGE_BATCH_SIZE) -> None:
+    """
+    Запись изменений для массовых операций в обход сигналов.
+    user_ids - список той же длины, что и object_ids, или None.
+    """
+    object_ids = list(object_ids)
+    if user_ids is None:
+        user_ids = [None] * len(object_ids)
+    Change.objects.bulk_create(
+        (Change(model=model, object_id=object_id, action=action,
+                user_id=user_id)
+         for object_id, user_id in zip(object_ids, user_ids)),
+        batch_size=batch_size)
+
+
+def sequence_changes() -> int:
+    """
+    Выдает номера seq зафиксированным изменениям одним UPDATE под
+    блокировкой. Изменение из транзакции, которая зафиксирована
+    позже, получает номер больше всех уже выданных, даже если его id
+    меньше, поэтому клиент с курсором по seq его не пропустит.
+    В SQLite запись и так идет по одной. Возвращает число номеров.
+    """
+    using = router.db_for_write(Change)
+    last = Change.objects.filter(seq__isnull=False).order_by(
+        '-seq').values('seq')[:1]
+    first = Change.objects.filter(seq__isnull=True).order_by(
+        'id').values('id')[:1]
+    with transaction.atomic(using=using, savepoint=False):
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)',
+                               [CHANGE_SEQUENCE_LOCK])
+        return Change.objects.using(using).filter(seq__isnull=True).update(
+            seq=F('id') - Subquery(first) + Coalesce(Subquery(last), 0) + 1)
+
+
+def get_latest() -> int:
+    """Последний выданный номер изменения."""
+    return Change.objects.aggregate(latest=Max('seq'))['latest'] or 0
+
+
+def get_horizon() -> int:
+    """Номер, до которого журнал удален сжатием."""
+    return Compaction.objects.aggregate(
+        horizon=Max('horizon'))['horizon'] or 0
+
+
+def get_changes(user, since: int, limit: int = CHANGE_FEED_BATCH_SIZE,
+                models: set = None) -> tuple:
+    """
+    Изменения с номером больше since, видимые пользователю: общие
+    и его собственные. Изменения без номера еще не отдаются.
+    Возвращает (список изменений, есть ли еще).
+    """
+    sequence_changes()
+    changes = Change.objects.filter(seq__gt=since)
+    if user.is_authenticated:
+        changes = changes.filter(Q(user__isnull=True) | Q(user=user))
+    else:
+        changes = changes.filter(user__isnull=True)
+    if models:
+        changes = changes.filter(model__in=models)
+    changes = list(changes.order_by('seq')[:limit + 1])
+    return changes[:limit], len(changes) > limit
+
+
+def compact_changes(retention_days: int = CHANGE_RETENTION_DAYS,
+                    batch_size: int = CHANGE_BATCH_SIZE) -> dict:
+    """
+    Сжатие журнала: из нескольких изменений одного объекта остается
+    последнее, изменения старше retention_days удаляются. Клиентам,
+    которые не синхронизировались дольше, нужна полная загрузка.
+    Сжимаются только изменения с номером.
+    """
+    stats = {'duplicates': 0, 'expired': 0}
+    sequence_changes()
+    horizon = Change.objects.filter(
+        created__lt=timezone.now() - timedelta(days=retention_days)
+    ).aggregate(horizon=Max('seq'))['horizon']
+    if horizon:
+        last_seq = 0
+        while last_seq < horizon:
+            stats['expired'] += Change.objects.filter(
+                seq__gt=last_seq, seq__lte=min(last_seq + batch_size, horizon)
+            )._raw_delete(Change.objects.db)
+            last_seq += batch_size
+        Compaction.objects.create(horizon=horizon, removed=stats['expired'])
+
+    newer = Change.objects.filter(model=OuterRef('model'),
+                                  object_id=OuterRef('object_id'),
+                                  seq__gt=OuterRef('seq'))
+    # NULL не равен NULL, общие изменения сравниваются отдельно
+    duplicates = (
+        Change.objects.filter(user__isnull=True)
+        .filter(Exists(newer.filter(user__isnull=True))),
+        Change.objects.filter(user__isnull=False)
+        .filter(Exists(newer.filter(user=OuterRef('user')))),
+    )
+    last_seq = horizon or 0
+    latest = get_latest()
+    while last_seq < latest:
+        with transaction.atomic():
+            for queryset in duplicates:
+                stats['duplicates'] += queryset.filter(
+                    seq__gt=last_seq, seq__lte=last_seq + batch_size
+                )._raw_delete(Change.objects.db)
+        last_seq += batch_size
+    return stats
@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand
+
+from changes.log import (CHANGE_BATCH_SIZE, CHANGE_RETENTION_DAYS,
+                         compact_changes)
+
+
+class Command(BaseCommand):
+    help = 'Сжатие журнала изменений для синхронизации клиентов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int,
+                            default=CHANGE_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int,
+                            default=CHANGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        stats = compact_changes(options['retention_days'],
+                                options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено повторов: {stats["duplicates"]}, '
+            f'устаревших изменений: {stats["expired"]}.'))
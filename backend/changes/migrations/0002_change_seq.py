@@ -0,0 +1,50 @@
+# flake8: noqa
+# Generated by Django 3.2.3 on 2026-10-19 20:36
+
+from django.db import migrations, models
+
+
+def number_existing_changes(apps, schema_editor):
+    """
+    Записи до миграции получают номер, равный id: номера,
+    сохраненные клиентами, и горизонты сжатия остаются верными.
+    """
+    Change = apps.get_model('changes', 'Change')
+    Change.objects.update(seq=models.F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('changes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='change',
+            name='change_user_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='change',
+            name='change_object_idx',
+        ),
+        migrations.AddField(
+            model_name='change',
+            name='seq',
+            field=models.BigIntegerField(blank=True, null=True, unique=True, verbose_name='Номер'),
+        ),
+        migrations.RunPython(number_existing_changes,
+                             migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['user', 'seq'], name='change_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['model', 'object_id', 'seq'], name='change_object_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(condition=models.Q(('seq__isnull', True)), fields=['id'], name='change_unsequenced_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.db import models
+
+from users.models import User
+
+
+class Change(models.Model):
+    """
+    Запись журнала изменений. seq служит номером изменения
+    для клиентов, которые синхронизируются по ?since=: его выдает
+    sequence_changes после фиксации записи, в порядке фиксации.
+    Изменения избранного, корзины и подписок видны только
+    их пользователю, object_id у них - id рецепта или автора.
+    """
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTIONS = (
+        (UPSERT, 'Создание или изменение'),
+        (DELETE, 'Удаление'),
+    )
+    MODELS = (
+        ('recipe', 'Рецепт'),
+        ('ingredient', 'Ингредиент'),
+        ('tag', 'Тег'),
+        ('favorite', 'Избранное'),
+        ('shopping_cart', 'Корзина'),
+        ('follow', 'Подписка'),
+    )
+
+    model = models.CharField('Модель', max_length=20, choices=MODELS)
+    object_id = models.BigIntegerField('id объекта')
+    action = models.CharField('Действие', max_length=10, choices=ACTIONS)
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             null=True,
+                             blank=True,
+                             related_name='changes',
+                             verbose_name='Пользователь')
+    created = models.DateTimeField('Дата', auto_now_add=True)
+    seq = models.BigIntegerField('Номер', null=True, blank=True, unique=True)
+
+    class Meta:
+        verbose_name = 'Изменение'
+        verbose_name_plural = 'Журнал изменений'
+        indexes = [
+            models.Index(fields=('user', 'seq'), name='change_user_seq_idx'),
+            models.Index(fields=('model', 'object_id', 'seq'),
+                         name='change_object_seq_idx'),
+            models.Index(fields=('id',), condition=models.Q(seq__isnull=True),
+                         name='change_unsequenced_idx'),
+        ]
+
+    def __str__(self):
+        return f'#{self.seq} {self.action} {self.model} {self.object_id}'
+
+
+class Compaction(models.Model):
+    """
+    Запуск сжатия журнала. Изменения с номером не больше horizon
+    удалены, клиентам с since меньше horizon нужна полная загрузка.
+    """
+    horizon = models.BigIntegerField('Удалены изменения до номера')
+    removed = models.PositiveIntegerField('Удалено записей')
+    created = models.DateTimeField('Дата', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Сжатие журнала'
+        verbose_name_plural = 'Сжатия журнала'
+
+    def __str__(self):
+        return f'до #{self.horizon}'
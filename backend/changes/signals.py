@@ -0,0 +1,45 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from changes.log import record_change
+from changes.models import Change
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import Follow
+
+CATALOG_MODELS = {Recipe: 'recipe', Ingredient: 'ingredient', Tag: 'tag'}
+# Связи пользователя: имя в журнале и поле с id объекта
+USER_MODELS = {Favorite: ('favorite', 'recipe_id'),
+               ShoppingCart: ('shopping_cart', 'recipe_id'),
+               Follow: ('follow', 'author_id')}
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+def record_catalog_save(sender, instance, **kwargs):
+    record_change(CATALOG_MODELS[sender], instance.pk, Change.UPSERT)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+def record_catalog_delete(sender, instance, **kwargs):
+    record_change(CATALOG_MODELS[sender], instance.pk, Change.DELETE)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def record_link_save(sender, instance, **kwargs):
+    model, field = USER_MODELS[sender]
+    record_change(model, getattr(instance, field), Change.UPSERT,
+                  instance.user_id)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Follow)
+def record_link_delete(sender, instance, **kwargs):
+    model, field = USER_MODELS[sender]
+    record_change(model, getattr(instance, field), Change.DELETE,
+                  instance.user_id)
@@ -0,0 +1,40 @@
+import gzip
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_SIZE = settings.COMPRESSION_MIN_SIZE
+# Кодировки в порядке предпочтения
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """Кодировка из Accept-Encoding или None, если сжатие не нужно."""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0
+        accepted[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(content: bytes, encoding: str, best: bool = False) -> bytes:
+    """
+    Сжатие тела ответа. best - максимальная степень для данных,
+    которые сжимаются один раз и отдаются многократно.
+    """
+    if encoding == 'br':
+        return brotli.compress(content, quality=11 if best else 5)
+    return gzip.compress(content, compresslevel=9 if best else 6, mtime=0)
@@ -0,0 +1,95 @@
+from django.db import connections, models, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.db.models.sql import DeleteQuery, InsertQuery
+
+
+def check_connections(**kwargs) -> None:
+    """
+    Закрывает оборванные постоянные соединения в начале запроса,
+    чтобы запрос открыл новое вместо ошибки на первом обращении.
+    Аналог CONN_HEALTH_CHECKS из Django 4.1.
+    """
+    for connection in connections.all():
+        if (connection.connection is not None
+                and not connection.in_atomic_block
+                and not connection.is_usable()):
+            connection.close()
+
+
+def insert_ignore(instance: models.Model) -> bool:
+    """
+    INSERT ... ON CONFLICT DO NOTHING одного объекта без предварительной
+    проверки exists(): из двух одновременных вставок одной пары
+    строку создает только одна, вторая получает False вместо
+    IntegrityError. Для вставленной строки отправляется post_save.
+    """
+    model = type(instance)
+    meta = model._meta
+    using = router.db_for_write(model, instance=instance)
+    connection = connections[using]
+    query = InsertQuery(model, ignore_conflicts=True)
+    query.insert_values(
+        [field for field in meta.local_concrete_fields
+         if field is not meta.pk], [instance])
+    compiler = query.get_compiler(using=using)
+    # PostgreSQL возвращает id через RETURNING, на конфликте строк нет
+    if connection.features.can_return_columns_from_insert:
+        compiler.returning_fields = [meta.pk]
+    [(statement, params)] = compiler.as_sql()
+    with transaction.atomic(using=using, savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute(statement, params)
+            if compiler.returning_fields:
+                row = cursor.fetchone()
+                if row is None:
+                    return False
+                instance.pk = row[0]
+            elif cursor.rowcount < 1:
+                return False
+            else:
+                instance.pk = connection.ops.last_insert_id(
+                    cursor, meta.db_table, meta.pk.column)
+        instance._state.adding = False
+        instance._state.db = using
+        post_save.send(sender=model, instance=instance, created=True,
+                       update_fields=None, raw=False, using=using)
+    return True
+
+
+def delete_links(queryset: models.QuerySet) -> int:
+    """
+    Удаляет строки выборки одним DELETE ... RETURNING и отправляет
+    post_delete только для строк, которые вернул этот запрос:
+    при одновременном удалении сигналы срабатывают один раз.
+    Для таблиц связей, на которые никто не ссылается. RETURNING
+    поддерживают PostgreSQL и SQLite с версии 3.35.
+    Возвращает количество удаленных строк.
+    """
+    model = queryset.model
+    using = queryset.db
+    connection = connections[using]
+    query = queryset.query.chain(DeleteQuery)
+    statement, params = query.get_compiler(using=using).as_sql()
+    fields = model._meta.concrete_fields
+    returning = ', '.join(connection.ops.quote_name(field.column)
+                          for field in fields)
+    with transaction.atomic(using=using, savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute(f'{statement} RETURNING {returning}', params)
+            rows = cursor.fetchall()
+        # Значения приводятся к типам полей, как при обычной выборке
+        columns = [field.get_col(model._meta.db_table) for field in fields]
+        converters = [(column, column.get_db_converters(connection)
+                       + connection.ops.get_db_converters(column))
+                      for column in columns]
+        names = [field.attname for field in fields]
+        for row in rows:
+            values = list(row)
+            for index, (column, functions) in enumerate(converters):
+                for function in functions:
+                    values[index] = function(values[index], column,
+                                             connection)
+            post_delete.send(sender=model,
+                             instance=model.from_db(using, names, values),
+                             using=using)
+    return len(rows)
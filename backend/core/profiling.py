@@ -0,0 +1,204 @@
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PROFILING_SAMPLE_RATE = settings.PROFILING_SAMPLE_RATE
+PROFILING_SECRET = settings.PROFILING_SECRET
+PROFILING_INTERVAL = settings.PROFILING_INTERVAL
+PROFILING_SLOW_QUERY_MS = settings.PROFILING_SLOW_QUERY_MS
+PROFILING_SWITCH_FILE = str(settings.PROFILING_SWITCH_FILE)
+PROFILING_HEADER = 'X-Profile'
+
+# Содержимое файла-переключателя по времени изменения файла
+_switch = {'mtime': None, 'rate': 0.0, 'until': 0.0}
+
+
+def read_switch() -> tuple:
+    """
+    Доля запросов и время окончания из файла-переключателя
+    (команда profiling). Файл перечитывается только после изменения,
+    поэтому он общий для всех воркеров и почти ничего не стоит.
+    """
+    try:
+        mtime = os.stat(PROFILING_SWITCH_FILE).st_mtime_ns
+    except OSError:
+        return 0.0, 0.0
+    if mtime != _switch['mtime']:
+        try:
+            with open(PROFILING_SWITCH_FILE) as file:
+                data = json.load(file)
+            _switch.update(rate=float(data['rate']),
+                           until=float(data['until']))
+        except (OSError, ValueError, KeyError, TypeError):
+            _switch.update(rate=0.0, until=0.0)
+        _switch['mtime'] = mtime
+    return _switch['rate'], _switch['until']
+
+
+def write_switch(rate: float, seconds: int) -> None:
+    with open(PROFILING_SWITCH_FILE, 'w') as file:
+        json.dump({'rate': rate, 'until': time.time() + seconds}, file)
+
+
+def should_profile(request) -> bool:
+    """
+    Запрос профилируется по заголовку X-Profile с PROFILING_SECRET,
+    с долей из включенного переключателя или PROFILING_SAMPLE_RATE.
+    """
+    secret = request.headers.get(PROFILING_HEADER)
+    if (PROFILING_SECRET and secret
+            and hmac.compare_digest(secret, PROFILING_SECRET)):
+        return True
+    rate, until = read_switch()
+    if until < time.time():
+        rate = PROFILING_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def folded_stack(frame) -> str:
+    """Стек в свернутом формате flamegraph: корень;...;вершина."""
+    names = []
+    while frame is not None:
+        names.append(f'{frame.f_globals.get("__name__")}:'
+                     f'{frame.f_code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """
+    Сэмплирующий профилировщик: отдельный поток каждые interval
+    секунд снимает стек потока запроса через sys._current_frames().
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILING_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[folded_stack(frame)] += 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+class QueryRecorder:
+    """Обертка execute_wrapper: SQL и время каждого запроса."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias, 'sql': sql,
+                'params': params, 'many': many,
+                'ms': round((time.perf_counter() - start) * 1000, 3)})
+
+
+def explain(alias: str, sql: str, params) -> object:
+    """
+    План SELECT: EXPLAIN (FORMAT JSON) в PostgreSQL,
+    EXPLAIN QUERY PLAN в SQLite. None, если план не получить.
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    connection = connections[alias]
+    formats = connection.features.supported_explain_formats
+    explain_format = 'JSON' if 'JSON' in formats else None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                connection.ops.explain_query_prefix(format=explain_format)
+                + ' ' + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError:
+        return None
+    if explain_format:
+        return rows[0][0]
+    return [row[-1] for row in rows]
+
+
+class RequestProfile:
+    """
+    Профиль одного запроса: сэмплы стека и SQL всех соединений.
+    Медленные SELECT дополняются планами после ответа, параметры
+    запросов в журнал не пишутся.
+    """
+
+    def __init__(self):
+        self.recorder = QueryRecorder()
+        self.sampler = StackSampler(threading.get_ident())
+        self.stack = ExitStack()
+
+    def __enter__(self):
+        for connection in connections.all():
+            self.stack.enter_context(
+                connection.execute_wrapper(self.recorder))
+        self.stack.enter_context(self.sampler)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = (time.perf_counter() - self.start) * 1000
+        self.stack.close()
+
+    def record(self, request, response) -> dict:
+        view = getattr(request, 'profiled_view', None)
+        actions = getattr(view, 'actions', None) or {}
+        view_class = getattr(view, 'cls', view)
+        user = getattr(request, 'user', None)
+        queries = self.recorder.queries
+        slow = [{'alias': query['alias'], 'sql': query['sql'],
+                 'ms': query['ms'],
+                 'plan': explain(query['alias'], query['sql'],
+                                 query['params'])}
+                for query in queries
+                if query['ms'] >= PROFILING_SLOW_QUERY_MS
+                and not query['many']]
+        return {
+            'time': time.time(),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'view': (f'{view_class.__module__}.{view_class.__qualname__}'
+                     if view_class is not None else None),
+            'action': actions.get(request.method.lower()),
+            'user_id': user.pk if user is not None else None,
+            'duration_ms': round(self.duration, 3),
+            'queries': len(queries),
+            'sql_ms': round(sum(query['ms'] for query in queries), 3),
+            'slow_queries': slow,
+            'interval_ms': self.sampler.interval * 1000,
+            'samples': dict(self.sampler.samples),
+        }
+
+    def write(self, request, response) -> None:
+        logger.info(json.dumps(self.record(request, response),
+                               ensure_ascii=False, default=str))
@@ -0,0 +1,75 @@
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+REPLICAS = [alias for alias in settings.DATABASES
+            if alias.startswith('replica_')]
+# Реплика, выбранная для текущего запроса
+current_replica = ContextVar('current_replica', default=None)
+# Сглаженное время выполнения запросов на репликах, мс
+replica_latency = {}
+
+_replica_cycle = itertools.cycle(REPLICAS)
+_cycle_lock = threading.Lock()
+LATENCY_SMOOTHING = 0.1
+
+
+def choose_replica() -> str:
+    """Реплика для запроса или None, если реплик нет."""
+    if not REPLICAS:
+        return None
+    if settings.DB_REPLICA_SELECTION == 'least_latency':
+        return min(REPLICAS, key=lambda alias: replica_latency.get(alias, 0))
+    with _cycle_lock:
+        return next(_replica_cycle)
+
+
+def track_latency(execute, sql, params, many, context):
+    """Обертка запросов реплики для выбора least_latency."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        alias = context['connection'].alias
+        elapsed = (time.perf_counter() - start) * 1000
+        previous = replica_latency.get(alias, elapsed)
+        replica_latency[alias] = (previous * (1 - LATENCY_SMOOTHING)
+                                  + elapsed * LATENCY_SMOOTHING)
+
+
+def install_latency_tracking(sender, connection, **kwargs) -> None:
+    if (connection.alias in REPLICAS
+            and track_latency not in connection.execute_wrappers):
+        connection.execute_wrappers.append(track_latency)
+
+
+def pin_to_primary(user) -> None:
+    """После записи пользователь читает свои изменения из основной базы."""
+    cache.set(f'primary_pin:{user.pk}', True,
+              settings.DB_REPLICA_PIN_SECONDS)
+
+
+def is_pinned_to_primary(user) -> bool:
+    return (user.is_authenticated
+            and cache.get(f'primary_pin:{user.pk}', False))
+
+
+class ReplicaRouter:
+    """
+    Чтение идет на реплику, выбранную для текущего запроса,
+    запись и чтение вне таких запросов - в основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        return current_replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
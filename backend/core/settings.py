@@ -15,11 +15,15 @@ DEBUG = os.getenv('DEBUG', 'DEBUG_OFF').lower() in ('true', '1', 't')
 
 ALLOWED_HOSTS = ['*']
 
+# Воркерам, которые обслуживают только API, админка не нужна:
+# без нее не импортируются admin.py приложений и import_export
+DJANGO_ADMIN_ENABLED = os.getenv(
+    'DJANGO_ADMIN_ENABLED', 'true').lower() in ('true', '1', 't')
+
 
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -32,11 +36,18 @@ INSTALLED_APPS = [
     'api',
     'recipes',
     'users',
-    'import_export',
+    'jobs',
+    'changes',
 ]
 
+if DJANGO_ADMIN_ENABLED:
+    INSTALLED_APPS = (['django.contrib.admin'] + INSTALLED_APPS
+                      + ['import_export'])
+
 MIDDLEWARE = [
+    'core.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,6 +88,13 @@ if DEBUG:
             'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
+    # Локальные реплики для проверки маршрутизации чтения
+    for number in range(1, int(os.getenv('SQLITE_REPLICAS', 0)) + 1):
+        DATABASES[f'replica_{number}'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'db_replica_{number}.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        }
 else:
     DATABASES = {
         'default': {
@@ -85,10 +103,61 @@ else:
             'USER': os.getenv('POSTGRES_USER', 'django'),
             'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
             'HOST': os.getenv('DB_HOST', ''),
-            'PORT': os.getenv('DB_PORT', 5432)
+            'PORT': os.getenv('DB_PORT', 5432),
+            # Время жизни постоянного соединения в секундах,
+            # 0 - новое соединение на каждый запрос
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            # Серверные курсоры несовместимы с pgbouncer в режиме transaction:
+            # при DB_HOST=pgbouncer они выключены, если не указано иное
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv(
+                'DB_DISABLE_SERVER_SIDE_CURSORS',
+                str(os.getenv('DB_HOST') == 'pgbouncer')
+            ).lower() in ('true', '1', 't'),
+        }
+    }
+
+    # Реплики для чтения: DB_REPLICA_HOSTS=replica1:5432,replica2
+    for number, address in enumerate(
+            filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')),
+            start=1):
+        host, _, port = address.partition(':')
+        DATABASES[f'replica_{number}'] = {
+            **DATABASES['default'],
+            'HOST': host,
+            'PORT': port or DATABASES['default']['PORT'],
+            'TEST': {'MIRROR': 'default'},
+        }
+
+# Кеш общий для всех воркеров gunicorn, фоновых задач и команд: в нем
+# закрепление за основной базой после записи, справочники, фасеты,
+# корзины ограничения запросов. CACHE_LOCATION - адреса memcached
+# через запятую. Кеш в памяти процесса - только для разработки
+CACHE_LOCATION = os.getenv('CACHE_LOCATION',
+                           '' if DEBUG else 'memcached:11211')
+if CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': CACHE_LOCATION.split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         }
     }
 
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+# Выбор реплики: round_robin или least_latency
+DB_REPLICA_SELECTION = os.getenv('DB_REPLICA_SELECTION', 'round_robin')
+# Сколько секунд после записи пользователь читает из основной базы
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 5))
+
+# Проверка постоянных соединений в начале каждого запроса
+DB_CONN_HEALTH_CHECKS = os.getenv(
+    'DB_CONN_HEALTH_CHECKS', 'true').lower() in ('true', '1', 't')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -141,6 +210,11 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 IMPORT_EXPORT_USE_TRANSACTIONS = True
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': (
+        ('api.renderers.CompactJSONRenderer',
+         'rest_framework.renderers.BrowsableAPIRenderer') if DEBUG
+        else ('api.renderers.CompactJSONRenderer',)
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
     ),
@@ -149,6 +223,32 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPagination',
     'PAGE_SIZE': 5,
+    'DEFAULT_THROTTLE_CLASSES': (
+        'api.throttling.UserTokenBucketThrottle',
+        'api.throttling.AnonTokenBucketThrottle',
+    ),
+    # Количество прокси перед backend для определения IP клиента
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 1)),
+}
+
+# Ограничение запросов: local - корзины в памяти воркера (лимит
+# умножается на число воркеров), cache - общий кеш Django
+THROTTLE_STORE = os.getenv('THROTTLE_STORE', 'local' if DEBUG else 'cache')
+# Емкость корзины и пополнение в токенах в секунду
+THROTTLE_BUCKETS = {
+    'user': {'capacity': 120, 'rate': 2},
+    'anon': {'capacity': 60, 'rate': 1},
+}
+# Стоимость действий view в токенах, по умолчанию 1
+THROTTLE_ACTION_COSTS = {
+    'list': 2,
+    'bulk_retrieve': 2,
+    'create': 3,
+    'partial_update': 3,
+    'download_shopping_cart': 20,
+    'export': 60,
+    'import_recipes': 60,
+    'bulk_delete': 60,
 }
 
 DJOSER = {
@@ -165,6 +265,11 @@ DJOSER = {
 # Константы
 MIN_COOKING_TIME = 1  # Минимальное время приготовления
 MIN_VALUE = 1  # Минимальное количество ингредиента
+MIN_SERVINGS = 1  # Минимальный множитель порций в корзине
+# Максимум порций в ?servings= рецепта и время жизни графа
+# переводов единиц в кеше, секунды
+MAX_SERVINGS = 100
+UNIT_GRAPH_CACHE_TIMEOUT = 3600
 REGEX_USERNAME = r'^[\w.@+-]+\Z$'
 # Лимит списка рецептов на странице подписок
 DEFAULT_RECIPES_LIMIT = 3
@@ -172,3 +277,98 @@ MAX_LEN_USERNAME = 150
 MAX_LEN_EMAIL = 254
 MAX_LEN_FIRST_NAME = 150
 MAX_LEN_LAST_NAME = 150
+# Максимум рецептов в одном запросе /api/recipes/bulk/
+RECIPE_BULK_MAX_IDS = 100
+# Максимум значений в каждом фасете списка рецептов (?facets=)
+# и время жизни посчитанных фасетов в кеше, секунды
+FACET_LIMIT = 50
+FACET_CACHE_TIMEOUT = 60
+# Журнал изменений: записей в ответе /api/changes/ и срок хранения в днях
+CHANGE_FEED_BATCH_SIZE = 500
+CHANGE_RETENTION_DAYS = 30
+# Размер пачки рецептов при пересчете пищевой ценности
+NUTRITION_BATCH_SIZE = 1000
+# Слияние похожих ингредиентов (dedupe_ingredients): порог похожести
+# названий, длина общего начала названий в блоке сравнения
+# и число кластеров, сливаемых в одной транзакции
+INGREDIENT_DEDUP_THRESHOLD = 0.85
+INGREDIENT_DEDUP_PREFIX = 3
+INGREDIENT_DEDUP_BATCH_SIZE = 500
+# Размер пачки рецептов при импорте/экспорте JSON Lines и сколько
+# отклоненных строк импорт перечисляет в ответе
+TRANSFER_BATCH_SIZE = 500
+TRANSFER_MAX_ERRORS = 100
+# Рейтинги рецептов: вес добавления в избранное и в корзину
+# и период полураспада trending в секундах
+RECIPE_SCORE_WEIGHTS = {'favorite': 1, 'shopping_cart': 1}
+TRENDING_HALF_LIFE = 3 * 24 * 60 * 60
+# Размер пачки при массовом удалении рецептов и пользователей
+DELETION_BATCH_SIZE = 1000
+# Картинки моложе этого возраста в секундах не удаляются сборщиком
+# мусора: ссылка на них может быть в незавершенной транзакции
+IMAGE_GC_GRACE = 60 * 60
+# Размер пачки bulk_create при генерации тестовых данных
+FAKE_DATA_BATCH_SIZE = 5000
+# Ответы меньше этого размера в байтах не сжимаются
+COMPRESSION_MIN_SIZE = 1024
+# Время жизни сжатых списков тегов и ингредиентов в кеше, секунды
+CATALOG_CACHE_TIMEOUT = 300
+# Порог оценки числа строк для пагинации больших таблиц в админке
+ESTIMATED_COUNT_THRESHOLD = 100000
+# Фоновые задачи: число потоков воркера и пауза опроса очереди, секунды
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_POLL_INTERVAL = 1
+# Аренда задачи: воркер продлевает ее каждые JOB_HEARTBEAT_INTERVAL
+# секунд; задача без продления дольше JOB_LEASE_TIMEOUT возвращается
+# в очередь, но не более JOB_MAX_ATTEMPTS запусков
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_LEASE_TIMEOUT = int(os.getenv('JOB_LEASE_TIMEOUT', 300))
+JOB_MAX_ATTEMPTS = 3
+# Результаты задач хранятся вне MEDIA_ROOT и удаляются вместе
+# с задачами через JOB_RESULT_TTL секунд после завершения
+JOB_RESULTS_ROOT = BASE_DIR / 'job_results'
+JOB_RESULT_TTL = 24 * 60 * 60
+# Как часто воркер удаляет просроченные задачи, секунды
+JOB_CLEANUP_INTERVAL = 60 * 60
+# CSV-файл справочника ингредиентов для load_csv_data
+INGREDIENTS_CSV = os.getenv('INGREDIENTS_CSV',
+                            str(BASE_DIR.parent / 'data' / 'ingredients.csv'))
+# Профилирование запросов (core.profiling): доля профилируемых запросов,
+# секрет заголовка X-Profile (пустой - заголовок отключен), интервал
+# сэмплов стека в секундах и порог медленного SQL для EXPLAIN в мс
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+PROFILING_SECRET = os.getenv('PROFILING_SECRET', '')
+PROFILING_INTERVAL = 0.005
+PROFILING_SLOW_QUERY_MS = float(os.getenv('PROFILING_SLOW_QUERY_MS', 100))
+# Файл-переключатель команды profiling и журнал профилей
+PROFILING_SWITCH_FILE = os.getenv('PROFILING_SWITCH_FILE',
+                                  BASE_DIR / 'profiling.json')
+PROFILING_LOG_FILE = os.getenv('PROFILING_LOG_FILE',
+                               BASE_DIR / 'profiling.log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        # Каждая строка журнала профилей - готовый JSON
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'profiling': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': PROFILING_LOG_FILE,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'core.profiling': {
+            'handlers': ['profiling'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+# Выполняется в отдельном интерпретаторе с -X importtime: замеряет
+# загрузку настроек, django.setup(), создание WSGI-обработчика
+# и два запроса к path. Результат печатается в stdout в JSON.
+STARTUP_SCRIPT = '''
+import json, sys, time
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+start = time.perf_counter()
+import django
+from django.conf import settings
+settings.INSTALLED_APPS
+timings = {'settings': time.perf_counter() - start}
+django.setup(set_prefix=False)
+timings['apps_ready'] = time.perf_counter() - start
+from django.core.handlers.wsgi import WSGIHandler
+handler = WSGIHandler()
+timings['wsgi_ready'] = time.perf_counter() - start
+path, query_string = (sys.argv[1].split('?', 1) + [''])[:2]
+statuses = []
+def start_response(status, headers, exc_info=None):
+    statuses.append(int(status.split()[0]))
+for name in ('first_request', 'second_request'):
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query_string,
+               'wsgi.input': BytesIO()}
+    setup_testing_defaults(environ)
+    request_start = time.perf_counter()
+    response = handler(environ, start_response)
+    b''.join(response)
+    response.close()
+    timings[name] = time.perf_counter() - request_start
+timings['status'] = statuses[0]
+print(json.dumps(timings))
+'''
+
+
+def parse_importtime(stderr: str) -> list:
+    """Строки -X importtime: (модуль, собственное время, общее время), мкс."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue
+        modules.append((name.strip(), int(own), int(cumulative)))
+    return modules
+
+
+def import_time_by_package(modules: list) -> dict:
+    """Собственное время импорта, сложенное по пакетам верхнего уровня."""
+    packages = defaultdict(int)
+    for name, own, _ in modules:
+        packages[name.split('.')[0]] += own
+    return dict(packages)
+
+
+def profile_startup(path: str = '/api/tags/', env: dict = None) -> tuple:
+    """
+    Запускает STARTUP_SCRIPT в новом интерпретаторе с текущими
+    настройками и переменными окружения env.
+    Возвращает (замеры в секундах, список модулей parse_importtime).
+    """
+    environ = dict(os.environ, **(env or {}))
+    environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, path],
+        env=environ, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout), parse_importtime(result.stderr)
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файлы называются по sha256 содержимого: <каталог>/ab/<хеш>.<ext>.
+    Повторная загрузка того же файла не пишет его заново, а только
+    обновляет время изменения, чтобы сборщик мусора не удалил файл
+    во время загрузки. Файл удаляется, когда на него не осталось
+    ссылок (см. recipes.images и delete_unused).
+    """
+
+    def hashed_name(self, name: str, content: File) -> str:
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        ext = os.path.splitext(name)[1].lower()
+        return posixpath.join(posixpath.dirname(name), digest[:2],
+                              digest + ext)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # Файл только что убрал delete_unused: пишем заново
+                pass
+        return super().save(name, content, max_length=max_length)
+
+    def delete_unused(self, name: str, is_used) -> bool:
+        """
+        Удаляет файл, если is_used(name, время изменения) ложно.
+        Перед проверкой файл переименовывается: загрузка того же
+        содержимого во время проверки либо уже обновила время
+        изменения, либо не найдет файл и запишет его заново.
+        Используемый файл возвращается на место. Возвращает True,
+        если файл удален.
+        """
+        path = self.path(name)
+        removed = f'{path}.{uuid.uuid4().hex}.deleting'
+        try:
+            os.rename(path, removed)
+        except FileNotFoundError:
+            return False
+        modified = self._datetime_from_timestamp(os.path.getmtime(removed))
+        if is_used(name, modified):
+            os.rename(removed, path)
+            return False
+        os.remove(removed)
+        return True
+
+    def walk(self, path: str = ''):
+        """Имена всех файлов каталога path с подкаталогами."""
+        if not self.exists(path):
+            return
+        directories, files = self.listdir(path)
+        for name in sorted(files):
+            yield posixpath.join(path, name)
+        for directory in sorted(directories):
+            yield from self.walk(posixpath.join(path, directory))
@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS',
+                        multiprocessing.cpu_count() * 2 + 1))
+# Приложение импортируется один раз в мастере, воркеры получают
+# его через fork и отвечают на первый запрос без импорта модулей
+preload_app = os.getenv(
+    'GUNICORN_PRELOAD', 'true').lower() in ('true', '1', 't')
+
+
+def pre_fork(server, worker):
+    """
+    Мастер загружает URLconf (views, сериализаторы) до fork и закрывает
+    соединения с базой: сокет, общий для нескольких процессов, ломает
+    протокол, поэтому каждый воркер открывает свое соединение.
+    """
+    if not server.cfg.preload_app:
+        return
+    from django.db import connections
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+    connections.close_all()
@@ -0,0 +1,10 @@
+from django.contrib import admin
+
+from jobs.models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'user', 'created', 'finished')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('started', 'finished')
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from api.utils import get_shopping_list, render_shopping_list
+from jobs.queue import register
+from recipes.catalog import load_ingredients
+from recipes.dedup import deduplicate_ingredients
+from recipes.images import remove_unreferenced
+
+
+@register('shopping_cart')
+def build_shopping_cart(job) -> None:
+    """Файл со списком покупок пользователя."""
+    content = render_shopping_list(get_shopping_list(job.user))
+    job.result.save('ingredients.txt', ContentFile(content.encode()),
+                    save=False)
+
+
+@register('load_ingredients')
+def import_ingredients(job) -> None:
+    """
+    Загрузка ингредиентов из CSV. Ошибки не перехватываются:
+    воркер отметит задачу как неудачную.
+    """
+    load_ingredients(job.params.get('path', settings.INGREDIENTS_CSV))
+
+
+@register('dedupe_ingredients')
+def dedupe_ingredients(job) -> None:
+    """Слияние похожих ингредиентов, параметры как у команды."""
+    deduplicate_ingredients(**job.params)
+
+
+@register('delete_files')
+def delete_files(job) -> None:
+    """
+    Удаление картинок, на которые больше не ссылаются рецепты.
+    Недавно загруженные файлы остаются сборщику мусора.
+    """
+    remove_unreferenced(job.params['names'])
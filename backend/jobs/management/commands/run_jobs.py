@@ -0,0 +1,68 @@
+import logging
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+import jobs.handlers  # noqa: F401 регистрация обработчиков
+from jobs.queue import claim_job, delete_expired_jobs, run_job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Запуск воркеров фоновых задач.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.JOB_WORKERS)
+        parser.add_argument('--poll-interval', type=float,
+                            default=settings.JOB_POLL_INTERVAL)
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить задачи из очереди и выйти.')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+
+        def work():
+            while not stop.is_set():
+                job = claim_job()
+                if job is not None:
+                    run_job(job)
+                elif options['once']:
+                    return
+                else:
+                    stop.wait(options['poll_interval'])
+
+        def clean():
+            # Просроченные задачи удаляются при запуске
+            # и затем раз в JOB_CLEANUP_INTERVAL секунд
+            while True:
+                try:
+                    delete_expired_jobs()
+                except Exception:
+                    logger.exception('Ошибка удаления просроченных задач')
+                finally:
+                    close_old_connections()
+                if options['once'] or stop.wait(
+                        settings.JOB_CLEANUP_INTERVAL):
+                    return
+
+        def shutdown(signum, frame):
+            # Воркеры дорабатывают текущие задачи и выходят; задачу,
+            # прерванную SIGKILL, вернет в очередь истекшая аренда
+            self.stdout.write('Остановка: завершаются текущие задачи.')
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        self.stdout.write(f'Воркеров: {options["workers"]}.')
+        with ThreadPoolExecutor(
+                max_workers=options['workers'] + 1) as executor:
+            futures = [executor.submit(clean)] + [
+                executor.submit(work) for _ in range(options['workers'])]
+            for future in futures:
+                future.result()
@@ -0,0 +1,32 @@
+# flake8: noqa
+# Generated by Django 3.2.3 on 2026-10-19 20:08
+
+from django.db import migrations, models
+
+
+def start_leases(apps, schema_editor):
+    # Выполняющимся задачам аренда отсчитывается от начала
+    Job = apps.get_model('jobs', 'Job')
+    Job.objects.filter(status='running').update(
+        heartbeat=models.F('started'), attempts=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Запусков'),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Продление аренды'),
+        ),
+        migrations.RunPython(start_leases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# flake8: noqa
+# Generated by Django 3.2.3 on 2026-10-19 20:28
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+import jobs.storage
+
+
+def remove_public_results(apps, schema_editor):
+    # Старые результаты лежат в MEDIA_ROOT, который раздает nginx
+    Job = apps.get_model('jobs', 'Job')
+    for name in Job.objects.exclude(result='').values_list('result',
+                                                           flat=True):
+        default_storage.delete(name)
+    Job.objects.exclude(result='').update(result='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0002_job_lease'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_public_results,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='job',
+            name='result',
+            field=models.FileField(blank=True, storage=jobs.storage.get_result_storage, upload_to=jobs.storage.result_path, verbose_name='Результат'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import models
+
+from jobs.storage import get_result_storage, result_path
+from users.models import User
+
+
+class Job(models.Model):
+    "Фоновая задача."
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    kind = models.CharField('Тип задачи', max_length=50)
+    params = models.JSONField('Параметры', default=dict, blank=True)
+    status = models.CharField('Статус', max_length=10,
+                              choices=STATUSES, default=PENDING)
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             null=True,
+                             blank=True,
+                             related_name='jobs',
+                             verbose_name='Пользователь')
+    result = models.FileField('Результат', upload_to=result_path,
+                              storage=get_result_storage, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    started = models.DateTimeField('Начата', null=True, blank=True)
+    finished = models.DateTimeField('Завершена', null=True, blank=True)
+    heartbeat = models.DateTimeField('Продление аренды', null=True,
+                                     blank=True)
+    attempts = models.PositiveSmallIntegerField('Запусков', default=0)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=('status', 'id'), name='job_status_id_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk}'
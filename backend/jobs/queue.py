@@ -0,0 +1,113 @@
+import logging
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+HEARTBEAT_INTERVAL = settings.JOB_HEARTBEAT_INTERVAL
+LEASE_TIMEOUT = settings.JOB_LEASE_TIMEOUT
+MAX_ATTEMPTS = settings.JOB_MAX_ATTEMPTS
+RESULT_TTL = settings.JOB_RESULT_TTL
+# Обработчики задач по типу, заполняются декоратором register
+JOB_HANDLERS = {}
+
+
+def register(kind: str):
+    """Регистрирует обработчик задач указанного типа."""
+    def decorator(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return decorator
+
+
+def enqueue(kind: str, user=None, **params) -> Job:
+    """Ставит задачу в очередь."""
+    return Job.objects.create(kind=kind, user=user, params=params)
+
+
+def claim_job() -> Job:
+    """
+    Забирает самую старую задачу из очереди или задачу, аренда которой
+    истекла: воркер упал или был убит, не завершив ее. Задача, которую
+    не удалось завершить за MAX_ATTEMPTS запусков, помечается ошибкой.
+    SKIP LOCKED позволяет воркерам не ждать друг друга; условный UPDATE
+    защищает от повторного захвата там, где блокировки строк нет (SQLite).
+    """
+    while True:
+        now = timezone.now()
+        available = Q(status=Job.PENDING) | Q(
+            status=Job.RUNNING,
+            heartbeat__lt=now - timedelta(seconds=LEASE_TIMEOUT))
+        with transaction.atomic():
+            job = (Job.objects.select_for_update(skip_locked=True)
+                   .filter(available).order_by('id').first())
+            if job is None:
+                return None
+            claimable = Job.objects.filter(available, pk=job.pk)
+            if job.attempts >= MAX_ATTEMPTS:
+                claimable.update(
+                    status=Job.FAILED, finished=now,
+                    error=f'Аренда истекла {job.attempts} раз подряд.')
+                continue
+            claimed = claimable.update(
+                status=Job.RUNNING, started=now, heartbeat=now,
+                attempts=F('attempts') + 1)
+        if not claimed:
+            return None
+        job.refresh_from_db()
+        return job
+
+
+def keep_alive(job: Job, stop: threading.Event) -> None:
+    """Продлевает аренду задачи, пока не выставлен stop."""
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            Job.objects.filter(
+                pk=job.pk, status=Job.RUNNING, attempts=job.attempts,
+            ).update(heartbeat=timezone.now())
+    finally:
+        connection.close()
+
+
+def run_job(job: Job) -> None:
+    """
+    Выполняет задачу и сохраняет результат или ошибку. Пока задача
+    выполняется, отдельный поток продлевает ее аренду.
+    """
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=keep_alive, args=(job, stop),
+                                 daemon=True)
+    heartbeat.start()
+    try:
+        JOB_HANDLERS[job.kind](job)
+        job.status = Job.DONE
+    except Exception:
+        logger.exception('Ошибка задачи %s', job)
+        job.status = Job.FAILED
+        job.error = traceback.format_exc()
+    finally:
+        stop.set()
+        heartbeat.join()
+        job.finished = timezone.now()
+        job.save(update_fields=('status', 'error', 'result', 'finished'))
+        # Как после HTTP-запроса: закрываем устаревшие соединения потока
+        close_old_connections()
+
+
+def delete_expired_jobs() -> int:
+    """
+    Удаляет завершенные задачи старше RESULT_TTL, файлы результатов
+    удаляет сигнал post_delete. Возвращает число удаленных задач.
+    """
+    deleted, _ = Job.objects.filter(
+        status__in=(Job.DONE, Job.FAILED),
+        finished__lt=timezone.now() - timedelta(seconds=RESULT_TTL),
+    ).delete()
+    return deleted
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from jobs.models import Job
+
+
+@receiver(post_delete, sender=Job)
+def delete_job_result(sender, instance, **kwargs):
+    # Файл удаляется после фиксации: при откате задача останется с ним
+    if instance.result:
+        name, storage = instance.result.name, instance.result.storage
+        transaction.on_commit(lambda: storage.delete(name))
@@ -0,0 +1,18 @@
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+def get_result_storage() -> FileSystemStorage:
+    """
+    Хранилище результатов задач вне MEDIA_ROOT: nginx его не раздает,
+    файлы отдает только JobViewSet.download владельцу задачи.
+    """
+    return FileSystemStorage(location=settings.JOB_RESULTS_ROOT,
+                             base_url=None)
+
+
+def result_path(job, filename: str) -> str:
+    """Случайный каталог: имя файла нельзя угадать."""
+    return f'{uuid.uuid4().hex}/{filename}'
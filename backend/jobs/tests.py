@@ -0,0 +1,112 @@
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+import jobs.handlers  # noqa: F401 регистрация обработчиков
+from jobs.models import Job
+from jobs.queue import (LEASE_TIMEOUT, MAX_ATTEMPTS, RESULT_TTL, claim_job,
+                        delete_expired_jobs, enqueue, run_job)
+from users.models import User
+
+
+class JobQueueTests(TestCase):
+
+    def expire(self, job, attempts=1):
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING, attempts=attempts,
+            heartbeat=timezone.now() - timedelta(seconds=LEASE_TIMEOUT + 1))
+
+    def test_failed_import_is_marked_failed(self):
+        enqueue('load_ingredients', path='/nonexistent/ingredients.csv')
+        job = claim_job()
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('FileNotFoundError', job.error)
+
+    def test_expired_lease_is_claimed_again(self):
+        job = enqueue('load_ingredients')
+        self.assertEqual(claim_job().pk, job.pk)
+        # Аренда действует - задачу никто не забирает
+        self.assertIsNone(claim_job())
+        self.expire(job)
+        claimed = claim_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_exhausted_attempts_fail(self):
+        job = enqueue('load_ingredients')
+        self.expire(job, attempts=MAX_ATTEMPTS)
+        self.assertIsNone(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+
+class JobResultTests(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        patcher = mock.patch.object(
+            Job._meta.get_field('result'), 'storage',
+            FileSystemStorage(location=self.root, base_url=None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='user')
+
+    def run_cart_job(self) -> Job:
+        job = enqueue('shopping_cart', user=self.user)
+        run_job(claim_job())
+        job.refresh_from_db()
+        return job
+
+    def test_result_is_private_and_unguessable(self):
+        first, second = self.run_cart_job(), self.run_cart_job()
+        self.assertNotEqual(first.result.name, second.result.name)
+        self.assertTrue(first.result.name.endswith('/ingredients.txt'))
+        self.assertTrue(os.path.exists(os.path.join(self.root,
+                                                    first.result.name)))
+        self.assertFalse(first.result.path.startswith(
+            str(settings.MEDIA_ROOT)))
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'/api/jobs/{first.id}/download/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='other')
+        self.client.force_authenticate(other)
+        response = self.client.get(f'/api/jobs/{first.id}/download/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_expired_jobs_are_deleted_with_files(self):
+        expired, fresh = self.run_cart_job(), self.run_cart_job()
+        Job.objects.filter(pk=expired.pk).update(
+            finished=timezone.now() - timedelta(seconds=RESULT_TTL + 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(delete_expired_jobs(), 1)
+        self.assertFalse(os.path.exists(expired.result.path))
+        self.assertTrue(os.path.exists(fresh.result.path))
+        self.assertEqual(list(Job.objects.values_list('id', flat=True)),
+                         [fresh.id])
+
+    def test_error_hides_traceback(self):
+        enqueue('load_ingredients', path='/nonexistent/ingredients.csv',
+                user=self.user)
+        job = claim_job()
+        with self.assertLogs('jobs.queue', 'ERROR') as logs:
+            run_job(job)
+        self.assertIn('Traceback', logs.output[0])
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'/api/jobs/{job.id}/')
+        self.assertEqual(response.data['status'], Job.FAILED)
+        self.assertNotIn('Traceback', response.data['error'])
+        self.assertTrue(response.data['error'])
@@ -1,16 +1,30 @@
 from django.contrib import admin
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from import_export.admin import ImportExportModelAdmin
 
+from recipes.deletion import delete_recipes
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            RecipeTag, ShoppingCart, Tag)
+                            RecipeScore, RecipeTag, ShoppingCart, Tag,
+                            UnitConversion)
+from recipes.nutrition import set_recipe_totals, update_recipe_totals
+from recipes.paginators import EstimatedCountPaginator
+from recipes.resources import IngredientResource, RecipeResource
 from users.models import Follow
 
 
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список без COUNT(*) по всей таблице."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
     extra = 0
     min_num = 1
     fields = ('ingredient', 'amount')
+    autocomplete_fields = ('ingredient',)
 
 
 class RecipeTagInline(admin.TabularInline):
@@ -21,20 +35,52 @@ class RecipeTagInline(admin.TabularInline):
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'image', 'text',
-                    'cooking_time', 'author', 'favorite_count')
+class RecipeAdmin(ImportExportModelAdmin, LargeTableAdmin):
+    resource_class = RecipeResource
+    list_display = ('id', 'name', 'cooking_time', 'author', 'favorite_count')
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__username')
+    autocomplete_fields = ('author',)
     fields = ('name', 'image', 'text', 'cooking_time',
-              'author', 'favorite_count')
-    readonly_fields = ('favorite_count',)
+              'author', 'favorite_count', 'calories', 'proteins',
+              'fats', 'carbohydrates', 'cost')
+    readonly_fields = ('favorite_count', 'calories', 'proteins',
+                       'fats', 'carbohydrates', 'cost')
     inlines = (RecipeIngredientInline, RecipeTagInline)
-    list_filter = ('name', 'author', 'tags')
+    # Фильтры по названию и автору заменены поиском:
+    # боковая панель не перебирает всю таблицу
+    list_filter = ('tags',)
+    actions = ('bulk_delete',)
+
+    def get_queryset(self, request):
+        # Подзапрос считается только для строк текущей страницы
+        favorites = (Favorite.objects.filter(recipe=OuterRef('pk'))
+                     .order_by().values('recipe')
+                     .annotate(count=Count('id')).values('count'))
+        return super().get_queryset(request).annotate(
+            favorite_count=Coalesce(Subquery(favorites), 0,
+                                    output_field=IntegerField()))
+
+    def save_related(self, request, form, formsets, change):
+        """Пересчет пищевой ценности после сохранения ингредиентов."""
+        super().save_related(request, form, formsets, change)
+        set_recipe_totals(form.instance)
 
     def favorite_count(self, obj):
         """Количество добавлений в избранное."""
-        return obj.favorites.all().count()
+        return obj.favorite_count
 
     favorite_count.short_description = 'Количество в избранном'
+    favorite_count.admin_order_field = 'favorite_count'
+
+    @admin.action(description='Быстро удалить выбранные рецепты',
+                  permissions=('delete',))
+    def bulk_delete(self, request, queryset):
+        """Удаление пачками без загрузки связанных объектов."""
+        stats = delete_recipes(queryset)
+        self.message_user(
+            request, f'Удалено рецептов: {stats["recipes"]}, связей: '
+            f'{stats["links"]} за {stats["seconds"]} с.')
 
 
 @admin.register(Tag)
@@ -44,31 +90,62 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Ingredient)
 class IngredientAdmin(ImportExportModelAdmin):
-    list_display = ('id', 'name', 'measurement_unit')
-    list_filter = ('name',)
+    resource_class = IngredientResource
+    list_display = ('id', 'name', 'measurement_unit', 'calories', 'price')
+    search_fields = ('name',)
     ordering = ('name',)
 
+    def save_model(self, request, obj, form, change):
+        """Пересчет рецептов с измененным ингредиентом."""
+        super().save_model(request, obj, form, change)
+        if change:
+            update_recipe_totals(
+                obj.recipe_igredient.values_list('recipe_id', flat=True))
+
+
+@admin.register(UnitConversion)
+class UnitConversionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'unit', 'base_unit', 'factor')
+
 
 @admin.register(RecipeIngredient)
-class RecipeIngredientAdmin(admin.ModelAdmin):
+class RecipeIngredientAdmin(LargeTableAdmin):
     list_display = ('id', 'recipe', 'ingredient')
+    list_select_related = ('recipe', 'ingredient')
+    autocomplete_fields = ('recipe', 'ingredient')
 
 
 @admin.register(RecipeTag)
-class RecipeTagAdmin(admin.ModelAdmin):
+class RecipeTagAdmin(LargeTableAdmin):
     list_display = ('id', 'recipe', 'tag')
+    list_select_related = ('recipe', 'tag')
+    autocomplete_fields = ('recipe',)
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(LargeTableAdmin):
     list_display = ('id', 'recipe', 'user')
+    list_select_related = ('recipe', 'user')
+    autocomplete_fields = ('recipe', 'user')
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ('id', 'recipe', 'user')
+class ShoppingCartAdmin(LargeTableAdmin):
+    list_display = ('id', 'recipe', 'user', 'servings')
+    list_select_related = ('recipe', 'user')
+    autocomplete_fields = ('recipe', 'user')
+
+
+@admin.register(RecipeScore)
+class RecipeScoreAdmin(LargeTableAdmin):
+    list_display = ('recipe', 'popularity', 'trending', 'updated')
+    list_select_related = ('recipe',)
+    autocomplete_fields = ('recipe',)
+    ordering = ('-trending',)
 
 
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ('id', 'author', 'user')
+    list_select_related = ('author', 'user')
+    autocomplete_fields = ('author', 'user')
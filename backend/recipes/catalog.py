@@ -0,0 +1,38 @@
+import csv
+
+from django.db import transaction
+from tqdm import tqdm
+
+from recipes.models import Ingredient
+from recipes.normalize import normalize_name, normalize_unit
+from recipes.nutrition import NUTRIENT_FIELDS, update_recipe_totals
+
+
+def load_ingredients(path, progress: bool = False) -> int:
+    """
+    Загрузка ингредиентов из CSV. Колонки: название, единица измерения
+    и необязательные калории, белки, жиры, углеводы, цена на 100 г.
+    Файл загружается в одной транзакции, ошибки чтения и разбора
+    не перехватываются. Возвращает число строк.
+    """
+    loaded = 0
+    has_nutrition = False
+    with open(path, encoding='utf-8') as csv_file, transaction.atomic():
+        for row in tqdm(csv.reader(csv_file), desc='Ingredients',
+                        disable=not progress):
+            # Ингредиент ищется по нормализованному ключу,
+            # как в ограничении unique_ingredient_normalized
+            key = dict(normalized_name=normalize_name(row[0]),
+                       measurement_unit=normalize_unit(row[1]))
+            loaded += 1
+            if len(row) == 2:
+                Ingredient.objects.get_or_create(
+                    **key, defaults={'name': row[0]})
+                continue
+            has_nutrition = True
+            Ingredient.objects.update_or_create(
+                **key, defaults=dict(zip(NUTRIENT_FIELDS, map(float, row[2:])),
+                                     name=row[0]))
+        if has_nutrition:
+            update_recipe_totals()
+    return loaded
@@ -0,0 +1,239 @@
+import re
+import time
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from changes.log import record_changes
+from changes.models import Change
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.normalize import normalize_name, normalize_unit
+from recipes.nutrition import update_recipe_totals
+
+DEDUP_THRESHOLD = settings.INGREDIENT_DEDUP_THRESHOLD
+DEDUP_PREFIX = settings.INGREDIENT_DEDUP_PREFIX
+DEDUP_BATCH_SIZE = settings.INGREDIENT_DEDUP_BATCH_SIZE
+# Опечатка допускается только в словах не короче: у коротких слов
+# одна буква меняет смысл (вода - водка, сайда - сайра)
+MIN_TYPO_LENGTH = 6
+
+
+def is_similar(first: str, second: str, threshold: float) -> bool:
+    """
+    Похожесть SequenceMatcher.ratio() не ниже threshold. Дешевые
+    верхние оценки real_quick_ratio и quick_ratio отсекают
+    большинство пар до полного сравнения.
+    """
+    matcher = SequenceMatcher(None, first, second, autojunk=False)
+    return (matcher.real_quick_ratio() >= threshold
+            and matcher.quick_ratio() >= threshold
+            and matcher.ratio() >= threshold)
+
+
+def is_typo(first: str, second: str) -> bool:
+    """
+    Слова длиной от MIN_TYPO_LENGTH отличаются одной правкой: вставкой,
+    удалением, заменой или перестановкой соседних букв.
+    """
+    if (abs(len(first) - len(second)) > 1
+            or min(len(first), len(second)) < MIN_TYPO_LENGTH):
+        return False
+    start = 0
+    while (start < min(len(first), len(second))
+           and first[start] == second[start]):
+        start += 1
+    first, second = first[start:], second[start:]
+    while first and second and first[-1] == second[-1]:
+        first, second = first[:-1], second[:-1]
+    return (len(first) <= 1 and len(second) <= 1
+            or len(first) == 2 and first == second[::-1])
+
+
+def is_duplicate(first: str, second: str, threshold: float) -> bool:
+    """
+    Названия - один ингредиент, если они похожи не меньше threshold
+    и отличаются только опечатками: слова попарно совпадают или
+    отличаются одной правкой без цифр. Поэтому 'жирный' и 'нежирный',
+    '1,5%' и '2,5%' остаются разными ингредиентами.
+    """
+    first_words, second_words = first.split(), second.split()
+    if len(first_words) != len(second_words):
+        return False
+    for first_word, second_word in zip(first_words, second_words):
+        if first_word != second_word and (
+                re.search(r'\d', first_word + second_word)
+                or not is_typo(first_word, second_word)):
+            return False
+    return is_similar(first, second, threshold)
+
+
+class DisjointSet:
+    """Система непересекающихся множеств для сборки кластеров."""
+
+    def __init__(self):
+        self.parents = {}
+
+    def find(self, item: int) -> int:
+        parents = self.parents
+        parents.setdefault(item, item)
+        while parents[item] != item:
+            parents[item] = parents[parents[item]]
+            item = parents[item]
+        return item
+
+    def union(self, first: int, second: int) -> None:
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parents[max(first, second)] = min(first, second)
+
+    def groups(self) -> list:
+        groups = defaultdict(list)
+        for item in self.parents:
+            groups[self.find(item)].append(item)
+        return sorted(sorted(group) for group in groups.values()
+                      if len(group) > 1)
+
+
+def find_duplicates(rows, threshold: float = DEDUP_THRESHOLD,
+                    prefix: int = DEDUP_PREFIX) -> list:
+    """
+    Кластеры похожих ингредиентов из строк (id, название, единица).
+    Сравниваются только названия одного блока: одна единица измерения
+    и общее начало из prefix символов нормализованного названия,
+    отличия проверяет is_duplicate. В блоке названия отсортированы
+    по длине, и перебор пар прекращается, когда разница длин
+    не оставляет шанса на порог.
+    """
+    blocks = defaultdict(list)
+    for ingredient_id, name, unit in rows:
+        name = normalize_name(name)
+        blocks[(normalize_unit(unit), name[:prefix])].append(
+            (len(name), name, ingredient_id))
+    clusters = DisjointSet()
+    for block in blocks.values():
+        block.sort()
+        for position, (length, name, ingredient_id) in enumerate(block):
+            for other_length, other_name, other_id in block[position + 1:]:
+                # ratio() не больше 2 * min / (сумма длин)
+                if 2 * length < threshold * (length + other_length):
+                    break
+                if name == other_name or is_duplicate(name, other_name,
+                                                      threshold):
+                    clusters.union(ingredient_id, other_id)
+    return clusters.groups()
+
+
+def choose_canonical(clusters: list) -> dict:
+    """
+    {id дубликата: id основного ингредиента}. Основной - ингредиент
+    кластера с наибольшим числом рецептов, при равенстве - старейший.
+    """
+    ids = [ingredient_id for cluster in clusters for ingredient_id in cluster]
+    counts = dict(RecipeIngredient.objects.filter(ingredient_id__in=ids)
+                  .values('ingredient_id').annotate(count=Count('id'))
+                  .values_list('ingredient_id', 'count'))
+    canonical = {}
+    for cluster in clusters:
+        target = min(cluster, key=lambda ingredient_id: (
+            -counts.get(ingredient_id, 0), ingredient_id))
+        canonical.update({ingredient_id: target for ingredient_id in cluster
+                          if ingredient_id != target})
+    return canonical
+
+
+def merge_ingredients(canonical: dict) -> list:
+    """
+    Переносит связи дубликатов на основные ингредиенты и удаляет
+    дубликаты. Если в рецепте есть оба ингредиента, остается одна
+    связь с суммой количеств. Возвращает id измененных рецептов.
+    """
+    links = RecipeIngredient.objects.filter(
+        ingredient_id__in=[*canonical, *canonical.values()]).values_list(
+        'id', 'recipe_id', 'ingredient_id', 'amount')
+    kept, changed, removed, recipes = {}, {}, [], set()
+    # Связи основных ингредиентов остаются, к ним добавляются дубликаты
+    for link_id, recipe_id, ingredient_id, amount in sorted(
+            links, key=lambda link: (link[2] in canonical, link[0])):
+        target = canonical.get(ingredient_id, ingredient_id)
+        if target != ingredient_id:
+            recipes.add(recipe_id)
+        link = kept.get((recipe_id, target))
+        if link is None:
+            kept[(recipe_id, target)] = RecipeIngredient(
+                id=link_id, recipe_id=recipe_id, ingredient_id=target,
+                amount=amount)
+            if target != ingredient_id:
+                changed[link_id] = kept[(recipe_id, target)]
+            continue
+        link.amount += amount
+        changed[link.id] = link
+        removed.append(link_id)
+    recipes = sorted(recipes)
+    with transaction.atomic():
+        # Лишние связи удаляются до переноса, иначе перенос
+        # нарушит unique_recipe_ingredient
+        RecipeIngredient.objects.filter(id__in=removed)._raw_delete(
+            RecipeIngredient.objects.db)
+        RecipeIngredient.objects.bulk_update(changed.values(),
+                                             ('ingredient', 'amount'))
+        # Сигналы удаления сбрасывают кеш справочника и пишут журнал
+        Ingredient.objects.filter(id__in=list(canonical)).delete()
+        Recipe.objects.filter(id__in=recipes).update(updated=timezone.now())
+        # Пересчет пишет журнал только для рецептов с новыми итогами,
+        # а связи перенесены у всех
+        record_changes('recipe', recipes, Change.UPSERT)
+        update_recipe_totals(recipes)
+    return recipes
+
+
+def normalize_ingredients() -> int:
+    """
+    Пересчитывает ключи ингредиентов, сохраненные по старым правилам
+    нормализации. Вызывается после слияния, когда новые ключи
+    уже не совпадают. Единица измерения видна клиентам, поэтому
+    изменение пишется в журнал. Возвращает число обновленных
+    ингредиентов.
+    """
+    ingredients = []
+    for ingredient in Ingredient.objects.only(
+            'id', 'name', 'normalized_name', 'measurement_unit').iterator():
+        key = (normalize_name(ingredient.name),
+               normalize_unit(ingredient.measurement_unit))
+        if key != (ingredient.normalized_name, ingredient.measurement_unit):
+            ingredient.normalized_name, ingredient.measurement_unit = key
+            ingredients.append(ingredient)
+    with transaction.atomic():
+        Ingredient.objects.bulk_update(
+            ingredients, ('normalized_name', 'measurement_unit'),
+            batch_size=DEDUP_BATCH_SIZE)
+        record_changes('ingredient',
+                       [ingredient.id for ingredient in ingredients],
+                       Change.UPSERT)
+    return len(ingredients)
+
+
+def deduplicate_ingredients(threshold: float = DEDUP_THRESHOLD,
+                            prefix: int = DEDUP_PREFIX,
+                            batch_size: int = DEDUP_BATCH_SIZE) -> dict:
+    """
+    Слияние похожих ингредиентов пачками по batch_size кластеров
+    и обновление ключей нормализации. Возвращает количество
+    кластеров, удаленных дубликатов, измененных рецептов
+    и перенормализованных ингредиентов, время в секундах.
+    """
+    start = time.perf_counter()
+    clusters = find_duplicates(
+        Ingredient.objects.values_list('id', 'name', 'measurement_unit')
+        .iterator(), threshold, prefix)
+    stats = {'clusters': len(clusters), 'duplicates': 0, 'recipes': 0}
+    for position in range(0, len(clusters), batch_size):
+        canonical = choose_canonical(clusters[position:position + batch_size])
+        stats['recipes'] += len(merge_ingredients(canonical))
+        stats['duplicates'] += len(canonical)
+    stats['normalized'] = normalize_ingredients()
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    return stats
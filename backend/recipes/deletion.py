@@ -0,0 +1,110 @@
+import time
+
+from django.conf import settings
+from django.db import models, transaction
+
+from changes.log import record_changes
+from changes.models import Change
+from jobs.queue import enqueue
+from recipes.models import Favorite, Recipe, ShoppingCart
+from recipes.scores import rebuild_recipe_scores
+from users.models import Follow, User
+
+DELETION_BATCH_SIZE = settings.DELETION_BATCH_SIZE
+
+
+def raw_delete(queryset: models.QuerySet,
+               batch_size: int = DELETION_BATCH_SIZE) -> int:
+    """
+    Удаляет строки пачками по первичному ключу одним DELETE на пачку.
+    Объекты не загружаются, сигналы не отправляются.
+    """
+    deleted = 0
+    pks = queryset.order_by().values_list('pk', flat=True)
+    while True:
+        batch = list(pks[:batch_size])
+        if not batch:
+            return deleted
+        deleted += queryset.model._base_manager.filter(
+            pk__in=batch)._raw_delete(queryset.db)
+
+
+def schedule_file_removal(names: set) -> None:
+    """После фиксации транзакции картинки удаляет фоновая задача."""
+    names = sorted(filter(None, names))
+    if names:
+        transaction.on_commit(lambda: enqueue('delete_files', names=names))
+
+
+def delete_recipes(recipes: models.QuerySet,
+                   batch_size: int = DELETION_BATCH_SIZE) -> dict:
+    """
+    Удаление рецептов пачками: связанные строки и сами рецепты
+    удаляются запросами DELETE ... WHERE recipe_id IN (...), без
+    коллектора Django. Рейтинги удаляемых рецептов не пересчитываются.
+    Возвращает количество удаленных рецептов и связей и время в секундах.
+    """
+    start = time.perf_counter()
+    stats = {'recipes': 0, 'links': 0}
+    # Все ссылки на рецепт каскадные, поэтому их можно удалить заранее
+    relations = [relation for relation in Recipe._meta.related_objects
+                 if relation.on_delete is models.CASCADE]
+    ids = recipes.order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while True:
+        batch = list(ids.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            images = set(Recipe.objects.filter(id__in=batch)
+                         .values_list('image', flat=True))
+            for relation in relations:
+                stats['links'] += relation.related_model._base_manager.filter(
+                    **{f'{relation.field.name}__in': batch}
+                )._raw_delete(recipes.db)
+            stats['recipes'] += Recipe._base_manager.filter(
+                id__in=batch)._raw_delete(recipes.db)
+            # Сигналов нет, удаление записывается в журнал изменений.
+            # Клиенты убирают рецепт и из избранного, и из корзины
+            record_changes('recipe', batch, Change.DELETE)
+            schedule_file_removal(images)
+        last_id = batch[-1]
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def delete_users(users: models.QuerySet,
+                 batch_size: int = DELETION_BATCH_SIZE) -> dict:
+    """
+    Удаление пользователей с рецептами, избранным, корзинами
+    и подписками. Объемные связи удаляются пачками, оставшееся
+    (токены, задачи) - обычным каскадом Django. Рейтинги рецептов,
+    из которых ушли избранное и корзины, пересчитываются.
+    """
+    start = time.perf_counter()
+    user_ids = list(users.values_list('id', flat=True))
+    stats = delete_recipes(Recipe.objects.filter(author_id__in=user_ids),
+                           batch_size)
+    affected = set()
+    for model in (Favorite, ShoppingCart):
+        links = model.objects.filter(user_id__in=user_ids)
+        affected.update(links.values_list('recipe_id', flat=True))
+        stats['links'] += raw_delete(links, batch_size)
+    # Подписчики удаленных авторов узнают об отписке из журнала
+    followers = (Follow.objects.filter(author_id__in=user_ids)
+                 .exclude(user_id__in=user_ids)
+                 .values_list('author_id', 'user_id'))
+    for offset in range(0, followers.count(), batch_size):
+        author_ids, follower_ids = zip(
+            *followers.order_by('id')[offset:offset + batch_size])
+        record_changes('follow', author_ids, Change.DELETE, follower_ids)
+    stats['links'] += raw_delete(
+        Follow.objects.filter(models.Q(user_id__in=user_ids)
+                              | models.Q(author_id__in=user_ids)),
+        batch_size)
+    if affected:
+        rebuild_recipe_scores(sorted(affected), batch_size)
+    _, deleted = User.objects.filter(id__in=user_ids).delete()
+    stats['users'] = deleted.get(User._meta.label, 0)
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    return stats
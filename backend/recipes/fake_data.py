@@ -0,0 +1,211 @@
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import Max
+
+from changes.log import record_changes
+from changes.models import Change
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, Tag)
+from recipes.nutrition import update_recipe_totals
+from recipes.scores import rebuild_recipe_scores
+from users.models import Follow, User
+
+FAKE_DATA_BATCH_SIZE = settings.FAKE_DATA_BATCH_SIZE
+# Показатель распределения Зипфа для популярности рецептов и авторов
+ZIPF_EXPONENT = 1.1
+FAKE_PASSWORD = 'fake-password'
+FAKE_IMAGE = 'recipes/fake.png'
+FAKE_TAGS = (('Завтрак', '#E26C2D', 'breakfast'),
+             ('Обед', '#49B64E', 'lunch'),
+             ('Ужин', '#8775D2', 'dinner'))
+
+
+class ZipfSampler:
+    """
+    Выбор элементов с вероятностью 1 / rank ** exponent.
+    Ранги перемешаны, поэтому популярные объекты не совпадают
+    с младшими id.
+    """
+
+    def __init__(self, rng: np.random.Generator, ids: np.ndarray,
+                 exponent: float = ZIPF_EXPONENT):
+        self.rng = rng
+        self.ids = rng.permutation(ids)
+        weights = 1 / np.arange(1, len(ids) + 1) ** exponent
+        self.cdf = np.cumsum(weights / weights.sum())
+
+    def sample(self, size: int) -> np.ndarray:
+        positions = np.searchsorted(self.cdf, self.rng.random(size))
+        return self.ids[np.minimum(positions, len(self.ids) - 1)]
+
+
+def unique_pairs(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Уникальные пары (left, right) без циклов по строкам."""
+    pairs = np.unique(np.stack((left, right), axis=1), axis=0)
+    return pairs[pairs[:, 0] != -1]
+
+
+def next_id(model: models.Model) -> int:
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+def reset_sequences(*model_list) -> None:
+    """После вставки с явными id сдвигаем последовательности PostgreSQL."""
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), model_list):
+            cursor.execute(sql)
+
+
+class FakeDataGenerator:
+    """
+    Генератор данных для нагрузочного тестирования. Объекты создаются
+    пачками bulk_create с явными id, поэтому память ограничена
+    размером пачки. Одинаковый seed дает одинаковые данные.
+    """
+
+    def __init__(self, seed: int = 0,
+                 batch_size: int = FAKE_DATA_BATCH_SIZE):
+        self.rng = np.random.default_rng(seed)
+        self.batch_size = batch_size
+        self.created = {}
+
+    def batches(self, first_id: int, count: int):
+        for start in range(first_id, first_id + count, self.batch_size):
+            yield np.arange(start, min(start + self.batch_size,
+                                       first_id + count))
+
+    def bulk_create(self, model: models.Model, objs: list) -> None:
+        """
+        Вставка без ignore_conflicts: id новые, связи уникальны после
+        unique_pairs, поэтому конфликт (например, занятое имя fakeN)
+        - ошибка, и транзакция откатывается. Вставлены все objs.
+        """
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        self.created[model.__name__] = (
+            self.created.get(model.__name__, 0) + len(objs))
+
+    def create_users(self, count: int) -> np.ndarray:
+        password = make_password(FAKE_PASSWORD)
+        first_id = next_id(User)
+        for ids in self.batches(first_id, count):
+            self.bulk_create(User, [
+                User(id=user_id, username=f'fake{user_id}',
+                     email=f'fake{user_id}@example.com',
+                     first_name='Имя', last_name=f'Фамилия{user_id}',
+                     password=password)
+                for user_id in ids.tolist()])
+        return np.arange(first_id, first_id + count)
+
+    def create_tags(self) -> np.ndarray:
+        if not Tag.objects.exists():
+            self.bulk_create(Tag, [Tag(name=name, color=color, slug=slug)
+                                   for name, color, slug in FAKE_TAGS])
+        return np.array(Tag.objects.values_list('id', flat=True))
+
+    def create_recipes(self, count: int, authors: ZipfSampler,
+                       ingredients: ZipfSampler, tag_ids: np.ndarray,
+                       ingredients_per_recipe: int) -> np.ndarray:
+        first_id = next_id(Recipe)
+        for ids in self.batches(first_id, count):
+            author_ids = authors.sample(len(ids))
+            cooking_times = self.rng.integers(5, 180, len(ids))
+            self.bulk_create(Recipe, [
+                Recipe(id=recipe_id, author_id=author_id,
+                       name=f'Рецепт {recipe_id}', image=FAKE_IMAGE,
+                       text=f'Описание рецепта {recipe_id}.',
+                       cooking_time=cooking_time)
+                for recipe_id, author_id, cooking_time in zip(
+                    ids.tolist(), author_ids.tolist(),
+                    cooking_times.tolist())])
+
+            counts = self.rng.poisson(ingredients_per_recipe - 1,
+                                      len(ids)) + 1
+            links = unique_pairs(np.repeat(ids, counts),
+                                 ingredients.sample(counts.sum()))
+            amounts = self.rng.integers(1, 500, len(links))
+            self.bulk_create(RecipeIngredient, [
+                RecipeIngredient(recipe_id=recipe_id,
+                                 ingredient_id=ingredient_id, amount=amount)
+                for (recipe_id, ingredient_id), amount in zip(
+                    links.tolist(), amounts.tolist())])
+
+            counts = self.rng.integers(1, len(tag_ids) + 1, len(ids))
+            links = unique_pairs(np.repeat(ids, counts),
+                                 self.rng.choice(tag_ids, counts.sum()))
+            self.bulk_create(RecipeTag, [
+                RecipeTag(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id, tag_id in links.tolist()])
+        return np.arange(first_id, first_id + count)
+
+    def create_user_links(self, user_ids: np.ndarray, recipes: ZipfSampler,
+                          authors: ZipfSampler, favorites: int,
+                          shopping_carts: int, follows: int) -> None:
+        """
+        Избранное, корзины и подписки. Активность пользователей
+        распределена геометрически: большинство добавляет немного,
+        единицы - очень много.
+        """
+        for ids in self.batches(int(user_ids[0]), len(user_ids)):
+            for model, mean, sampler in (
+                    (Favorite, favorites, recipes),
+                    (ShoppingCart, shopping_carts, recipes),
+                    (Follow, follows, authors)):
+                if not mean:
+                    continue
+                counts = self.rng.geometric(1 / mean, len(ids))
+                users = np.repeat(ids, counts)
+                targets = sampler.sample(counts.sum())
+                if model is Follow:
+                    # Подписка на себя запрещена, такие пары отбрасываются
+                    users[users == targets] = -1
+                links = unique_pairs(users, targets).tolist()
+                if model is Follow:
+                    objs = [Follow(user_id=user_id, author_id=author_id)
+                            for user_id, author_id in links]
+                elif model is ShoppingCart:
+                    servings = self.rng.integers(1, 5, len(links)).tolist()
+                    objs = [ShoppingCart(user_id=user_id, recipe_id=recipe_id,
+                                         servings=portions)
+                            for (user_id, recipe_id), portions
+                            in zip(links, servings)]
+                else:
+                    objs = [model(user_id=user_id, recipe_id=recipe_id)
+                            for user_id, recipe_id in links]
+                self.bulk_create(model, objs)
+
+    def generate(self, users: int, recipes: int,
+                 ingredients_per_recipe: int = 8, favorites: int = 10,
+                 shopping_carts: int = 2, follows: int = 5) -> dict:
+        """
+        Создает данные и возвращает число вставленных строк по моделям.
+        Средние favorites, shopping_carts и follows - 0 или не меньше 1:
+        геометрическому распределению нужна вероятность 1 / mean <= 1.
+        """
+        ingredient_ids = np.array(
+            Ingredient.objects.values_list('id', flat=True))
+        if not len(ingredient_ids):
+            raise ValueError('Сначала загрузите ингредиенты.')
+        with transaction.atomic():
+            user_ids = self.create_users(users)
+            tag_ids = self.create_tags()
+            authors = ZipfSampler(self.rng, user_ids)
+            recipe_ids = self.create_recipes(
+                recipes, authors, ZipfSampler(self.rng, ingredient_ids),
+                tag_ids, ingredients_per_recipe)
+            self.create_user_links(user_ids, ZipfSampler(self.rng, recipe_ids),
+                                   authors, favorites, shopping_carts,
+                                   follows)
+            reset_sequences(User, Recipe)
+            # Избранное, корзины и подписки тестовых пользователей
+            # в журнал изменений не попадают
+            record_changes('tag', tag_ids.tolist(), Change.UPSERT,
+                           batch_size=self.batch_size)
+            record_changes('recipe', recipe_ids.tolist(), Change.UPSERT,
+                           batch_size=self.batch_size)
+        # bulk_create не отправляет сигналы, рейтинги считаются заново
+        update_recipe_totals()
+        rebuild_recipe_scores()
+        return self.created
@@ -0,0 +1,74 @@
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from recipes.models import Recipe
+
+IMAGE_GC_GRACE = settings.IMAGE_GC_GRACE
+IMAGE_GC_BATCH_SIZE = settings.DELETION_BATCH_SIZE
+IMAGE_FIELD = Recipe._meta.get_field('image')
+
+
+def image_references(names) -> dict:
+    """Число рецептов, ссылающихся на каждую картинку из names."""
+    return dict(Recipe.objects.filter(image__in=list(names))
+                .order_by().values_list('image')
+                .annotate(count=Count('id')))
+
+
+def unreferenced_images(names, grace: int = IMAGE_GC_GRACE) -> list:
+    """
+    Картинки из names, на которые не ссылается ни один рецепт
+    и которые не загружались последние grace секунд.
+    """
+    storage = IMAGE_FIELD.storage
+    threshold = timezone.now() - timedelta(seconds=grace)
+    names = set(filter(None, names)) - set(image_references(names))
+    return [name for name in sorted(names)
+            if storage.exists(name)
+            and storage.get_modified_time(name) <= threshold]
+
+
+def delete_unreferenced(name: str, grace: int = IMAGE_GC_GRACE) -> bool:
+    """
+    Удаляет картинку, если на нее по-прежнему нет ссылок и ее не
+    загружали последние grace секунд. Проверка повторяется прямо
+    перед удалением: между выбором кандидатов и удалением картинку
+    могли загрузить снова.
+    """
+    threshold = timezone.now() - timedelta(seconds=grace)
+    return IMAGE_FIELD.storage.delete_unused(
+        name, lambda name, modified: (
+            modified > threshold
+            or Recipe.objects.filter(image=name).exists()))
+
+
+def remove_unreferenced(names, grace: int = IMAGE_GC_GRACE) -> list:
+    """Удаляет картинки без ссылок, возвращает имена удаленных."""
+    return [name for name in unreferenced_images(names, grace)
+            if delete_unreferenced(name, grace)]
+
+
+def collect_image_garbage(batch_size: int = IMAGE_GC_BATCH_SIZE,
+                          grace: int = IMAGE_GC_GRACE,
+                          dry_run: bool = False) -> dict:
+    """
+    Обходит каталог картинок рецептов и удаляет файлы без ссылок.
+    Ссылки проверяются одним запросом на пачку имен.
+    """
+    stats = {'files': 0, 'removed': 0, 'bytes': 0}
+    storage = IMAGE_FIELD.storage
+    names = storage.walk(IMAGE_FIELD.upload_to.rstrip('/'))
+    while True:
+        batch = list(islice(names, batch_size))
+        if not batch:
+            return stats
+        stats['files'] += len(batch)
+        for name in unreferenced_images(batch, grace):
+            size = storage.size(name)
+            if dry_run or delete_unreferenced(name, grace):
+                stats['removed'] += 1
+                stats['bytes'] += size
@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand
+
+from recipes.images import (IMAGE_GC_BATCH_SIZE, IMAGE_GC_GRACE,
+                            collect_image_garbage)
+
+
+class Command(BaseCommand):
+    help = 'Удаление картинок рецептов, на которые нет ссылок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=IMAGE_GC_BATCH_SIZE)
+        parser.add_argument('--grace', type=int, default=IMAGE_GC_GRACE,
+                            help='Не трогать файлы моложе, секунды.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено.')
+
+    def handle(self, *args, **options):
+        stats = collect_image_garbage(options['batch_size'],
+                                      options['grace'], options['dry_run'])
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {stats["files"]}. {action}: '
+            f'{stats["removed"]}, {stats["bytes"]} байт.'))
@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand
+
+from recipes.scores import (SCORE_BATCH_SIZE, decay_trending_scores,
+                            rebuild_recipe_scores)
+
+
+class Command(BaseCommand):
+    help = ('Затухание рейтинга trending. Запускается периодически, '
+            'например раз в час из cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=SCORE_BATCH_SIZE)
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Пересчитать рейтинги с нуля.')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            updated = rebuild_recipe_scores(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Пересчитано рейтингов: {updated}.'))
+            return
+        updated = decay_trending_scores(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено рейтингов: {updated}.'))
@@ -0,0 +1,57 @@
+from django.core.management import BaseCommand, CommandError
+
+from jobs.queue import enqueue
+from recipes.dedup import (DEDUP_BATCH_SIZE, DEDUP_PREFIX, DEDUP_THRESHOLD,
+                           deduplicate_ingredients, find_duplicates)
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = ('Слияние ингредиентов, которые отличаются регистром, '
+            'ё/е, пробелами, записью единицы или опечаткой.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float,
+                            default=DEDUP_THRESHOLD,
+                            help='Порог похожести названий, от 0 до 1.')
+        parser.add_argument('--prefix', type=int, default=DEDUP_PREFIX,
+                            help='Сравнивать названия с общим началом '
+                                 'такой длины.')
+        parser.add_argument('--batch-size', type=int,
+                            default=DEDUP_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать найденные дубликаты.')
+        parser.add_argument('--async', action='store_true',
+                            dest='in_background',
+                            help='Поставить слияние в очередь задач.')
+
+    def handle(self, *args, **options):
+        if not 0 < options['threshold'] <= 1:
+            raise CommandError('Порог похожести от 0 до 1.')
+        if options['prefix'] < 0:
+            raise CommandError('Длина начала названия не меньше 0.')
+        params = {key: options[key]
+                  for key in ('threshold', 'prefix', 'batch_size')}
+        if options['in_background']:
+            job = enqueue('dedupe_ingredients', **params)
+            self.stdout.write(f'Задача {job.id} поставлена в очередь.')
+            return
+        if options['dry_run']:
+            rows = list(Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'))
+            names = {ingredient_id: f'{name} ({unit})'
+                     for ingredient_id, name, unit in rows}
+            clusters = find_duplicates(rows, options['threshold'],
+                                       options['prefix'])
+            for cluster in clusters:
+                self.stdout.write(' | '.join(names[ingredient_id]
+                                             for ingredient_id in cluster))
+            self.stdout.write(self.style.SUCCESS(
+                f'Найдено групп дубликатов: {len(clusters)}.'))
+            return
+        stats = deduplicate_ingredients(**params)
+        self.stdout.write(self.style.SUCCESS(
+            f'Групп дубликатов: {stats["clusters"]}, удалено '
+            f'ингредиентов: {stats["duplicates"]}, изменено рецептов: '
+            f'{stats["recipes"]}, обновлено ключей: {stats["normalized"]} '
+            f'за {stats["seconds"]} с.'))
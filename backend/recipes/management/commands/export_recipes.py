@@ -0,0 +1,23 @@
+import sys
+
+from django.core.management import BaseCommand
+
+from recipes.transfer import TRANSFER_BATCH_SIZE, export_recipes
+
+
+class Command(BaseCommand):
+    help = 'Экспорт всех рецептов в формате JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Файл, по умолчанию stdout.')
+        parser.add_argument('--batch-size', type=int,
+                            default=TRANSFER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        output = (open(options['output'], 'w', encoding='utf-8')
+                  if options['output'] else sys.stdout)
+        try:
+            output.writelines(export_recipes(options['batch_size']))
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from recipes.fake_data import FAKE_DATA_BATCH_SIZE, FakeDataGenerator
+
+
+class Command(BaseCommand):
+    help = ('Генерация пользователей, рецептов, избранного, корзин '
+            'и подписок для нагрузочного тестирования.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8,
+                            help='Среднее число ингредиентов в рецепте.')
+        parser.add_argument('--favorites', type=int, default=10,
+                            help='Среднее число избранных у пользователя.')
+        parser.add_argument('--shopping-carts', type=int, default=2,
+                            help='Среднее число рецептов в корзине.')
+        parser.add_argument('--follows', type=int, default=5,
+                            help='Среднее число подписок у пользователя.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int,
+                            default=FAKE_DATA_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['recipes'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь и рецепт.')
+        if options['ingredients_per_recipe'] < 1:
+            raise CommandError('В рецепте нужен хотя бы один ингредиент.')
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пачки должен быть больше нуля.')
+        for name in ('favorites', 'shopping_carts', 'follows'):
+            if options[name] < 0:
+                raise CommandError(
+                    f'--{name.replace("_", "-")}: среднее не может '
+                    f'быть отрицательным.')
+        start = time.perf_counter()
+        generator = FakeDataGenerator(options['seed'], options['batch_size'])
+        try:
+            created = generator.generate(
+                options['users'], options['recipes'],
+                options['ingredients_per_recipe'], options['favorites'],
+                options['shopping_carts'], options['follows'])
+        except ValueError as error:
+            raise CommandError(error)
+        except IntegrityError as error:
+            raise CommandError(f'Данные конфликтуют с существующими: {error}')
+        for model, count in created.items():
+            self.stdout.write(f'{model}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные созданы за {time.perf_counter() - start:.1f} с.'))
@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand
+
+from recipes.transfer import TRANSFER_BATCH_SIZE, import_recipes
+
+
+class Command(BaseCommand):
+    help = 'Импорт рецептов из файла JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int,
+                            default=TRANSFER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        with open(options['path'], encoding='utf-8') as jsonl_file:
+            stats = import_recipes(jsonl_file, options['batch_size'])
+        for error in stats['errors']:
+            self.stderr.write(f'Строка {error["line"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов загружено: {stats["created"]}, '
+            f'пропущено: {stats["skipped"]}.'))
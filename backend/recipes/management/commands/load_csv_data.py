@@ -1,22 +1,33 @@
 import csv
 
-from django.core.management import BaseCommand
-from tqdm import tqdm
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
 
-from recipes.models import Ingredient
+from jobs.queue import enqueue
+from recipes.catalog import load_ingredients
 
 
 class Command(BaseCommand):
+    """
+    Загрузка ингредиентов. Колонки: название, единица измерения
+    и необязательные калории, белки, жиры, углеводы, цена на 100 г.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.INGREDIENTS_CSV,
+                            help='Путь к CSV-файлу с ингредиентами.')
+        parser.add_argument('--async', action='store_true',
+                            dest='in_background',
+                            help='Поставить загрузку в очередь задач.')
+
     def handle(self, *args, **kwarg):
+        if kwarg['in_background']:
+            job = enqueue('load_ingredients', path=kwarg['path'])
+            self.stdout.write(f'Задача {job.id} поставлена в очередь.')
+            return
         try:
-            with open('../data/ingredients.csv',
-                      encoding='utf-8') as csv_file:
-                reader = csv.reader(csv_file)
-                for row in tqdm(reader, desc='Ingredients'):
-                    _, created = Ingredient.objects.get_or_create(
-                        name=row[0],
-                        measurement_unit=row[1])
-            self.stdout.write(self.style.SUCCESS(
-                'Ингредиенты загружены.'))
-        except Exception as e:
-            print(f'Ошибка загрузки данных: {e}')
+            loaded = load_ingredients(kwarg['path'], progress=True)
+        except (OSError, ValueError, IndexError, csv.Error) as e:
+            raise CommandError(f'Ошибка загрузки данных: {e}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Ингредиенты загружены: {loaded}.'))
@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+
+from recipes.nutrition import NUTRITION_BATCH_SIZE, update_recipe_totals
+
+
+class Command(BaseCommand):
+    help = 'Пересчет пищевой ценности и стоимости всех рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=NUTRITION_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        updated = update_recipe_totals(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено рецептов: {updated}.'))
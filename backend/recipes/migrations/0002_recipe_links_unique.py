@@ -0,0 +1,60 @@
+# flake8: noqa
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, Exists, Min, OuterRef, Sum
+
+
+def remove_duplicate_links(apps, schema_editor):
+    """
+    Связи создавались bulk_create в обход проверки уникальности,
+    поэтому повторы удаляются до добавления ограничений. Количества
+    одного ингредиента в рецепте складываются в связь с наименьшим
+    id, повторные связи с тегом просто удаляются.
+    """
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    RecipeTag = apps.get_model('recipes', 'RecipeTag')
+    totals = (RecipeIngredient.objects.values('recipe', 'ingredient')
+              .annotate(count=Count('id'), first=Min('id'),
+                        total=Sum('amount'))
+              .filter(count__gt=1).values_list('first', 'total'))
+    RecipeIngredient.objects.bulk_update(
+        [RecipeIngredient(id=link_id, amount=total)
+         for link_id, total in totals.iterator()],
+        ('amount',), batch_size=500)
+    for model, field in ((RecipeIngredient, 'ingredient'),
+                         (RecipeTag, 'tag')):
+        earlier = model.objects.filter(
+            recipe=OuterRef('recipe'), id__lt=OuterRef('id'),
+            **{field: OuterRef(field)})
+        model.objects.filter(Exists(earlier))._raw_delete(
+            schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_recipe_created_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_links,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.IntegerField(validators=[django.core.validators.MinValueValidator(1, message='Укажите время приготовления больше 0.')], verbose_name='Время приготовления'),
+        ),
+        migrations.AlterField(
+            model_name='recipeingredient',
+            name='amount',
+            field=models.IntegerField(validators=[django.core.validators.MinValueValidator(1, message='Укажите количество больше 0.')], verbose_name='Количество'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipeingredient',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingredient'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipetag',
+            constraint=models.UniqueConstraint(fields=('recipe', 'tag'), name='unique_recipe_tag'),
+        ),
+    ]
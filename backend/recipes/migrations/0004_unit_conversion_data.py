@@ -0,0 +1,40 @@
+# flake8: noqa
+from django.db import migrations
+
+# Единица измерения, базовая единица, количество базовых единиц
+UNIT_CONVERSIONS = (
+    ('г', 'г', 1),
+    ('кг', 'г', 1000),
+    ('щепотка', 'г', 1),
+    ('мл', 'мл', 1),
+    ('л', 'мл', 1000),
+    ('стакан', 'мл', 200),
+    ('ст. л.', 'мл', 15),
+    ('ч. л.', 'мл', 5),
+    ('капля', 'мл', 0.05),
+)
+
+
+def load_unit_conversions(apps, schema_editor):
+    UnitConversion = apps.get_model('recipes', 'UnitConversion')
+    UnitConversion.objects.bulk_create(
+        UnitConversion(unit=unit, base_unit=base_unit, factor=factor)
+        for unit, base_unit, factor in UNIT_CONVERSIONS
+    )
+
+
+def unload_unit_conversions(apps, schema_editor):
+    UnitConversion = apps.get_model('recipes', 'UnitConversion')
+    UnitConversion.objects.filter(
+        unit__in=[unit for unit, _, _ in UNIT_CONVERSIONS]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_nutrition'),
+    ]
+
+    operations = [
+        migrations.RunPython(load_unit_conversions, unload_unit_conversions),
+    ]
@@ -0,0 +1,20 @@
+# flake8: noqa
+# Generated by Django 3.2.3 on 2026-10-19 19:07
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_unit_conversion_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='servings',
+            field=models.PositiveIntegerField(default=1, help_text='Во сколько раз умножить количество ингредиентов', validators=[django.core.validators.MinValueValidator(1, message='Укажите количество порций больше 0.')], verbose_name='Порции'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# flake8: noqa
+from django.db import migrations
+from django.db.models import Count
+
+
+def create_recipe_scores(apps, schema_editor):
+    """
+    Рейтинги существующих рецептов. Даты добавления у старых записей
+    одинаковые, поэтому trending равен popularity.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeScore = apps.get_model('recipes', 'RecipeScore')
+    recipes = Recipe.objects.annotate(
+        favorites_count=Count('favorites', distinct=True),
+        carts_count=Count('shopping_carts', distinct=True),
+    ).values_list('id', 'favorites_count', 'carts_count')
+    RecipeScore.objects.bulk_create(
+        (RecipeScore(recipe_id=recipe_id,
+                     popularity=favorites + carts,
+                     trending=favorites + carts)
+         for recipe_id, favorites, carts in recipes.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_recipe_scores,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# flake8: noqa
+# Generated by Django 3.2.3 on 2026-10-19 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_author_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=200, verbose_name='Нормализованное название'),
+            preserve_default=False,
+        ),
+    ]
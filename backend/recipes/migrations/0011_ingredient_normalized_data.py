@@ -0,0 +1,88 @@
+# flake8: noqa
+import re
+
+from django.db import migrations
+
+# Копия recipes.normalize на момент миграции: миграция не должна
+# меняться вместе с правилами нормализации
+NAME_STRIP_CHARS = ' .,;:"\'«»'
+BATCH_SIZE = 500
+
+
+def normalize_unit(name):
+    name = re.sub(r'\.(?=\S)', '. ', name.strip().lower())
+    return re.sub(r'\s+', ' ', name)
+
+
+def normalize_name(name):
+    name = name.casefold().replace('ё', 'е')
+    name = re.sub(r'["«»]', '', name)
+    return re.sub(r'\s+', ' ', name).strip(NAME_STRIP_CHARS)
+
+
+def merge_exact_duplicates(apps, schema_editor):
+    """
+    Заполняет нормализованные название и единицу. Ингредиенты
+    с одинаковым ключом сливаются в ингредиент с наименьшим id:
+    связи переносятся, количества в одном рецепте складываются.
+    Похожие, но не совпадающие названия сливает dedupe_ingredients.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    canonical, duplicates, ingredients = {}, {}, []
+    for ingredient in Ingredient.objects.order_by('id').only(
+            'id', 'name', 'measurement_unit').iterator():
+        ingredient.normalized_name = normalize_name(ingredient.name)
+        ingredient.measurement_unit = normalize_unit(
+            ingredient.measurement_unit)
+        key = (ingredient.normalized_name, ingredient.measurement_unit)
+        if key in canonical:
+            duplicates[ingredient.id] = canonical[key]
+            continue
+        canonical[key] = ingredient.id
+        ingredients.append(ingredient)
+    Ingredient.objects.bulk_update(
+        ingredients, ('normalized_name', 'measurement_unit'),
+        batch_size=BATCH_SIZE)
+    if not duplicates:
+        return
+
+    # Связи основных ингредиентов идут первыми, к ним добавляются
+    # количества дубликатов из того же рецепта
+    links = RecipeIngredient.objects.filter(
+        ingredient_id__in=[*duplicates, *set(duplicates.values())]
+    ).values_list('id', 'recipe_id', 'ingredient_id', 'amount')
+    kept, changed, removed = {}, {}, []
+    for link_id, recipe_id, ingredient_id, amount in sorted(
+            links, key=lambda link: (link[2] in duplicates, link[0])):
+        target = duplicates.get(ingredient_id, ingredient_id)
+        link = kept.get((recipe_id, target))
+        if link is None:
+            link = kept[(recipe_id, target)] = RecipeIngredient(
+                id=link_id, recipe_id=recipe_id, ingredient_id=target,
+                amount=amount)
+            if target != ingredient_id:
+                changed[link_id] = link
+            continue
+        link.amount += amount
+        changed[link.id] = link
+        removed.append(link_id)
+    # Лишние связи удаляются до переноса из-за unique_recipe_ingredient
+    for start in range(0, len(removed), BATCH_SIZE):
+        RecipeIngredient.objects.filter(
+            id__in=removed[start:start + BATCH_SIZE]).delete()
+    RecipeIngredient.objects.bulk_update(
+        changed.values(), ('ingredient', 'amount'), batch_size=BATCH_SIZE)
+    Ingredient.objects.filter(id__in=list(duplicates)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_ingredient_normalized_name'),
+    ]
+
+    # Слитые ингредиенты и сложенные количества не восстановить
+    operations = [
+        migrations.RunPython(merge_exact_duplicates, reverse_code=None),
+    ]
@@ -0,0 +1,18 @@
+# flake8: noqa
+# Generated by Django 3.2.3 on 2026-10-19 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_ingredient_normalized_data'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('normalized_name', 'measurement_unit'), name='unique_ingredient_normalized'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# flake8: noqa
+# Generated by Django 3.2.3 on 2026-10-19 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_ingredient_unique_normalized'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['updated'], name='recipe_score_updated'),
+        ),
+    ]
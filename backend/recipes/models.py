@@ -1,12 +1,16 @@
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
 
+from core.storage import ContentAddressedStorage
+from recipes.normalize import normalize_name, normalize_unit
 from users.models import User
 
 # Минимальное время приготовления, для валидатора в модели Recipe
 MIN_COOKING_TIME = settings.MIN_COOKING_TIME
 MIN_VALUE = settings.MIN_VALUE  # Минимальное количество ингредиента
+MIN_SERVINGS = settings.MIN_SERVINGS
 
 
 class Tag(models.Model):
@@ -26,15 +30,58 @@ class Tag(models.Model):
 class Ingredient(models.Model):
     "Модель ингредиентов."
     name = models.CharField('Ингредиент', max_length=200, db_index=True)
+    # Ключ поиска и уникальности, заполняется в save()
+    normalized_name = models.CharField('Нормализованное название',
+                                       max_length=200, editable=False)
     measurement_unit = models.CharField('Единица измерения', max_length=200)
+    # Пищевая ценность и цена указываются на 100 г (мл) продукта
+    calories = models.FloatField(
+        'Калорийность, ккал', default=0, validators=[MinValueValidator(0)])
+    proteins = models.FloatField(
+        'Белки, г', default=0, validators=[MinValueValidator(0)])
+    fats = models.FloatField(
+        'Жиры, г', default=0, validators=[MinValueValidator(0)])
+    carbohydrates = models.FloatField(
+        'Углеводы, г', default=0, validators=[MinValueValidator(0)])
+    price = models.FloatField(
+        'Цена', default=0, validators=[MinValueValidator(0)])
 
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('normalized_name', 'measurement_unit'),
+                name='unique_ingredient_normalized')
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_name'}
+        self.name = ' '.join(self.name.split())
+        self.normalized_name = normalize_name(self.name)
+        self.measurement_unit = normalize_unit(self.measurement_unit)
+        super().save(*args, **kwargs)
+
+
+class UnitConversion(models.Model):
+    "Перевод единиц измерения в базовые (г, мл)."
+    unit = models.CharField('Единица измерения', max_length=200, unique=True)
+    base_unit = models.CharField('Базовая единица', max_length=200)
+    factor = models.FloatField(
+        'Количество базовых единиц', validators=[MinValueValidator(0)])
+
+    class Meta:
+        verbose_name = 'Перевод единиц измерения'
+        verbose_name_plural = 'Перевод единиц измерения'
+
+    def __str__(self):
+        return f'1 {self.unit} = {self.factor} {self.base_unit}'
+
 
 class Recipe(models.Model):
     "Модель рецептов."
@@ -43,7 +90,8 @@ class Recipe(models.Model):
                                related_name='recipes',
                                verbose_name='Автор рецепта')
     name = models.CharField('Название рецепта', max_length=200)
-    image = models.ImageField('Картинка', upload_to='recipes/')
+    image = models.ImageField('Картинка', upload_to='recipes/',
+                              storage=ContentAddressedStorage())
     text = models.TextField('Текстовое описание блюда')
     cooking_time = models.IntegerField(
         'Время приготовления',
@@ -56,10 +104,25 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField(Ingredient,
                                          verbose_name='Ингредиенты',
                                          through='RecipeIngredient')
+    created = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated = models.DateTimeField('Дата изменения', auto_now=True,
+                                   db_index=True)
+    # Итоги по ингредиентам, пересчитываются в recipes.nutrition
+    calories = models.FloatField('Калорийность, ккал', default=0,
+                                 editable=False, db_index=True)
+    proteins = models.FloatField('Белки, г', default=0, editable=False)
+    fats = models.FloatField('Жиры, г', default=0, editable=False)
+    carbohydrates = models.FloatField('Углеводы, г', default=0,
+                                      editable=False)
+    cost = models.FloatField('Стоимость', default=0, editable=False,
+                             db_index=True)
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        # Рецепты автора от новых к старым: профиль и ?author=
+        indexes = [models.Index(fields=('author', '-id'),
+                                name='recipe_author_id_idx')]
 
     def __str__(self):
         return self.name
@@ -122,6 +185,7 @@ class Favorite(models.Model):
                              on_delete=models.CASCADE,
                              related_name='favorites',
                              verbose_name='Пользователь')
+    created = models.DateTimeField('Дата добавления', auto_now_add=True)
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -142,6 +206,14 @@ class ShoppingCart(models.Model):
                              on_delete=models.CASCADE,
                              related_name='shopping_carts',
                              verbose_name='Пользователь')
+    created = models.DateTimeField('Дата добавления', auto_now_add=True)
+    servings = models.PositiveIntegerField(
+        'Порции',
+        default=1,
+        help_text='Во сколько раз умножить количество ингредиентов',
+        validators=[MinValueValidator(
+            MIN_SERVINGS,
+            message='Укажите количество порций больше 0.')])
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -150,3 +222,35 @@ class ShoppingCart(models.Model):
             models.UniqueConstraint(fields=('recipe', 'user'),
                                     name='unique_shopping_cart')
         ]
+
+
+class RecipeScore(models.Model):
+    """
+    Рейтинг рецепта по избранному и корзинам. Обновляется при каждом
+    добавлении и удалении, trending затухает экспоненциально,
+    см. recipes.scores.
+    """
+    recipe = models.OneToOneField(Recipe,
+                                  on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='score',
+                                  verbose_name='Рецепт')
+    popularity = models.IntegerField('Популярность', default=0)
+    trending = models.FloatField('Популярность с затуханием', default=0)
+    decayed_at = models.DateTimeField('Дата затухания', default=timezone.now)
+    updated = models.DateTimeField('Дата изменения', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [
+            models.Index(fields=('-popularity', '-recipe'),
+                         name='recipe_score_popularity'),
+            models.Index(fields=('-trending', '-recipe'),
+                         name='recipe_score_trending'),
+            # Max(updated) для ETag списков с сортировкой по рейтингу
+            models.Index(fields=('updated',), name='recipe_score_updated'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.popularity}, {self.trending:.2f}'
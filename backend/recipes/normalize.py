@@ -0,0 +1,20 @@
+import re
+
+# Кавычки и знаки препинания по краям названия
+NAME_STRIP_CHARS = ' .,;:"\'«»'
+
+
+def normalize_unit(name: str) -> str:
+    """'Ст.Л.' и 'ст.  л.' записываются одинаково: 'ст. л.'."""
+    name = re.sub(r'\.(?=\S)', '. ', name.strip().lower())
+    return re.sub(r'\s+', ' ', name)
+
+
+def normalize_name(name: str) -> str:
+    """
+    Ключ названия ингредиента: без учета регистра, ё/е, лишних
+    пробелов и кавычек. 'Ёжевика  «Садовая»' -> 'ежевика садовая'.
+    """
+    name = name.casefold().replace('ё', 'е')
+    name = re.sub(r'["«»]', '', name)
+    return re.sub(r'\s+', ' ', name).strip(NAME_STRIP_CHARS)
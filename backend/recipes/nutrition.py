@@ -0,0 +1,106 @@
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from changes.log import record_changes
+from changes.models import Change
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.units import get_unit_graph
+
+# Поля ингредиента на 100 г (мл) и соответствующие итоги рецепта
+NUTRIENT_FIELDS = ('calories', 'proteins', 'fats', 'carbohydrates', 'price')
+TOTAL_FIELDS = ('calories', 'proteins', 'fats', 'carbohydrates', 'cost')
+NUTRITION_BATCH_SIZE = settings.NUTRITION_BATCH_SIZE
+
+
+def get_ingredient_matrix(ingredient_ids: list = None) -> np.ndarray:
+    """
+    Матрица значений на одну единицу измерения ингредиента.
+    Номер строки совпадает с id ингредиента. Единицы без записи
+    в графе переводов не учитываются, 1 мл считается равным 1 г.
+    """
+    graph = get_unit_graph()
+    ingredients = Ingredient.objects.all()
+    if ingredient_ids is not None:
+        ingredients = ingredients.filter(id__in=ingredient_ids)
+    rows = list(ingredients.values_list(
+        'id', 'measurement_unit', *NUTRIENT_FIELDS))
+    if not rows:
+        return np.zeros((0, len(NUTRIENT_FIELDS)))
+
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    values = np.array([row[2:] for row in rows], dtype=np.float64)
+    units = [graph.unit(row[1]) for row in rows]
+    per_unit = np.array([0 if unit.countable else float(unit.factor)
+                         for unit in units]) / 100
+    matrix = np.zeros((ids.max() + 1, len(NUTRIENT_FIELDS)))
+    matrix[ids] = values * per_unit[:, np.newaxis]
+    return matrix
+
+
+def get_recipe_links(recipe_ids: np.ndarray) -> np.ndarray:
+    """Строки (recipe_id, ingredient_id, amount) для рецептов."""
+    rows = RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids.tolist()).values_list(
+        'recipe_id', 'ingredient_id', 'amount')
+    return np.array(list(rows), dtype=np.int64).reshape(-1, 3)
+
+
+def calculate_totals(recipe_ids: np.ndarray, links: np.ndarray,
+                     matrix: np.ndarray) -> np.ndarray:
+    """
+    Итоги по рецептам, строки в порядке отсортированных recipe_ids.
+    """
+    totals = np.zeros((len(recipe_ids), len(NUTRIENT_FIELDS)))
+    # Ингредиенты, добавленные после построения матрицы, пропускаем
+    links = links[links[:, 1] < len(matrix)]
+    positions = np.searchsorted(recipe_ids, links[:, 0])
+    np.add.at(totals, positions,
+              matrix[links[:, 1]] * links[:, 2, np.newaxis])
+    return totals.round(2)
+
+
+def set_recipe_totals(recipe: Recipe) -> None:
+    """Пересчет итогов одного рецепта при сохранении."""
+    recipe_ids = np.array([recipe.id], dtype=np.int64)
+    links = get_recipe_links(recipe_ids)
+    matrix = get_ingredient_matrix(links[:, 1].tolist())
+    totals = calculate_totals(recipe_ids, links, matrix)[0]
+    for field, value in zip(TOTAL_FIELDS, totals):
+        setattr(recipe, field, float(value))
+    recipe.save(update_fields=TOTAL_FIELDS)
+
+
+def update_recipe_totals(recipe_ids: list = None,
+                         batch_size: int = NUTRITION_BATCH_SIZE) -> int:
+    """
+    Пакетный пересчет итогов. Без recipe_ids пересчитывается
+    весь каталог. Сохраняются только изменившиеся рецепты, у них
+    обновляется и поле updated, иначе условный GET отдал бы 304
+    со старыми итогами, и пишется журнал изменений.
+    Возвращает количество обновленных рецептов.
+    """
+    matrix = get_ingredient_matrix()
+    recipes = Recipe.objects.order_by('id')
+    if recipe_ids is not None:
+        recipes = recipes.filter(id__in=recipe_ids)
+
+    updated = last_id = 0
+    while True:
+        rows = list(recipes.filter(id__gt=last_id)
+                    .values_list('id', *TOTAL_FIELDS)[:batch_size])
+        if not rows:
+            return updated
+        batch = np.array([row[0] for row in rows], dtype=np.int64)
+        current = np.array([row[1:] for row in rows], dtype=np.float64)
+        totals = calculate_totals(batch, get_recipe_links(batch), matrix)
+        changed = np.any(totals != current, axis=1)
+        now = timezone.now()
+        Recipe.objects.bulk_update(
+            [Recipe(id=int(recipe_id), updated=now,
+                    **dict(zip(TOTAL_FIELDS, map(float, row))))
+             for recipe_id, row in zip(batch[changed], totals[changed])],
+            (*TOTAL_FIELDS, 'updated'))
+        record_changes('recipe', batch[changed].tolist(), Change.UPSERT)
+        updated += int(changed.sum())
+        last_id = int(batch[-1])
@@ -0,0 +1,52 @@
+from import_export import fields, resources, widgets
+
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.normalize import normalize_name, normalize_unit
+from recipes.nutrition import update_recipe_totals
+from users.models import User
+
+
+class IngredientResource(resources.ModelResource):
+    """Импорт/экспорт ингредиентов с пищевой ценностью и ценой."""
+    # id только выгружается: пустой id при импорте превратил бы
+    # найденный ингредиент в новый
+    id = fields.Field(attribute='id', column_name='id', readonly=True)
+
+    class Meta:
+        model = Ingredient
+        import_id_fields = ('name', 'measurement_unit')
+        fields = ('id', 'name', 'measurement_unit', 'calories', 'proteins',
+                  'fats', 'carbohydrates', 'price')
+
+    def get_instance(self, instance_loader, row):
+        """
+        Строка обновляет ингредиент с тем же нормализованным ключом:
+        'Сахар ' и 'сахар' не создают дубликат.
+        """
+        return Ingredient.objects.filter(
+            normalized_name=normalize_name(row['name']),
+            measurement_unit=normalize_unit(row['measurement_unit']),
+        ).first()
+
+    def after_import(self, dataset, result, using_transactions, dry_run,
+                     **kwargs):
+        """Пересчитываем итоги рецептов по новым значениям."""
+        super().after_import(dataset, result, using_transactions, dry_run,
+                             **kwargs)
+        if not dry_run:
+            update_recipe_totals()
+
+
+class RecipeResource(resources.ModelResource):
+    """Импорт/экспорт рецептов с автором и тегами."""
+    author = fields.Field(
+        column_name='author', attribute='author',
+        widget=widgets.ForeignKeyWidget(User, field='username'))
+    tags = fields.Field(
+        column_name='tags', attribute='tags',
+        widget=widgets.ManyToManyWidget(Tag, field='slug'))
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'name', 'text', 'cooking_time', 'image',
+                  'author', 'tags')
@@ -0,0 +1,133 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from recipes.models import Favorite, Recipe, RecipeScore, ShoppingCart
+
+# Вес добавления в избранное и в корзину
+SCORE_WEIGHTS = settings.RECIPE_SCORE_WEIGHTS
+# Время, за которое вклад добавления в trending падает вдвое, секунды
+TRENDING_HALF_LIFE = settings.TRENDING_HALF_LIFE
+# Меньшие значения trending обнуляются и больше не затухают
+MIN_TRENDING = 0.001
+SCORE_BATCH_SIZE = settings.NUTRITION_BATCH_SIZE
+SCORE_MODELS = (('favorite', Favorite), ('shopping_cart', ShoppingCart))
+
+
+def decay_factor(age):
+    """Множитель затухания для возраста в секундах (число или массив)."""
+    return np.exp2(-np.maximum(age, 0) / TRENDING_HALF_LIFE)
+
+
+def change_recipe_score(recipe_id: int, popularity: int,
+                        trending: float) -> None:
+    """
+    Атомарное изменение рейтинга через F(), без чтения строки.
+    Если строки еще нет (рецепт создан bulk_create), она создается
+    при положительном изменении.
+    """
+    changed = RecipeScore.objects.filter(recipe_id=recipe_id).update(
+        popularity=Greatest(F('popularity') + popularity, 0),
+        trending=Greatest(F('trending') + trending, 0.0),
+        updated=timezone.now())
+    if not changed and popularity > 0:
+        RecipeScore.objects.bulk_create(
+            [RecipeScore(recipe_id=recipe_id, popularity=popularity,
+                         trending=trending)],
+            ignore_conflicts=True)
+
+
+def add_to_score(kind: str, recipe_id: int) -> None:
+    weight = SCORE_WEIGHTS[kind]
+    change_recipe_score(recipe_id, weight, weight)
+
+
+def remove_from_score(kind: str, recipe_id: int, created) -> None:
+    """
+    Вычитает вклад удаленной записи. Вклад уже затух с даты добавления
+    до последнего затухания рейтинга.
+    """
+    decayed_at = (RecipeScore.objects.filter(recipe_id=recipe_id)
+                  .values_list('decayed_at', flat=True).first())
+    if decayed_at is None:
+        return
+    weight = SCORE_WEIGHTS[kind]
+    contribution = weight * float(
+        decay_factor((decayed_at - created).total_seconds()))
+    change_recipe_score(recipe_id, -weight, -contribution)
+
+
+def decay_trending_scores(batch_size: int = SCORE_BATCH_SIZE) -> int:
+    """
+    Пакетное затухание trending с момента прошлого затухания строки.
+    Умножение идет через F(), поэтому одновременные добавления
+    не теряются. Возвращает количество обновленных рейтингов.
+    """
+    now = timezone.now()
+    scores = (RecipeScore.objects.filter(trending__gt=0)
+              .order_by('recipe_id')
+              .values_list('recipe_id', 'decayed_at'))
+    updated = last_id = 0
+    while True:
+        batch = list(scores.filter(recipe_id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        recipe_ids = [recipe_id for recipe_id, _ in batch]
+        factors = decay_factor(np.array(
+            [(now - decayed_at).total_seconds() for _, decayed_at in batch]))
+        RecipeScore.objects.filter(recipe_id__in=recipe_ids).update(
+            trending=Case(
+                *[When(recipe_id=recipe_id, then=F('trending') * factor)
+                  for recipe_id, factor in zip(recipe_ids, factors.tolist())],
+                output_field=FloatField()),
+            decayed_at=now,
+            updated=now)
+        updated += len(batch)
+        last_id = recipe_ids[-1]
+    RecipeScore.objects.filter(trending__gt=0,
+                               trending__lt=MIN_TRENDING).update(trending=0)
+    return updated
+
+
+def rebuild_recipe_scores(recipe_ids: list = None,
+                          batch_size: int = SCORE_BATCH_SIZE) -> int:
+    """
+    Пересчет рейтингов по избранному и корзинам, например после
+    массовой загрузки или удаления в обход сигналов. Без recipe_ids
+    пересчитывается весь каталог. Возвращает количество рецептов.
+    """
+    now = timezone.now()
+    recipes = Recipe.objects.order_by('id').values_list('id', flat=True)
+    if recipe_ids is not None:
+        recipes = recipes.filter(id__in=recipe_ids)
+    updated = last_id = 0
+    while True:
+        batch = np.array(list(recipes.filter(id__gt=last_id)[:batch_size]),
+                         dtype=np.int64)
+        if not len(batch):
+            return updated
+        popularity = np.zeros(len(batch), dtype=np.int64)
+        trending = np.zeros(len(batch))
+        for kind, model in SCORE_MODELS:
+            rows = list(model.objects.filter(recipe_id__in=batch.tolist())
+                        .values_list('recipe_id', 'created'))
+            if not rows:
+                continue
+            positions = np.searchsorted(batch, [row[0] for row in rows])
+            ages = np.array([(now - row[1]).total_seconds() for row in rows])
+            np.add.at(popularity, positions, SCORE_WEIGHTS[kind])
+            np.add.at(trending, positions,
+                      SCORE_WEIGHTS[kind] * decay_factor(ages))
+        with transaction.atomic():
+            RecipeScore.objects.filter(recipe_id__in=batch.tolist()).delete()
+            RecipeScore.objects.bulk_create(
+                RecipeScore(recipe_id=recipe_id, popularity=row_popularity,
+                            trending=row_trending, decayed_at=now,
+                            updated=now)
+                for recipe_id, row_popularity, row_trending in zip(
+                    batch.tolist(), popularity.tolist(), trending.tolist()))
+        updated += len(batch)
+        last_id = int(batch[-1])
@@ -0,0 +1,89 @@
+from django.core.cache import cache
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from changes.log import record_changes
+from changes.models import Change
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeScore,
+                            ShoppingCart, Tag, UnitConversion)
+from recipes.scores import add_to_score, remove_from_score
+from recipes.units import UNIT_GRAPH_CACHE_KEY
+from users.models import User
+
+# Поля автора, которые выводятся в ответе с рецептом
+AUTHOR_FIELDS = ('username', 'email', 'first_name', 'last_name')
+
+
+def touch_recipes(recipes) -> None:
+    """
+    Обновляет дату изменения рецептов, в ответе которых выводятся
+    измененные тег, ингредиент или автор: от нее зависят валидаторы
+    условного GET. Изменение записывается в журнал.
+    """
+    ids = list(recipes.values_list('id', flat=True).distinct())
+    if ids:
+        Recipe.objects.filter(id__in=recipes.values('id')).update(
+            updated=timezone.now())
+        record_changes('recipe', ids, Change.UPSERT)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(sender, instance, created, **kwargs):
+    if created:
+        RecipeScore.objects.create(recipe=instance)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(sender, instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(recipe_tag__tag=instance))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(
+            recipe_igredient__ingredient=instance))
+
+
+@receiver(pre_save, sender=User)
+def remember_author_fields(sender, instance, update_fields=None, **kwargs):
+    # Вход пользователя сохраняет только last_login
+    if instance.pk is None or (
+            update_fields is not None
+            and not set(update_fields) & set(AUTHOR_FIELDS)):
+        return
+    instance._author_fields = User.objects.filter(pk=instance.pk).values_list(
+        *AUTHOR_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_author_fields', None)
+    if previous is not None and previous != tuple(
+            getattr(instance, field) for field in AUTHOR_FIELDS):
+        touch_recipes(Recipe.objects.filter(author=instance))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increase_recipe_score(sender, instance, created, **kwargs):
+    if created:
+        kind = 'favorite' if sender is Favorite else 'shopping_cart'
+        add_to_score(kind, instance.recipe_id)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrease_recipe_score(sender, instance, **kwargs):
+    kind = 'favorite' if sender is Favorite else 'shopping_cart'
+    remove_from_score(kind, instance.recipe_id, instance.created)
+
+
+@receiver((post_save, post_delete), sender=UnitConversion)
+def reset_unit_graph_cache(sender, **kwargs):
+    cache.delete(UNIT_GRAPH_CACHE_KEY)
@@ -0,0 +1,456 @@
+import hashlib
+import importlib
+import json
+import os
+import tempfile
+import time
+from fractions import Fraction
+from io import StringIO
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Max
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from changes.models import Change
+from core.storage import ContentAddressedStorage
+from recipes.dedup import (choose_canonical, find_duplicates, is_duplicate,
+                           is_typo, merge_ingredients)
+from recipes.deletion import delete_users
+from recipes.images import (IMAGE_GC_GRACE, collect_image_garbage,
+                            delete_unreferenced, remove_unreferenced,
+                            unreferenced_images)
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeScore, RecipeTag, ShoppingCart, Tag,
+                            UnitConversion)
+from recipes.transfer import import_recipes
+from recipes.units import (MAX_SERVINGS, UNIT_GRAPH_CACHE_KEY, UnitGraph,
+                           get_unit_graph, parse_servings, round_amounts,
+                           scale_amount)
+from users.models import Follow, User
+
+
+class ImportRecipesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(
+            username='author', email='author@example.com', password='author')
+        Tag.objects.create(name='Завтрак', color='#000000', slug='breakfast')
+        Ingredient.objects.create(name='Сахар', measurement_unit='г')
+
+    def line(self, **fields) -> str:
+        item = {'author': 'author', 'name': 'Рецепт', 'text': 'Описание',
+                'cooking_time': 10, 'image': 'recipes/test.png',
+                'tags': ['breakfast'],
+                'ingredients': [{'name': 'сахар', 'measurement_unit': 'г',
+                                 'amount': 100}]}
+        item.update(fields)
+        return json.dumps(item, ensure_ascii=False)
+
+    def test_invalid_rows_are_reported_and_valid_rows_imported(self):
+        lines = [
+            self.line(),
+            self.line(name='x' * 201),
+            self.line(cooking_time=0),
+            self.line(ingredients=[{'name': 'сахар',
+                                    'measurement_unit': 'г', 'amount': 0}]),
+            self.line(author=['author']),
+            self.line(author={'name': 'author'}),
+            self.line(tags=['unknown']),
+            self.line(ingredients=5),
+            self.line(ingredients=[{'name': 'соль',
+                                    'measurement_unit': 'г', 'amount': 1}]),
+            self.line(ingredients=[
+                {'name': 'сахар', 'measurement_unit': 'г', 'amount': 100},
+                {'name': 'Сахар ', 'measurement_unit': 'Г', 'amount': 50}]),
+            'not json',
+            '[]',
+        ]
+        stats = import_recipes(lines, batch_size=4)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['skipped'], len(lines) - 1)
+        self.assertEqual([error['line'] for error in stats['errors']],
+                         list(range(2, len(lines) + 1)))
+        self.assertIn('name', stats['errors'][0]['errors'])
+        self.assertIn('cooking_time', stats['errors'][1]['errors'])
+        self.assertIn('ingredients', stats['errors'][2]['errors'])
+        self.assertEqual(stats['errors'][8]['errors']['ingredients'],
+                         ['Нельзя добавить ингредиент дважды.'])
+        recipe = Recipe.objects.get()
+        self.assertEqual(
+            RecipeIngredient.objects.get(recipe=recipe).amount, 100)
+
+
+class RecipeScoreTests(TestCase):
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN SQLite')
+    def test_latest_update_uses_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            RecipeScore.objects.aggregate(updated=Max('updated'))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'EXPLAIN QUERY PLAN {queries.captured_queries[0]["sql"]}')
+            plan = str(cursor.fetchall())
+        self.assertIn('recipe_score_updated', plan)
+
+
+class DeleteUsersTests(TestCase):
+
+    def test_stats_after_batched_unfollows(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='author')
+        for number in range(3):
+            follower = User.objects.create_user(
+                username=f'follower{number}', email=f'f{number}@example.com',
+                password='follower')
+            Follow.objects.create(user=follower, author=author)
+        Recipe.objects.create(author=author, name='Рецепт', text='Описание',
+                              cooking_time=10, image='recipes/test.png')
+        start = time.perf_counter()
+        stats = delete_users(User.objects.filter(id=author.id), batch_size=1)
+        elapsed = time.perf_counter() - start
+        self.assertEqual((stats['users'], stats['recipes']), (1, 1))
+        self.assertEqual(Change.objects.filter(
+            model='follow', action=Change.DELETE).count(), 3)
+        # Время считается от начала удаления, а не от номера пачки
+        self.assertTrue(0 <= stats['seconds'] <= elapsed + 0.001)
+
+
+class UnitGraphTests(SimpleTestCase):
+
+    def setUp(self):
+        self.graph = UnitGraph({
+            'г': ('г', 1), 'кг': ('г', 1000),
+            'мл': ('мл', 1), 'л': ('мл', 1000), 'Ст.Л.': ('мл', 15),
+            'капля': ('мл', 0.05), 'бутылка': ('л', 0.5),
+        })
+
+    def test_chained_conversion(self):
+        bottle = self.graph.unit('бутылка')
+        self.assertEqual((bottle.base, bottle.factor), ('мл', 500))
+        self.assertEqual(self.graph.convert(3, 'бутылка', 'л'),
+                         Fraction(3, 2))
+        self.assertEqual(self.graph.convert(1, 'ст.  л.', 'мл'), 15)
+        self.assertEqual(self.graph.unit('капля').factor, Fraction(1, 20))
+
+    def test_missing_path(self):
+        with self.assertRaises(ValueError):
+            self.graph.convert(1, 'кг', 'л')
+        with self.assertRaises(ValueError):
+            self.graph.convert(1, 'шт.', 'г')
+        unknown = self.graph.unit('Пучок')
+        self.assertEqual((unknown.base, unknown.countable), ('пучок', True))
+
+    def test_cycle_stops(self):
+        graph = UnitGraph({'a': ('b', 2), 'b': ('a', 3)})
+        self.assertEqual(graph.unit('a').base, 'b')
+        self.assertEqual(graph.unit('b').base, 'a')
+
+    def test_scale_amount_rounding(self):
+        gram, piece = self.graph.unit('г'), self.graph.unit('шт.')
+        cases = (
+            (100, Fraction(3, 2), gram, 150),
+            (1, Fraction(1, 3), gram, 0.35),
+            (1, Fraction(13, 5), gram, 2.5),
+            (5, Fraction(5, 2), gram, 12),
+            (1, Fraction(1, 100), gram, 0.05),
+            (1, Fraction(13, 10), piece, 1.5),
+            (1, Fraction(1, 10), piece, 0.5),
+        )
+        for amount, servings, unit, expected in cases:
+            with self.subTest(amount=amount, servings=servings):
+                self.assertEqual(scale_amount(amount, servings, unit),
+                                 expected)
+        self.assertIsInstance(scale_amount(100, Fraction(3, 2), gram), int)
+
+    def test_round_amounts(self):
+        values = np.array([0.33, 2.6, 12.4, 0.01, 0, 1.3])
+        countable = np.array([False] * 5 + [True])
+        np.testing.assert_array_equal(
+            round_amounts(values, countable),
+            [0.35, 2.5, 12, 0.05, 0, 1.5])
+
+    def test_batch_path_matches_scalar(self):
+        rng = np.random.default_rng(0)
+        names = ['г', 'кг', 'л', 'ст. л.', 'капля', 'бутылка', 'шт.']
+        amounts = rng.uniform(0, 50, 500)
+        units = rng.choice(names, 500)
+        values, bases, countable = self.graph.to_base(amounts, units)
+        rounded = round_amounts(values, countable)
+        for index, (amount, name) in enumerate(zip(amounts, units)):
+            unit = self.graph.unit(name)
+            exact = Fraction(amount) * unit.factor
+            self.assertEqual(bases[index], unit.base)
+            self.assertEqual(countable[index], unit.countable)
+            self.assertAlmostEqual(values[index], float(exact))
+            self.assertAlmostEqual(rounded[index], float(unit.round(exact)))
+
+    def test_parse_servings(self):
+        self.assertEqual(parse_servings(' 3/2 '), Fraction(3, 2))
+        self.assertEqual(parse_servings('1.5'), Fraction(3, 2))
+        self.assertEqual(parse_servings(str(MAX_SERVINGS)), MAX_SERVINGS)
+        for value in ('', 'abc', '1/0', '0', '-1', 'nan', 'inf',
+                      str(MAX_SERVINGS + 1)):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_servings(value)
+
+
+class UnitGraphCacheTests(TestCase):
+
+    def test_conversion_change_resets_cache(self):
+        cache.delete(UNIT_GRAPH_CACHE_KEY)
+        self.assertEqual(get_unit_graph().convert(2, 'кг', 'г'), 2000)
+        UnitConversion.objects.create(unit='банка', base_unit='г',
+                                      factor=400)
+        self.assertEqual(get_unit_graph().convert(1, 'банка', 'кг'),
+                         Fraction(2, 5))
+
+
+class DeduplicationTests(TestCase):
+
+    def test_is_typo(self):
+        cases = (
+            ('молоко', 'малоко', True),
+            ('сметана', 'смеатна', True),
+            ('сметана', 'сметаана', True),
+            ('вода', 'водка', False),
+            ('молоко', 'маликo', False),
+            ('сметана', 'сметанка', True),
+            ('сметана', 'стмеанаа', False),
+        )
+        for first, second, expected in cases:
+            with self.subTest(first=first, second=second):
+                self.assertIs(is_typo(first, second), expected)
+
+    def test_is_duplicate(self):
+        cases = (
+            ('молоко коровье', 'малоко коровье', True),
+            ('молоко 2,5%', 'молоко 1,5%', False),
+            ('жирный творог', 'нежирный творог', False),
+            ('молоко', 'молоко коровье', False),
+        )
+        for first, second, expected in cases:
+            with self.subTest(first=first, second=second):
+                self.assertIs(is_duplicate(first, second, 0.85), expected)
+
+    def test_blocking(self):
+        rows = [(1, 'Молоко коровье', 'мл'), (2, 'молоко каровье', 'мл'),
+                (3, 'Молоко коровье', 'г'), (4, 'Малоко коровье', 'мл'),
+                (5, 'Сметана', 'г')]
+        # Одна единица и общее начало из prefix символов
+        self.assertEqual(find_duplicates(rows, 0.85, prefix=3), [[1, 2]])
+        self.assertEqual(find_duplicates(rows, 0.85, prefix=1), [[1, 2, 4]])
+
+    def test_merge_sums_amounts_and_repoints_links(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='author')
+        first, second, third = (
+            Recipe.objects.create(author=author, name=f'Рецепт {number}',
+                                  text='Описание', cooking_time=10,
+                                  image='recipes/test.png')
+            for number in range(3))
+        milk = Ingredient.objects.create(name='Молоко', measurement_unit='мл')
+        typo = Ingredient.objects.create(name='Малоко', measurement_unit='мл')
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=first, ingredient=milk, amount=100),
+            RecipeIngredient(recipe=first, ingredient=typo, amount=50),
+            RecipeIngredient(recipe=second, ingredient=typo, amount=30),
+            RecipeIngredient(recipe=third, ingredient=typo, amount=20),
+        ])
+        # Основной ингредиент - с наибольшим числом рецептов
+        canonical = choose_canonical([[milk.id, typo.id]])
+        self.assertEqual(canonical, {milk.id: typo.id})
+        recipes = merge_ingredients(canonical)
+
+        self.assertEqual(recipes, [first.id])
+        self.assertFalse(Ingredient.objects.filter(id=milk.id).exists())
+        self.assertEqual(
+            sorted(RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id', 'amount')),
+            [(first.id, typo.id, 150), (second.id, typo.id, 30),
+             (third.id, typo.id, 20)])
+        self.assertTrue(Change.objects.filter(
+            model='recipe', object_id=first.id,
+            action=Change.UPSERT).exists())
+
+    def test_migration_merges_exact_duplicates(self):
+        migration = importlib.import_module(
+            'recipes.migrations.0011_ingredient_normalized_data')
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='author')
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание', cooking_time=10,
+            image='recipes/test.png')
+        other = Recipe.objects.create(
+            author=author, name='Другой', text='Описание', cooking_time=10,
+            image='recipes/test.png')
+        sugar = Ingredient.objects.create(name='Сахар', measurement_unit='г')
+        copy = Ingredient.objects.create(name='копия', measurement_unit='г')
+        # Ключ, сохраненный до нормализации
+        Ingredient.objects.filter(id=copy.id).update(
+            name='«САХАР» ', measurement_unit='Г')
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient=sugar, amount=10),
+            RecipeIngredient(recipe=recipe, ingredient=copy, amount=5),
+            RecipeIngredient(recipe=other, ingredient=copy, amount=7),
+        ])
+        with CaptureQueriesContext(connection) as queries:
+            migration.merge_exact_duplicates(apps, None)
+        # Обе измененные связи обновляются одним запросом
+        updates = [query['sql'] for query in queries
+                   if query['sql'].startswith('UPDATE')
+                   and RecipeIngredient._meta.db_table in query['sql']]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(list(Ingredient.objects.values_list('id', flat=True)),
+                         [sugar.id])
+        self.assertEqual(
+            sorted(RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id', 'amount')),
+            [(recipe.id, sugar.id, 15), (other.id, sugar.id, 7)])
+        self.assertFalse(migration.Migration.operations[0].reversible)
+
+
+class GenerateFakeDataTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}',
+                       normalized_name=f'ингредиент {number}',
+                       measurement_unit='г')
+            for number in range(20))
+
+    def generate(self, *args) -> str:
+        output = StringIO()
+        call_command('generate_fake_data', '--users', '20', '--recipes', '50',
+                     '--batch-size', '7', *args, stdout=output)
+        return output.getvalue()
+
+    def test_reported_counts_match_inserted_rows(self):
+        output = self.generate()
+        for model in (User, Tag, Recipe, RecipeIngredient, RecipeTag,
+                      Favorite, ShoppingCart, Follow):
+            with self.subTest(model=model.__name__):
+                self.assertIn(f'{model.__name__}: {model.objects.count()}\n',
+                              output)
+
+    def test_invalid_arguments(self):
+        for args in (('--favorites', '-1'), ('--follows', '-2'),
+                     ('--batch-size', '0'), ('--users', '0')):
+            with self.subTest(args=args), self.assertRaises(CommandError):
+                self.generate(*args)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_conflict_rolls_back(self):
+        User.objects.create_user(username='fake2', email='taken@example.com')
+        with self.assertRaises(CommandError):
+            self.generate()
+        self.assertEqual(User.objects.count(), 1)
+        self.assertFalse(Recipe.objects.exists())
+
+
+class ImageStorageTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentAddressedStorage(location=directory.name)
+        patcher = mock.patch.object(
+            Recipe._meta.get_field('image'), 'storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='author')
+
+    def save(self, content: bytes, name: str = 'recipes/photo.png',
+             age: int = 0) -> str:
+        """Сохраняет картинку, age - сколько секунд назад ее загрузили."""
+        name = self.storage.save(name, ContentFile(content))
+        if age:
+            modified = time.time() - age
+            os.utime(self.storage.path(name), (modified, modified))
+        return name
+
+    def create_recipe(self, image: str) -> Recipe:
+        return Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=10, image=image)
+
+    def test_name_is_content_hash(self):
+        digest = hashlib.sha256(b'first').hexdigest()
+        name = self.save(b'first', 'recipes/Photo.PNG')
+        self.assertEqual(name, f'recipes/{digest[:2]}/{digest}.png')
+        self.assertEqual(self.save(b'first', 'recipes/other.png'), name)
+        self.assertNotEqual(self.save(b'second'), name)
+        with self.storage.open(name) as image:
+            self.assertEqual(image.read(), b'first')
+
+    def test_same_content_refreshes_modified_time(self):
+        name = self.save(b'image', age=2 * IMAGE_GC_GRACE)
+        self.assertEqual(self.save(b'image'), name)
+        self.assertEqual(list(self.storage.walk('recipes')), [name])
+        age = time.time() - os.path.getmtime(self.storage.path(name))
+        self.assertLess(age, IMAGE_GC_GRACE)
+
+    def test_referenced_images_are_kept(self):
+        used = self.save(b'used', age=2 * IMAGE_GC_GRACE)
+        unused = self.save(b'unused', age=2 * IMAGE_GC_GRACE)
+        self.create_recipe(used)
+        self.assertEqual(unreferenced_images([used, unused, '']), [unused])
+        self.assertEqual(remove_unreferenced([used, unused]), [unused])
+        self.assertTrue(self.storage.exists(used))
+        self.assertFalse(self.storage.exists(unused))
+
+    def test_recent_images_are_kept(self):
+        recent = self.save(b'recent')
+        old = self.save(b'old', age=2 * IMAGE_GC_GRACE)
+        self.assertEqual(unreferenced_images([recent, old]), [old])
+        self.assertEqual(unreferenced_images([recent, old], grace=0),
+                         sorted([old, recent]))
+        stats = collect_image_garbage(batch_size=1)
+        self.assertEqual((stats['files'], stats['removed']), (2, 1))
+        self.assertEqual(stats['bytes'], len(b'old'))
+        self.assertEqual(list(self.storage.walk('recipes')), [recent])
+
+    def test_dry_run_keeps_files(self):
+        name = self.save(b'old', age=2 * IMAGE_GC_GRACE)
+        stats = collect_image_garbage(dry_run=True)
+        self.assertEqual(stats['removed'], 1)
+        self.assertTrue(self.storage.exists(name))
+
+    def test_references_are_checked_again_before_delete(self):
+        name = self.save(b'image', age=2 * IMAGE_GC_GRACE)
+        self.assertEqual(unreferenced_images([name]), [name])
+        # Рецепт с той же картинкой сохранен после выбора кандидатов
+        self.create_recipe(name)
+        self.assertFalse(delete_unreferenced(name))
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(list(self.storage.walk('recipes')), [name])
+
+    def test_upload_during_delete_is_kept(self):
+        name = self.save(b'image', age=2 * IMAGE_GC_GRACE)
+
+        def upload_during_check(checked, modified):
+            # Загрузка того же содержимого, пока файл проверяется
+            self.assertEqual(self.save(b'image'), name)
+            return False
+
+        self.assertTrue(self.storage.delete_unused(name, upload_during_check))
+        self.assertEqual(list(self.storage.walk('recipes')), [name])
+        with self.storage.open(name) as image:
+            self.assertEqual(image.read(), b'image')
+
+    def test_upload_before_delete_is_kept(self):
+        name = self.save(b'image', age=2 * IMAGE_GC_GRACE)
+        self.assertEqual(unreferenced_images([name]), [name])
+        # Загрузка после выбора кандидатов обновила время изменения
+        self.save(b'image')
+        self.assertFalse(delete_unreferenced(name))
+        self.assertEqual(list(self.storage.walk('recipes')), [name])
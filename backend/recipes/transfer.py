@@ -0,0 +1,209 @@
+import json
+from itertools import islice
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.db.models import Prefetch
+
+from changes.log import record_changes
+from changes.models import Change
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeScore,
+                            RecipeTag, Tag)
+from recipes.normalize import normalize_name, normalize_unit
+from recipes.nutrition import update_recipe_totals
+from users.models import User
+
+TRANSFER_BATCH_SIZE = settings.TRANSFER_BATCH_SIZE
+TRANSFER_MAX_ERRORS = settings.TRANSFER_MAX_ERRORS
+
+
+def bulk_create_returning(model: models.Model, objs: list) -> list:
+    """
+    bulk_create с заполнением первичных ключей. Если база не умеет
+    возвращать id из INSERT (SQLite в Django 3.2), объекты
+    сохраняются по одному.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objs)
+    for obj in objs:
+        obj.save(force_insert=True)
+    return objs
+
+
+def export_recipes(batch_size: int = TRANSFER_BATCH_SIZE) -> Iterator[str]:
+    """
+    Построчный экспорт рецептов в JSON Lines. Рецепты читаются
+    пачками по id, поэтому память не зависит от размера каталога.
+    """
+    recipes = (Recipe.objects.select_related('author').order_by('id')
+               .prefetch_related(
+                   Prefetch('recipe_igredient',
+                            queryset=RecipeIngredient.objects
+                            .select_related('ingredient')),
+                   Prefetch('recipe_tag',
+                            queryset=RecipeTag.objects
+                            .select_related('tag'))))
+    last_id = 0
+    while True:
+        batch = list(recipes.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        for recipe in batch:
+            yield json.dumps({
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'image': recipe.image.name,
+                'author': recipe.author.username,
+                'tags': [link.tag.slug for link in recipe.recipe_tag.all()],
+                'ingredients': [
+                    {'name': link.ingredient.name,
+                     'measurement_unit': link.ingredient.measurement_unit,
+                     'amount': link.amount}
+                    for link in recipe.recipe_igredient.all()],
+            }, ensure_ascii=False) + '\n'
+        last_id = batch[-1].id
+
+
+def import_recipes(lines: Iterable[str],
+                   batch_size: int = TRANSFER_BATCH_SIZE) -> dict:
+    """
+    Пакетный импорт рецептов из JSON Lines. Авторы ищутся по username,
+    теги по slug, ингредиенты по нормализованным названию и единице.
+    Каждая строка проверяется валидаторами моделей, отклоненные
+    строки пропускаются и попадают в errors с номером строки
+    (первые TRANSFER_MAX_ERRORS).
+    """
+    # Справочники загружаются один раз на весь импорт
+    ingredients = {
+        (name, unit): ingredient_id for ingredient_id, name, unit
+        in Ingredient.objects.values_list(
+            'id', 'normalized_name', 'measurement_unit')}
+    tags = dict(Tag.objects.values_list('slug', 'id'))
+    authors = {}
+    stats = {'created': 0, 'skipped': 0, 'errors': []}
+
+    lines = enumerate(lines, start=1)
+    while True:
+        chunk = list(islice(lines, batch_size))
+        if not chunk:
+            return stats
+        items = []
+        for number, line in chunk:
+            if not line.strip():
+                continue
+            try:
+                items.append((number, json.loads(line)))
+            except ValueError:
+                items.append((number, None))
+
+        usernames = {item.get('author') for _, item in items
+                     if isinstance(item, dict)
+                     and isinstance(item.get('author'), str)}
+        authors.update(User.objects.filter(
+            username__in=usernames - authors.keys())
+            .values_list('username', 'id'))
+        created, errors = _import_batch(items, authors, tags, ingredients)
+        stats['created'] += created
+        stats['skipped'] += len(errors)
+        stats['errors'].extend(
+            errors[:TRANSFER_MAX_ERRORS - len(stats['errors'])])
+
+
+def build_recipe(item, authors: dict, tags: dict,
+                 ingredients: dict) -> tuple:
+    """
+    Рецепт и его связи (id тегов, [(id ингредиента, количество)])
+    из строки импорта. Поля проверяются валидаторами моделей,
+    повтор ингредиента отклоняется, как в RecipeWriteSerializer.
+    ValidationError - строка отклоняется.
+    """
+    if not isinstance(item, dict):
+        raise ValidationError('Строка должна быть объектом JSON.')
+    errors = {}
+    for field in ('author', 'name', 'text', 'image'):
+        if not isinstance(item.get(field), str):
+            errors[field] = 'Ожидается строка.'
+    if errors:
+        raise ValidationError(errors)
+    if item['author'] not in authors:
+        raise ValidationError({'author': 'Неизвестный автор.'})
+    recipe = Recipe(author_id=authors[item['author']], name=item['name'],
+                    text=item['text'], cooking_time=item.get('cooking_time'),
+                    image=item['image'])
+    try:
+        recipe.clean_fields(exclude=('author',))
+    except ValidationError as error:
+        errors.update(error.message_dict)
+
+    slugs = item.get('tags')
+    if (not isinstance(slugs, list)
+            or not all(isinstance(slug, str) and slug in tags
+                       for slug in slugs)):
+        errors['tags'] = 'Ожидается список известных slug тегов.'
+
+    recipe_ingredients, rows = [], item.get('ingredients')
+    if not isinstance(rows, list):
+        errors['ingredients'] = 'Ожидается список ингредиентов.'
+        rows = []
+    for ingredient in rows:
+        try:
+            key = (normalize_name(ingredient['name']),
+                   normalize_unit(ingredient['measurement_unit']))
+            link = RecipeIngredient(ingredient_id=ingredients[key],
+                                    amount=ingredient['amount'])
+            link.clean_fields(exclude=('recipe', 'ingredient'))
+        except (KeyError, TypeError, AttributeError):
+            errors['ingredients'] = (
+                'Ожидается список известных ингредиентов '
+                'с name, measurement_unit и amount.')
+            break
+        except ValidationError as error:
+            errors['ingredients'] = error.messages
+            break
+        if any(link.ingredient_id == ingredient_id
+               for ingredient_id, _ in recipe_ingredients):
+            errors['ingredients'] = 'Нельзя добавить ингредиент дважды.'
+            break
+        recipe_ingredients.append((link.ingredient_id, link.amount))
+    if errors:
+        raise ValidationError(errors)
+    return recipe, ([tags[slug] for slug in slugs], recipe_ingredients)
+
+
+def _import_batch(items: list, authors: dict, tags: dict,
+                  ingredients: dict) -> tuple:
+    recipes, links, errors = [], [], []
+    for number, item in items:
+        try:
+            recipe, recipe_links = build_recipe(item, authors, tags,
+                                                ingredients)
+        except ValidationError as error:
+            errors.append({'line': number, 'errors': (
+                error.message_dict if hasattr(error, 'error_dict')
+                else error.messages)})
+            continue
+        recipes.append(recipe)
+        links.append(recipe_links)
+
+    with transaction.atomic():
+        bulk_create_returning(Recipe, recipes)
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag_id=tag_id)
+            for recipe, (tag_ids, _) in zip(recipes, links)
+            for tag_id in set(tag_ids))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for recipe, (_, recipe_ingredients) in zip(recipes, links)
+            for ingredient_id, amount in recipe_ingredients)
+        # Рейтинги создаются сигналом post_save, которого у bulk_create нет
+        RecipeScore.objects.bulk_create(
+            [RecipeScore(recipe=recipe) for recipe in recipes],
+            ignore_conflicts=True)
+        update_recipe_totals([recipe.id for recipe in recipes])
+        record_changes('recipe', [recipe.id for recipe in recipes],
+                       Change.UPSERT)
+    return len(recipes), errors
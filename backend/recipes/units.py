@@ -0,0 +1,145 @@
+from dataclasses import dataclass
+from fractions import Fraction
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import UnitConversion
+from recipes.normalize import normalize_unit
+
+UNIT_GRAPH_CACHE_KEY = 'unit_graph'
+UNIT_GRAPH_CACHE_TIMEOUT = settings.UNIT_GRAPH_CACHE_TIMEOUT
+MAX_SERVINGS = settings.MAX_SERVINGS
+# Шаги округления: количества меньше 1 - до 0.05, меньше 10 -
+# до четвертей, остальные - до целых. Штучные единицы
+# (без перевода в базовую) - до половинок
+ROUNDING_STEPS = ((1, Fraction(1, 20)), (10, Fraction(1, 4)))
+COUNT_STEP = Fraction(1, 2)
+# Знаменатель коэффициентов из UnitConversion (0.05 -> 1/20)
+MAX_DENOMINATOR = 1000
+
+
+def as_number(value: Fraction):
+    """Целое, если дробной части нет, иначе float."""
+    return int(value) if value.denominator == 1 else float(value)
+
+
+@dataclass(frozen=True)
+class Unit:
+    """
+    Единица измерения: factor базовых единиц base в одной единице.
+    Единицы без перевода (шт., пучок) считаются штучными
+    и служат базовыми сами для себя.
+    """
+    name: str
+    base: str
+    factor: Fraction = Fraction(1)
+    countable: bool = True
+
+    def step(self, amount: Fraction) -> Fraction:
+        """Шаг округления количества amount."""
+        if self.countable:
+            return COUNT_STEP
+        for limit, step in ROUNDING_STEPS:
+            if amount < limit:
+                return step
+        return Fraction(1)
+
+    def round(self, amount: Fraction) -> Fraction:
+        """
+        Округление до шага, ненулевое количество не округляется до нуля.
+        """
+        step = self.step(amount)
+        rounded = round(amount / step) * step
+        return rounded if rounded or not amount else step
+
+
+class UnitGraph:
+    """
+    Граф переводов из UnitConversion: ребро unit -> base_unit
+    с коэффициентом factor. Цепочки (бутылка -> л -> мл)
+    сворачиваются в перевод сразу в конечную единицу.
+    """
+
+    def __init__(self, edges: dict):
+        edges = {normalize_unit(unit): (normalize_unit(base), factor)
+                 for unit, (base, factor) in edges.items()}
+        self.units = {unit: self.resolve(unit, edges) for unit in edges}
+
+    @staticmethod
+    def resolve(name: str, edges: dict) -> Unit:
+        factor, unit, seen = Fraction(1), name, {name}
+        while unit in edges:
+            base, step = edges[unit]
+            if base in seen:
+                break
+            factor *= Fraction(step).limit_denominator(MAX_DENOMINATOR)
+            unit = base
+            seen.add(unit)
+        return Unit(name, unit, factor, countable=False)
+
+    def unit(self, name: str) -> Unit:
+        normalized = normalize_unit(name)
+        return self.units.get(normalized) or Unit(normalized, normalized)
+
+    def convert(self, amount, source: str, target: str) -> Fraction:
+        """Количество amount единиц source в единицах target."""
+        source, target = self.unit(source), self.unit(target)
+        if source.base != target.base:
+            raise ValueError(
+                f'Нельзя перевести {source.name} в {target.name}.')
+        return Fraction(amount) * source.factor / target.factor
+
+    def to_base(self, amounts, units) -> tuple:
+        """
+        Пакетный перевод в базовые единицы: каждая единица
+        разбирается один раз, умножение выполняется над массивом.
+        Возвращает (количества, базовые единицы, признаки штучных).
+        """
+        names, inverse = np.unique(np.asarray(units, dtype=str),
+                                   return_inverse=True)
+        parsed = [self.unit(name) for name in names]
+        factors = np.array([float(unit.factor) for unit in parsed])
+        bases = np.array([unit.base for unit in parsed], dtype=object)
+        countable = np.array([unit.countable for unit in parsed], dtype=bool)
+        values = np.asarray(amounts, dtype=np.float64) * factors[inverse]
+        return values, bases[inverse], countable[inverse]
+
+
+def round_amounts(values: np.ndarray, countable: np.ndarray) -> np.ndarray:
+    """Векторный вариант Unit.round для массива количеств."""
+    steps = np.select([values < limit for limit, _ in ROUNDING_STEPS],
+                      [float(step) for _, step in ROUNDING_STEPS], 1.0)
+    steps = np.where(countable, float(COUNT_STEP), steps)
+    # Второе округление убирает хвосты вида 0.30000000000000004
+    rounded = np.round(np.round(values / steps) * steps, 2)
+    return np.where((rounded == 0) & (values > 0), steps, rounded)
+
+
+def get_unit_graph() -> UnitGraph:
+    """Граф переводов, кешируется до изменения UnitConversion."""
+    graph = cache.get(UNIT_GRAPH_CACHE_KEY)
+    if graph is None:
+        graph = UnitGraph({
+            unit: (base_unit, factor) for unit, base_unit, factor
+            in UnitConversion.objects.values_list(
+                'unit', 'base_unit', 'factor')})
+        cache.set(UNIT_GRAPH_CACHE_KEY, graph, UNIT_GRAPH_CACHE_TIMEOUT)
+    return graph
+
+
+def parse_servings(value: str) -> Fraction:
+    """Множитель порций: '2', '1.5' или '3/2', от 0 до MAX_SERVINGS."""
+    try:
+        servings = Fraction(value.strip())
+    except (ValueError, ZeroDivisionError):
+        raise ValueError('Укажите число порций: 2, 1.5 или 3/2.')
+    if not 0 < servings <= MAX_SERVINGS:
+        raise ValueError(f'Число порций от 0 до {MAX_SERVINGS}.')
+    return servings.limit_denominator(MAX_SERVINGS)
+
+
+def scale_amount(amount, servings: Fraction, unit: Unit):
+    """Количество ингредиента на servings порций с округлением."""
+    return as_number(unit.round(Fraction(amount) * servings))
@@ -2,12 +2,28 @@ from django.contrib import admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 
+from recipes.deletion import delete_users
+from recipes.paginators import EstimatedCountPaginator
+
 User = get_user_model()
 
 
 class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff')
-    list_filter = ('username', 'email')
+    list_filter = ('is_staff', 'is_active')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('bulk_delete',)
+
+    @admin.action(description='Быстро удалить выбранных пользователей',
+                  permissions=('delete',))
+    def bulk_delete(self, request, queryset):
+        """Удаление с рецептами, избранным и подписками пачками."""
+        stats = delete_users(queryset)
+        self.message_user(
+            request, f'Удалено пользователей: {stats["users"]}, рецептов: '
+            f'{stats["recipes"]}, связей: {stats["links"]} '
+            f'за {stats["seconds"]} с.')
 
 
 admin.site.unregister(User)